@@ -6,29 +6,105 @@ Runs the Flask Application for the UW Course Planner Web App.
 
 
 import re
-import json
 import os
 import uwtools
 import pandas as pd
-from create_tree import create_tree, graph_department
-from schedule import get_combinations
+import json
+import math
+from catalog_index import CatalogIndex
+from create_tree import CACHE as TREE_CACHE, FAILED, PENDING, create_tree, graph_department, post_requisites
+from http_cache import IMMUTABLE, Payload, PayloadCache, respond
+from cursors import CursorStore
+from keyword_index import KeywordIndex
+from refresh import Refresher, Watcher
+from planner import QUARTERS, Offerings, make_plan
+from prereq_graph import PrereqGraph, REQUISITE_TYPES
+from schedule import RANK_WEIGHTS, count_combinations, rank_combinations
 from schedule import main as check_schedules
-from flask import Flask, redirect, url_for, render_template, jsonify, request
+from schedule_store import LOAD_ERRORS, ScheduleStore, is_quarter
+from metrics import REGISTRY, init_app, timed
+from snapshot import load as load_data
+from flask import Flask, abort, redirect, url_for, render_template, jsonify, request, session
 
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = '\xfaz\xc3\xa8\xd6\xb8\xa0>\x89\x80b'
+# Request latency, '/metrics' and profiling of slow requests (see metrics.py)
+init_app(app)
 
 PATH = os.path.join(os.getcwd(), 'static')
 
-CATALOGS = pd.read_csv(os.path.join(PATH, 'Course_Catalogs.csv'), dtype=str, index_col=0).fillna('')
-with open(os.path.join(PATH, 'departments.json'), mode='r') as f:
-    UW_DEPARTMENTS = json.loads(f.read())
-with open(os.path.join(PATH, 'geocode.json'), mode='r') as f:
-    GEOCODED = json.loads(f.read())
-# Used to check courses entered in MyMap to verify they are actually offered that quarter
-with open(os.path.join(PATH, 'Time_Schedules.json'), mode='r') as f:
-    TIME_SCHEDULE = json.loads(f.read())
+# Loaded from the compiled snapshot if it is up to date ('python snapshot.py build')
+CATALOGS, UW_DEPARTMENTS, GEOCODED, time_schedule, keyword_postings = load_data(PATH)
+# Course and department lookups of the course and department pages
+CATALOG_INDEX = CatalogIndex(CATALOGS, UW_DEPARTMENTS)
+KEYWORD_INDEX = KeywordIndex(CATALOGS, CATALOG_INDEX.records, keyword_postings)
+PREREQ_GRAPH = PrereqGraph.load(CATALOGS, os.path.join(PATH, 'Course_Catalogs.csv'))
+# Scrapes new Course Catalogs and Time Schedules in the background (see refresh.py)
+REFRESHER = Refresher(PATH)
+# Courses offered in every quarter with a Time Schedule, used by the degree planner
+OFFERINGS = Offerings(PATH)
+# Compiled Time Schedules by quarter. Also used to check courses entered in MyMap to verify
+# they are actually offered that quarter.
+SCHEDULES = ScheduleStore(PATH)
+SCHEDULES.add(time_schedule)
+# Schedule searches of MyMap users. The search state is kept in the session of the user.
+CURSORS = CursorStore(SCHEDULES)
+# Maximum number of schedules returned by '/get_schedules/' at once
+MAX_SCHEDULES = 100
+# Serialized and gzipped bodies of the responses that only change with the data
+PAYLOADS = PayloadCache()
+GEOCODE_PAYLOAD = Payload(json.dumps({'coords': GEOCODED}, separators=(',', ':')), 'application/json')
+
+
+def load_catalogs():
+    # Loads the Course Catalogs again and swaps in everything built from them
+    global CATALOGS, KEYWORD_INDEX, CATALOG_INDEX, PREREQ_GRAPH
+    file_path = os.path.join(PATH, 'Course_Catalogs.csv')
+    catalogs = pd.read_csv(file_path, dtype=str, index_col=0).fillna('')
+    catalog_index = CatalogIndex(catalogs, UW_DEPARTMENTS)
+    keyword_index = KeywordIndex(catalogs, catalog_index.records)
+    # Trees of the previous Course Catalogs are no longer reachable since the catalog version is
+    # part of their cache key. They are kept so 'prerender.py' can reuse the unchanged ones.
+    prereq_graph = PrereqGraph.load(catalogs, file_path)
+    CATALOGS, KEYWORD_INDEX, CATALOG_INDEX, PREREQ_GRAPH = catalogs, keyword_index, catalog_index, prereq_graph
+
+
+# Every worker loads the Course Catalogs again once any worker replaced them
+CATALOG_WATCHER = Watcher(os.path.join(PATH, 'Course_Catalogs.csv'), load_catalogs)
+
+
+@app.before_request
+def check_catalogs():
+    CATALOG_WATCHER.check()
+
+
+@REGISTRY.collector
+def cache_stats():
+    # Sizes and hit rates of the in-memory caches, read when '/metrics' is served
+    conflicts = SCHEDULES.get().conflicts.stats()
+    return [
+        ('uwcp_conflict_cache_entries', 'Conflict matrices cached for the current quarter', conflicts['entries']),
+        ('uwcp_conflict_cache_hits', 'Conflict matrix cache hits for the current quarter', conflicts['hits']),
+        ('uwcp_conflict_cache_misses', 'Conflict matrix cache misses for the current quarter', conflicts['misses']),
+        ('uwcp_conflict_cache_build_seconds', 'Time spent building conflict matrices', conflicts['build_time']),
+        ('uwcp_schedule_cursors', 'Schedule cursors kept in memory', len(CURSORS.cursors)),
+        ('uwcp_tree_cache_files', 'Prerequisite Tree SVGs in the cache', len(TREE_CACHE.index)),
+        ('uwcp_tree_cache_bytes', 'Size of the Prerequisite Tree SVGs in the cache', TREE_CACHE.size),
+    ]
+
+
+def page_tree(svg, name):
+    """Splits a tree rendered with wait=False into what the course and department pages show
+    @params
+        'svg': Path of the SVG, PENDING, FAILED or None (see 'render_cached')
+        'name': The course or department of the tree
+    Returns
+        Dictionary with the path of the SVG, if it is rendered already, and the name the page
+        asks '/_get_tree/' for while the tree is still being rendered
+    """
+    rendered = svg not in (PENDING, FAILED)
+    return {'svg': svg if rendered else None, 'pending': name if svg == PENDING else None}
 
 
 @app.route('/')
@@ -52,14 +128,16 @@ def get_transcript():
 def search():
     # Search used for the Search Bar in right corner of the Nav Bar
     course = request.form['name'].upper().replace(' ', '')
-    if course in CATALOGS.index:
+    if course in CATALOG_INDEX:
         # Create the Prerequisite Tree if necessary for the course page
-        svg = create_tree(CATALOGS, course, request.url_root)
+        tree = page_tree(create_tree(PREREQ_GRAPH, course, url_for('index'), wait=False), course)
+        with timed('catalog_lookup'):
+            course_data = CATALOG_INDEX.record(course)
         return render_template(
             'course.html',
-            svg=svg,
+            **tree,
             course=course,
-            course_data=CATALOGS.loc[course].to_dict()
+            course_data=course_data
         )
     return redirect(url_for('index'))
 
@@ -72,61 +150,108 @@ def _get_tree():
     search_course = course.endswith('SEARCHCOURSE')
     course = course.replace('SEARCHCOURSE', '', 1)
     if re.search(r'[A-Z]+', course) and not re.search(r'\d{3}', course):
-        if course in {c for v in UW_DEPARTMENTS.values() for c in v}:
+        if CATALOG_INDEX.is_department(course):
             img = graph_department(
-                CATALOGS[CATALOGS['Department Name'] == course],
+                PREREQ_GRAPH,
                 course,
-                request.url_root
+                url_for('index'),
+                wait=False
             ) if not search_course else course
         else:
             # ND -> Not a Department
             img = f'ND {course}'
-    elif course in CATALOGS.index:
-        if CATALOGS.loc[course, 'Prerequisites'] or CATALOGS.loc[course, 'Co-Requisites']:
-            img = create_tree(CATALOGS, course, request.url_root) if not search_course else course
+    elif course in CATALOG_INDEX:
+        record = CATALOG_INDEX.records[course]
+        if record['Prerequisites'] or record['Co-Requisites']:
+            img = create_tree(PREREQ_GRAPH, course, url_for('index'), wait=False) if not search_course else course
         else:
             # NP -> No Prerequisites
             img = f'NP {course}'
     else:
         # NA -> Not Available
         img = f'NA {course}' if course else ''
+    if img == PENDING:
+        # PENDING -> The tree is still being rendered, the client asks again
+        img = f'PENDING {course}'
+    elif img == FAILED:
+        # FAILED -> The tree could not be rendered
+        img = f'FAILED {course}'
+    return jsonify({'data': img})
+
+
+@app.route('/_get_post_tree/', methods=['POST'])
+def _get_post_tree():
+    # Used to generate trees of all courses that require a course
+    course = request.form['name'].upper().replace(' ', '')
+    if course in CATALOG_INDEX:
+        img = post_requisites(PREREQ_GRAPH, course, url_for('index'), wait=False)
+        if img == PENDING:
+            # PENDING -> The tree is still being rendered, the client asks again
+            img = f'PENDING {course}'
+        elif img == FAILED:
+            # FAILED -> The tree could not be rendered
+            img = f'FAILED {course}'
+        elif not img:
+            # NR -> Not Required by any course
+            img = f'NR {course}'
+    else:
+        # NA -> Not Available
+        img = f'NA {course}' if course else ''
     return jsonify({'data': img})
 
 
 @app.route('/_keyword_search/', methods=['POST'])
 def _keyword_search():
     # Used for the case-insensitive keyword search 
-    keyword = request.form['keyword'].lower()
-    lower = CATALOGS['Description'].str.lower()
-    courses = CATALOGS[lower.str.contains(keyword, regex=False)].to_dict(orient='index')
-    return jsonify({'matches': courses})
+    limit = request.form.get('limit', default=200, type=int)
+    with timed('keyword_search'):
+        matches, total = KEYWORD_INDEX.search(request.form['keyword'], limit)
+    return jsonify({'matches': matches, 'total': total})
 
 
-@app.route('/get_geocode/', methods=['POST'])
+@app.route('/get_geocode/', methods=['GET', 'POST'])
 def get_geocode():
-    return jsonify({'coords': GEOCODED}) 
+    return respond(GEOCODE_PAYLOAD, 'public, max-age=3600')
+
+
+@app.route('/static/Prerequisite_Trees/<key>.svg')
+def tree_svg(key):
+    # Trees are stored under a key derived from what was drawn, so a tree URL never changes
+    if not re.fullmatch(r'[0-9a-f]{40}', key):
+        abort(404)
+
+    def build():
+        with open(os.path.join(TREE_CACHE.path, f'{key}.svg'), mode='rb') as f:
+            return Payload(f.read(), 'image/svg+xml')
+
+    try:
+        payload = PAYLOADS.get(('tree', key), build)
+    except FileNotFoundError:
+        abort(404)
+    return respond(payload, IMMUTABLE)
 
 
 @app.route('/check_course/', methods=['POST'])
 def check_course():
     course = request.form['course'].upper().replace(' ', '')
     planned_course = None
+    time_schedule = SCHEDULES.get()
     if re.search(r'[A-Z& ]+\d+ ?[A-Z]?', course):
         check_in = course if not course[-1].isalpha() else course[:-1]
-        if check_in in TIME_SCHEDULE:
+        if check_in in time_schedule:
             planned_course = course
             check = True
             if course[-1].isalpha():
                 planned_course = f'{course[:-1]} {course[-1]}'
-                if course[:-1] in CATALOGS.index:
-                    if course[:-1] in TIME_SCHEDULE:
-                        check = f'Lecture {course[-1]}' in TIME_SCHEDULE[course[:-1]]
+                if course[:-1] in CATALOG_INDEX:
+                    if course[:-1] in time_schedule:
+                        check = f'Lecture {course[-1]}' in time_schedule[course[:-1]]
                     else:
                         check = False
                 else:
                     check = False
             else:
-                check = course in CATALOGS.index
+                check = course in CATALOG_INDEX
         else:
             check = False
     else:
@@ -134,29 +259,114 @@ def check_course():
     return jsonify({'data': check, 'name': planned_course})
 
 
-course_options = None
+def get_constraints(form):
+    """Reads the hard constraints of a schedule search from a form
+    @params
+        'form': Form with the optional fields
+            'blocked': Blocked windows in 24 hour time, i.e 'MWF 0800-0930;TTh 1530-1800'
+            'free_days': Days without any classes, i.e 'MF'
+            'open_seats': 'true' to exclude full sections
+    Returns
+        Dictionary of hard constraints (see 'blocked_mask' in schedule.py)
+    """
+    blocked = []
+    for window in form.get('blocked', '').split(';'):
+        match = re.search(r'^\s*([MTWhFS]+)\s+(\d\d)(\d\d)-(\d\d)(\d\d)\s*$', window)
+        if match:
+            days, start_hour, start_minute, end_hour, end_minute = match.groups()
+            blocked.append([days, int(start_hour) * 60 + int(start_minute), int(end_hour) * 60 + int(end_minute)])
+    return {
+        'blocked': blocked,
+        'free_days': form.get('free_days', ''),
+        'open_seats': form.get('open_seats', '').lower() == 'true',
+    }
+
+
 @app.route('/create_schedule/', methods=['POST'])
 def create_schedule():
     # Creates all possible schedules based on the courses entered by the user
     courses = request.form['course'].strip(',').split(',')
-    global course_options
-    course_options = get_combinations(courses)
+    year, quarter = request.form.get('year', ''), request.form.get('quarter', '').upper()
+    if not year or not quarter:
+        year = quarter = None
+    elif is_quarter(year, quarter):
+        year = int(year)
+    else:
+        return jsonify({'option': None, 'total': 0})
     try:
-        next_option = next(course_options)
-    except StopIteration:
-        next_option = None
-    return jsonify({'option': next_option, 'coords': GEOCODED})
+        time_schedule = SCHEDULES.get(year, quarter)
+    except LOAD_ERRORS:
+        return jsonify({'option': None, 'total': 0})
+    constraints = get_constraints(request.form)
+    # Campuses are known per course, so courses at other campuses rule out every schedule
+    campuses = [campus for campus in request.form.get('campuses', '').split(',') if campus]
+    names = [course.split(' ')[0] for course in courses]
+    if campuses and any(name in PREREQ_GRAPH and PREREQ_GRAPH.campus(name) not in campuses for name in names):
+        session.pop('schedule', None)
+        return jsonify({'option': None, 'total': 0})
+    with timed('schedule_compile'):
+        total = count_combinations(courses, time_schedule, constraints)
+    # Ranked schedules are all returned at once, best first. 'rank' lists the criteria to rank by.
+    criteria = [criterion for criterion in request.form.get('rank', '').split(',') if criterion in RANK_WEIGHTS]
+    if criteria:
+        session.pop('schedule', None)
+        with timed('schedule_rank'):
+            ranked = rank_combinations(courses, MAX_SCHEDULES, criteria, GEOCODED, time_schedule, constraints)
+        options = [option for _, option in ranked]
+        return jsonify({
+            'option': options[0] if options else None,
+            'options': options[1:],
+            'scores': [score for score, _ in ranked],
+            'total': total
+        })
+    token, state = CURSORS.create(courses, year, quarter, constraints)
+    with timed('schedule_search'):
+        options, state = CURSORS.next(token, state)
+    session['schedule'] = {'token': token, 'state': state, 'total': total}
+    return jsonify({'option': options[0] if options else None, 'total': total})
+
+
+@app.route('/plan/', methods=['POST'])
+def plan():
+    # Plans the quarters to take the courses entered in (see planner.py)
+    targets = [course.upper().replace(' ', '') for course in request.form['courses'].split(',') if course.strip()]
+    completed = [course.upper().replace(' ', '') for course in request.form.get('completed', '').split(',') if course.strip()]
+    start = None
+    year, quarter = request.form.get('year', type=int), request.form.get('quarter', '').upper()
+    if year is not None and quarter in QUARTERS:
+        start = (quarter, year)
+    offerings = OFFERINGS.get() if request.form.get('offerings', '').lower() == 'true' else None
+    try:
+        max_credits = float(request.form.get('max_credits', 15))
+    except ValueError:
+        max_credits = 0
+    if not 0 < max_credits < math.inf:
+        return jsonify({'error': "'max_credits' must be a positive number"}), 400
+    with timed('plan'):
+        result = make_plan(
+            PREREQ_GRAPH,
+            targets,
+            completed,
+            CATALOG_INDEX.records,
+            max_credits=max_credits,
+            start=start,
+            offerings=offerings,
+            summer=request.form.get('summer', '').lower() == 'true'
+        )
+    return jsonify(result)
 
 
 @app.route('/get_schedules/', methods=['POST'])
 def get_schedules():
-    # Cycles through course options
-    global course_options
-    try:
-        next_option = next(course_options)
-    except StopIteration:
-        next_option = None
-    return jsonify({'option': next_option, 'coords': GEOCODED})
+    # Returns the next 'n' course options. Building coordinates are available from '/get_geocode/'.
+    count = min(max(request.args.get('n', default=1, type=int), 1), MAX_SCHEDULES)
+    if 'schedule' not in session:
+        return jsonify({'options': [], 'total': 0, 'done': True})
+    schedule = session['schedule']
+    with timed('schedule_search'):
+        options, state = CURSORS.next(schedule['token'], schedule['state'], count)
+    session['schedule'] = {**schedule, 'state': state}
+    return jsonify({'options': options, 'total': schedule['total'], 'done': state['done']})
 
 
 @app.route('/keyword/')
@@ -169,16 +379,15 @@ def departments():
     # Displays all departments at every UW Campus
     if request.method == 'POST':
         return redirect(url_for('index'))
-    total = {}
-    for campus in sorted(UW_DEPARTMENTS):
-        total[campus] = {
-            d: UW_DEPARTMENTS[campus][d] for d in sorted(UW_DEPARTMENTS[campus])
-        }
-    return render_template(
-        'departments.html',
-        department_dict=total,
-        url=request.url_root
+    payload = PAYLOADS.get(
+        ('departments', PREREQ_GRAPH.version, request.url_root),
+        lambda: Payload(render_template(
+            'departments.html',
+            department_dict=CATALOG_INDEX.campuses,
+            url=request.url_root
+        ), 'text/html')
     )
+    return respond(payload)
 
 
 @app.route('/geocode/')
@@ -194,38 +403,38 @@ def department(department):
         return redirect(url_for('index'))
     department = department.upper()
     if not re.search(r'[A-Z]+\d+', department):
-        department_chosen = {}
         department = department.replace('&amp;', '&')
-        department_df = CATALOGS[CATALOGS['Department Name'] == department]
-        svg = graph_department(department_df, department, request.url_root)
-        if not department_df.empty:
-            for dict_ in department_df.to_dict(orient='records'):
-                department_chosen[f"{dict_['Department Name']}{dict_['Course Number']}"] = dict_
+        with timed('catalog_lookup'):
+            department_chosen = CATALOG_INDEX.payload(department)
+        tree = page_tree(graph_department(PREREQ_GRAPH, department, url_for('index'), wait=False), department)
         return render_template(
             'department.html',
             course_dict=department_chosen,
-            department_dict={c: d for v in UW_DEPARTMENTS.values() for c, d in v.items()},
+            department_dict=CATALOG_INDEX.names,
             url=request.url_root,
             department=department,
             in_dict=bool(department_chosen),
-            svg=svg
+            **tree
         )
     else:
-        svg = create_tree(CATALOGS, department, request.url_root)
-        in_dict = department in CATALOGS.index
+        tree = page_tree(create_tree(PREREQ_GRAPH, department, url_for('index'), wait=False), department)
+        in_dict = department in CATALOG_INDEX
         if in_dict:
-            course_data = CATALOGS.loc[department].to_dict()
-            split_course = re.compile(r'/|,|&&|;')
-            for data in ['Prerequisites', 'Co-Requisites', 'Offered with']:
-                course_data[data] = list(filter(
-                    lambda x: x in CATALOGS.index and x != 'POI',
-                    split_course.split(course_data[data])
+            with timed('catalog_lookup'):
+                course_data = CATALOG_INDEX.record(department)
+            for i, data in enumerate(REQUISITE_TYPES):
+                course_data[data] = list(dict.fromkeys(
+                    requisite for requisite, _, _ in PREREQ_GRAPH.requisites(department, requisite_type=i)
                 ))
+            course_data['Offered with'] = list(filter(
+                lambda x: x in CATALOG_INDEX and x != 'POI',
+                re.split(r'/|,|&&|;', course_data['Offered with'])
+            ))
         else:
             course_data = None
         return render_template(
             'course.html',
-            svg=svg,
+            **tree,
             course=department, 
             course_data=course_data,
             in_dict=in_dict,
@@ -238,18 +447,33 @@ def generate():
     return render_template('generate.html')
 
 
+def refresh_catalogs():
+    REFRESHER.publish('Course_Catalogs.csv', lambda file_path: uwtools.course_catalogs().to_csv(file_path))
+    CATALOG_WATCHER.check()
+
+
 @app.route('/update_course_catalog/')
 def update_course_catalog():
-    uwtools.course_catalogs().to_csv(os.path.join(PATH, 'Course_Catalogs.csv'))
+    REFRESHER.start('catalogs', refresh_catalogs)
     return redirect(url_for('index'))
 
 
 @app.route('/update_time_schedules/<quarter>/')
 def update_time_schedules(quarter):
-    year, q = quarter.split('#', 1)
-    check_schedules(int(year), q.upper())
+    year, q = quarter.split('#', 1) if '#' in quarter else (quarter, '')
+    if not is_quarter(year, q):
+        abort(404)
+    REFRESHER.start(
+        f'time_schedules {year}{q.upper()}', SCHEDULES.refresh, int(year), q.upper(), REFRESHER.publish
+    )
     return redirect(url_for('index'))
 
 
+@app.route('/refresh_status/')
+def refresh_status():
+    # State of the refresh jobs started by this worker
+    return jsonify(REFRESHER.status())
+
+
 if __name__ == '__main__':
     app.run(debug=False)
\ No newline at end of file
@@ -0,0 +1,490 @@
+"""
+Alex Eidt
+
+Compares the speed of the schedule conflict checks, the keyword search and the tree renderers.
+
+The suite times the schedule search, tree builds and keyword search on generated data (or
+the data in 'static' with --fixture) and saves the results as JSON, so the results of two
+commits can be compared.
+
+Usage:
+    python benchmark.py schedule EE235 EE233 MATH207 PHYS122 CHEM142
+    python benchmark.py keyword "data structures" algorithms circuits
+    python benchmark.py tree EE235 CSE332 MATH308 --department EE
+    python benchmark.py suite --output before.json
+    python benchmark.py compare before.json after.json
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import tracemalloc
+from statistics import median
+from itertools import filterfalse, product
+from time import perf_counter
+from schedule import DAYS, TimeSchedule, backtrack, check_overlap, get_combinations, get_days, get_options
+
+
+def time_generator(generator, limit):
+    """Times how long it takes to find the first and the first 'limit' items of a generator
+    @params
+        'generator': Generator to time
+        'limit': Maximum number of items to take from the generator
+    Returns
+        Tuple with the time to the first item, total time and number of items found
+    """
+    start = perf_counter()
+    first = None
+    count = 0
+    for _ in generator:
+        if first is None:
+            first = perf_counter() - start
+        count += 1
+        if count == limit:
+            break
+    return first, perf_counter() - start, count
+
+
+def time_function(function, repeat):
+    """Times 'function' over 'repeat' calls
+    @params
+        'function': Function without arguments to time
+        'repeat': Number of times to call 'function'
+    Returns
+        Tuple with the average time per call and the result of the last call
+    """
+    start = perf_counter()
+    for _ in range(repeat):
+        result = function()
+    return (perf_counter() - start) / repeat, result
+
+
+def benchmark_schedule(courses, limit=1000, workers=None, baseline=True):
+    with open(os.path.join(os.getcwd(), 'static', 'Time_Schedules.json'), mode='r') as f:
+        courses_offered = json.loads(f.read())
+
+    total = get_options(courses_offered, courses)
+    # Sections are compiled once when the Time Schedule is loaded, not per search
+    time_schedule = TimeSchedule(courses_offered)
+    masks = [[mask for _, mask in options] for options in sorted(time_schedule.compile(courses), key=len)]
+    results = {}
+    if baseline:
+        results['check_overlap'] = time_generator(filterfalse(check_overlap, product(*total)), limit)
+    results.update({
+        'backtrack': time_generator(backtrack(masks), limit),
+        'get_combinations': time_generator(get_combinations(courses, time_schedule), limit),
+        # Second search of the same courses reuses the cached conflict matrix
+        'cached matrix': time_generator(get_combinations(courses, time_schedule), limit),
+    })
+
+    if workers:
+        results[f'{workers} processes'] = time_generator(
+            get_combinations(courses, time_schedule, workers=workers, count=limit), limit
+        )
+
+    combinations = 1
+    for options in total:
+        combinations *= len(options)
+    print(f'Courses: {", ".join(courses)} ({combinations} combinations)')
+    for name, (first, elapsed, count) in results.items():
+        first = f'{first * 1000:.2f} ms' if first is not None else '-'
+        print(f'{name:>16}: first {first}, {count} schedules in {elapsed * 1000:.2f} ms')
+    if baseline and results['get_combinations'][1]:
+        speedup = results['check_overlap'][1] / results['get_combinations'][1]
+        print(f'{"speedup":>16}: {speedup:.1f}x')
+    stats = time_schedule.conflicts.stats()
+    print(
+        f'{"conflict cache":>16}: {stats["hits"]} hits, {stats["misses"]} misses, '
+        f'built in {stats["average_build_time"] * 1000:.2f} ms'
+    )
+
+
+def benchmark_keyword(keywords, repeat=20):
+    import pandas as pd
+    from keyword_index import KeywordIndex
+
+    catalogs = pd.read_csv(
+        os.path.join(os.getcwd(), 'static', 'Course_Catalogs.csv'), dtype=str, index_col=0
+    ).fillna('')
+    start = perf_counter()
+    index = KeywordIndex(catalogs)
+    print(f'Index built in {(perf_counter() - start) * 1000:.2f} ms ({len(catalogs)} courses)')
+
+    def scan(keyword):
+        # Keyword search used before the index
+        lower = catalogs['Description'].str.lower()
+        return catalogs[lower.str.contains(keyword.lower(), regex=False)].to_dict(orient='index')
+
+    for keyword in keywords:
+        scanned, courses = time_function(lambda: scan(keyword), repeat)
+        indexed, (_, total) = time_function(lambda: index.search(keyword), repeat)
+        print(
+            f'{keyword!r:>24}: scan {scanned * 1000:.2f} ms ({len(courses)} courses), '
+            f'index {indexed * 1000:.2f} ms ({total} courses), {scanned / indexed:.1f}x'
+        )
+
+
+def benchmark_tree(courses, departments, repeat=5):
+    import tempfile
+    import pandas as pd
+    from create_tree import build_department, build_tree
+    from prereq_graph import PrereqGraph
+    from svg_tree import render_graphviz, render_svg
+
+    catalogs = pd.read_csv(
+        os.path.join(os.getcwd(), 'static', 'Course_Catalogs.csv'), dtype=str, index_col=0
+    ).fillna('')
+    graph = PrereqGraph(catalogs)
+    trees = [(course, build_tree(graph, course, '/')) for course in courses]
+    trees += [(department, build_department(graph, department, '/')) for department in departments]
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'tree')
+        for name, tree in trees:
+            if tree is None:
+                print(f'{name:>10}: no tree')
+                continue
+            in_process, _ = time_function(lambda: render_svg(tree, path), repeat)
+            graphviz, _ = time_function(lambda: render_graphviz(tree, path), repeat)
+            print(
+                f'{name:>10}: {len(tree.nodes)} nodes, in-process {in_process * 1000:.2f} ms, '
+                f'graphviz {graphviz * 1000:.2f} ms, {graphviz / in_process:.1f}x'
+            )
+
+
+# Words used for the generated course names and descriptions
+WORDS = [
+    'data', 'structures', 'algorithms', 'circuits', 'signals', 'systems', 'design', 'analysis',
+    'introduction', 'advanced', 'theory', 'methods', 'linear', 'probability', 'networks', 'energy',
+    'materials', 'software', 'control', 'chemistry', 'physics', 'calculus', 'writing', 'research',
+]
+
+
+def format_time(minutes):
+    # Time Schedule time without AM/PM (i.e 130 for 1:30 PM)
+    hour, minute = divmod(minutes, 60)
+    return f'{(hour - 1) % 12 + 1}{minute:02d}'
+
+
+def synthetic_section(course, section_type, section, days, start, length, rng):
+    end = start + length
+    seats = rng.randint(0, 40)
+    return {
+        'Course Name': course,
+        'Type': section_type,
+        'Section': section,
+        'Building': ['BLD'],
+        'Days': [days],
+        'Room Number': ['100'],
+        'Seats': [f'{seats}/40'],
+        'Time': [f'{format_time(start)}-{format_time(end)}'],
+        'Meetings': [[day, start, end, 'BLD'] for day in sorted(get_days(days), key=DAYS.index)],
+    }
+
+
+def synthetic_time_schedule(courses, lectures, sections, seed=0):
+    """Generates an Organized Time Schedule (see 'main' in schedule.py)
+    @params
+        'courses': Number of courses
+        'lectures': Number of lectures of every course
+        'sections': Number of quiz sections of every lecture
+        'seed': Seed of the random number generator
+    Returns
+        Organized Time Schedule with the courses C0, C1, ...
+    """
+    rng = random.Random(seed)
+    courses_offered = {}
+    for i in range(courses):
+        course = f'C{i}'
+        courses_offered[course] = {}
+        for j in range(lectures):
+            letter = chr(ord('A') + j)
+            days, length = rng.choice([('MWF', 50), ('TTh', 80), ('MW', 80)])
+            lecture = synthetic_section(course, 'LECT', letter, days, rng.randrange(510, 1020, 30), length, rng)
+            quizzes = [
+                synthetic_section(
+                    course, 'QZ', f'{letter}{chr(ord("A") + k)}', rng.choice(['M', 'T', 'W', 'Th', 'F']),
+                    rng.randrange(510, 1020, 30), 50, rng
+                )
+                for k in range(sections)
+            ]
+            courses_offered[course][f'Lecture {letter}'] = {'LECT': lecture, 'QZ': quizzes, 'LB': [], 'ST': []}
+    return courses_offered
+
+
+def synthetic_catalogs(departments, courses, depth, seed=0):
+    """Generates Course Catalogs with chains of prerequisites
+    @params
+        'departments': Number of departments
+        'courses': Number of courses of every department
+        'depth': Length of the prerequisite chains. Every course but the first of a chain
+                 requires the course before it and one of two entry courses of another department.
+        'seed': Seed of the random number generator
+    Returns
+        DataFrame of courses as read from Course_Catalogs.csv
+    """
+    import pandas as pd
+
+    rng = random.Random(seed)
+    names = [f'D{i}' for i in range(departments)]
+    rows = {}
+    for department in names:
+        for i in range(courses):
+            number = 100 + i
+            prerequisites = []
+            if i % depth:
+                prerequisites.append(f'{department}{number - 1}')
+                # Entry courses (first of their chain) have no prerequisites
+                other = rng.choice(names)
+                entries = [f'{other}{100 + rng.randrange(0, courses, depth)}' for _ in range(2)]
+                prerequisites.append('/'.join(entries))
+            rows[f'{department}{number}'] = {
+                'Campus': 'Seattle',
+                'Department Name': department,
+                'Course Number': str(number),
+                'Course Name': ' '.join(rng.choices(WORDS, k=3)),
+                'Credits': '5',
+                'Prerequisites': ';'.join(prerequisites),
+                'Co-Requisites': '',
+                'Offered with': '',
+                'Description': ' '.join(rng.choices(WORDS, k=40)),
+            }
+    return pd.DataFrame.from_dict(rows, orient='index')
+
+
+def percentile(values, p):
+    # Nearest rank percentile of 'values'
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def peak_memory(function):
+    """Measures the peak memory allocated while calling 'function'
+    @params
+        'function': Function without arguments to measure
+    Returns
+        Peak memory in MiB
+    """
+    tracemalloc.start()
+    try:
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / 2 ** 20
+
+
+def suite_schedule(courses_offered, planned, limit, repeat):
+    def search():
+        # A fresh TimeSchedule, so building the conflict matrix is part of the search
+        time_schedule = TimeSchedule(courses_offered)
+        return time_generator(get_combinations(planned, time_schedule), limit)
+
+    compile_times, searches, cached_searches = [], [], []
+    for _ in range(repeat):
+        compile_time, time_schedule = time_function(lambda: TimeSchedule(courses_offered), 1)
+        compile_times.append(compile_time)
+        searches.append(time_generator(get_combinations(planned, time_schedule), limit))
+        # The second search of the same courses reuses the conflict matrix
+        cached_searches.append(time_generator(get_combinations(planned, time_schedule), limit))
+    first, elapsed, count = zip(*searches)
+    cached_first, cached, cached_count = zip(*cached_searches)
+    return {
+        'courses': planned,
+        'compile_ms': median(compile_times) * 1000,
+        'first_schedule_ms': median(first) * 1000 if count[0] else None,
+        'schedules': count[0],
+        'schedules_per_second': count[0] / median(elapsed),
+        'cached_first_schedule_ms': median(cached_first) * 1000 if count[0] else None,
+        'cached_schedules_per_second': count[0] / median(cached),
+        'peak_memory_mib': peak_memory(search),
+    }
+
+
+def suite_tree(catalogs, courses, post_courses, departments, repeat):
+    from create_tree import build_department, build_post_requisites, build_tree
+    from prereq_graph import PrereqGraph
+
+    graph_time, graph = time_function(lambda: PrereqGraph(catalogs), 1)
+    results = {'graph_build_ms': graph_time * 1000}
+    builds = [('tree', build_tree, course) for course in courses]
+    builds += [('post_requisites', build_post_requisites, course) for course in post_courses]
+    builds += [('department', build_department, department) for department in departments]
+    for kind, build, name in builds:
+        elapsed, tree = time_function(lambda: build(graph, name, '/'), repeat)
+        results[f'{kind} {name}'] = {
+            'build_ms': elapsed * 1000,
+            'nodes': len(tree.nodes) if tree is not None else 0,
+        }
+    results['peak_memory_mib'] = peak_memory(lambda: [build(PrereqGraph(catalogs), name, '/') for _, build, name in builds])
+    return results
+
+
+def suite_keyword(catalogs, keywords, repeat):
+    from keyword_index import KeywordIndex
+
+    index_time, index = time_function(lambda: KeywordIndex(catalogs), 1)
+    latencies = []
+    for _ in range(repeat):
+        for keyword in keywords:
+            start = perf_counter()
+            index.search(keyword)
+            latencies.append(perf_counter() - start)
+    return {
+        'keywords': keywords,
+        'index_build_ms': index_time * 1000,
+        'searches': len(latencies),
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'peak_memory_mib': peak_memory(lambda: KeywordIndex(catalogs).search(keywords[0])),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def benchmark_suite(args):
+    """Times the schedule search, tree builds and keyword search on one dataset
+    @params
+        'args': Parsed arguments of the 'suite' command
+    Returns
+        Dictionary with the dataset and the results of every benchmark
+    """
+    if args.fixture:
+        import pandas as pd
+
+        with open(os.path.join(os.getcwd(), 'static', 'Time_Schedules.json'), mode='r') as f:
+            courses_offered = json.loads(f.read())
+        catalogs = pd.read_csv(
+            os.path.join(os.getcwd(), 'static', 'Course_Catalogs.csv'), dtype=str, index_col=0
+        ).fillna('')
+        dataset = {'name': 'fixture'}
+        planned = [course.upper() for course in args.planned or ['EE235', 'EE233', 'MATH207', 'PHYS122']]
+        courses = [course.upper() for course in args.trees or ['EE235', 'CSE332', 'MATH308']]
+        post_courses = courses
+        departments = [department.upper() for department in args.department or ['EE']]
+    else:
+        dataset = {
+            'name': 'synthetic', 'seed': args.seed, 'courses': args.courses, 'lectures': args.lectures,
+            'sections': args.sections, 'departments': args.departments,
+            'department_courses': args.department_courses, 'depth': args.depth,
+        }
+        courses_offered = synthetic_time_schedule(args.courses, args.lectures, args.sections, args.seed)
+        catalogs = synthetic_catalogs(args.departments, args.department_courses, args.depth, args.seed)
+        planned = [f'C{i}' for i in range(min(args.planned_count, args.courses))]
+        # The last course of a chain has the deepest tree, the first one the most post requisites
+        last = 100 + min(args.depth, args.department_courses) - 1
+        courses = [f'D0{last}', f'D{args.departments - 1}{last}']
+        post_courses = ['D0100', f'D{args.departments - 1}100']
+        departments = ['D0']
+    return {
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'dataset': dataset,
+        'schedule': suite_schedule(courses_offered, planned, args.limit, args.repeat),
+        'tree': suite_tree(catalogs, courses, post_courses, departments, args.repeat),
+        'keyword': suite_keyword(catalogs, args.keywords, args.repeat),
+    }
+
+
+def flatten(results, prefix=''):
+    # Numeric results by their dotted path (i.e schedule.first_schedule_ms)
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f'{prefix}{key}.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[f'{prefix}{key}'] = value
+    return flat
+
+
+def compare(before_path, after_path, threshold=0.1):
+    """Prints the change of every result between two suite runs
+    @params
+        'before_path': JSON file of the earlier run
+        'after_path': JSON file of the later run
+        'threshold': Relative change flagged as a regression or improvement
+    """
+    with open(before_path, mode='r') as f:
+        before = json.loads(f.read())
+    with open(after_path, mode='r') as f:
+        after = json.loads(f.read())
+    if before['dataset'] != after['dataset']:
+        print('Warning: the runs used different datasets')
+    print(f"{before['commit']} -> {after['commit']}")
+    old, new = flatten(before), flatten(after)
+    for key in sorted(old.keys() & new.keys()):
+        if key.startswith('dataset.') or not old[key]:
+            continue
+        change = new[key] / old[key] - 1
+        # Higher is better for throughput, lower is better for times and memory
+        better = change > 0 if key.endswith('per_second') else change < 0
+        flag = '' if abs(change) < threshold or key.endswith(('nodes', 'schedules', 'searches')) else (
+            'better' if better else 'WORSE'
+        )
+        print(f'{key:>48}: {old[key]:>12.3f} -> {new[key]:>12.3f} ({change:+.1%}) {flag}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='UW Course Planner Benchmarks')
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+    schedule_parser = subparsers.add_parser('schedule', help='Schedule conflict checks')
+    schedule_parser.add_argument('courses', nargs='*', default=['EE235', 'EE233', 'MATH207', 'PHYS122'])
+    schedule_parser.add_argument('--limit', type=int, default=1000)
+    schedule_parser.add_argument('--workers', type=int, default=None, help='Also time the parallel search')
+    schedule_parser.add_argument('--no-baseline', action='store_true', help='Skip the slow check_overlap search')
+    keyword_parser = subparsers.add_parser('keyword', help='Keyword search')
+    keyword_parser.add_argument('keywords', nargs='*', default=['data', 'data structures', 'circuits'])
+    keyword_parser.add_argument('--repeat', type=int, default=20)
+    tree_parser = subparsers.add_parser('tree', help='Tree rendering')
+    tree_parser.add_argument('courses', nargs='*', default=['EE235', 'CSE332', 'MATH308'])
+    tree_parser.add_argument('--department', action='append', default=[])
+    tree_parser.add_argument('--repeat', type=int, default=5)
+    suite_parser = subparsers.add_parser('suite', help='Schedule, tree and keyword benchmarks saved as JSON')
+    suite_parser.add_argument('--output', help='JSON file to save the results to')
+    suite_parser.add_argument('--fixture', action='store_true', help="Use the data in 'static'")
+    suite_parser.add_argument('--seed', type=int, default=0)
+    suite_parser.add_argument('--courses', type=int, default=200, help='Courses in the generated Time Schedule')
+    suite_parser.add_argument('--lectures', type=int, default=3, help='Lectures of every generated course')
+    suite_parser.add_argument('--sections', type=int, default=6, help='Quiz sections of every generated lecture')
+    suite_parser.add_argument('--planned-count', type=int, default=5, help='Generated courses to search')
+    suite_parser.add_argument('--departments', type=int, default=50)
+    suite_parser.add_argument('--department-courses', type=int, default=60)
+    suite_parser.add_argument('--depth', type=int, default=12, help='Length of the generated prerequisite chains')
+    suite_parser.add_argument('--planned', nargs='*', help='Courses to search with --fixture')
+    suite_parser.add_argument('--trees', nargs='*', help='Courses to build trees of with --fixture')
+    suite_parser.add_argument('--department', action='append', help='Departments to build trees of with --fixture')
+    suite_parser.add_argument('--keywords', nargs='*', default=['data', 'data structures', 'circuits', 'linear systems'])
+    suite_parser.add_argument('--limit', type=int, default=1000)
+    suite_parser.add_argument('--repeat', type=int, default=20)
+    compare_parser = subparsers.add_parser('compare', help='Compare two suite results')
+    compare_parser.add_argument('before')
+    compare_parser.add_argument('after')
+    compare_parser.add_argument('--threshold', type=float, default=0.1)
+    args = parser.parse_args()
+
+    if args.benchmark == 'schedule':
+        benchmark_schedule([course.upper() for course in args.courses], args.limit, args.workers, not args.no_baseline)
+    elif args.benchmark == 'keyword':
+        benchmark_keyword(args.keywords, args.repeat)
+    elif args.benchmark == 'suite':
+        results = json.dumps(benchmark_suite(args), indent=4)
+        if args.output:
+            with open(args.output, mode='w') as f:
+                f.write(results)
+        print(results)
+    elif args.benchmark == 'compare':
+        compare(args.before, args.after, args.threshold)
+    else:
+        benchmark_tree([c.upper() for c in args.courses], [d.upper() for d in args.department], args.repeat)
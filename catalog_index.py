@@ -0,0 +1,67 @@
+"""
+Alex Eidt
+
+Index of the Course Catalogs and UW departments used by the course and department pages.
+
+Built once when the Course Catalogs are loaded so requests look up courses and departments
+directly instead of filtering the Course Catalogs DataFrame.
+"""
+
+
+class CatalogIndex:
+    def __init__(self, course_df, departments):
+        """Builds the index
+        @params
+            'course_df': The DataFrame of courses
+            'departments': Dictionary of campuses to department abbreviations to department names
+        """
+        records = course_df.to_dict(orient='index')
+        # Courses sorted by department so every department is a slice of 'courses'
+        self.courses = sorted(records, key=lambda course: records[course]['Department Name'])
+        self.records = {course: records[course] for course in self.courses}
+        self.slices = {}
+        for i, course in enumerate(self.courses):
+            department = records[course]['Department Name']
+            start = self.slices[department].start if department in self.slices else i
+            self.slices[department] = slice(start, i + 1)
+        # Department abbreviations to names of all campuses
+        self.names = {d: name for campus in departments.values() for d, name in campus.items()}
+        # Departments of every campus sorted by abbreviation for the departments page
+        self.campuses = {
+            campus: {d: departments[campus][d] for d in sorted(departments[campus])}
+            for campus in sorted(departments)
+        }
+        # Course page data of every department, as passed to 'department.html'
+        self.payloads = {
+            department: {
+                f"{record['Department Name']}{record['Course Number']}": record
+                for record in map(self.records.get, self.courses[courses])
+            }
+            for department, courses in self.slices.items()
+        }
+
+    def __contains__(self, course):
+        return course in self.records
+
+    def record(self, course):
+        """Finds the Course Catalog entry of a course
+        @params
+            'course': Course to find (i.e EE235)
+        Returns
+            Copy of the dictionary of the course or None if it is not in the Course Catalogs
+        """
+        record = self.records.get(course)
+        return dict(record) if record is not None else None
+
+    def is_department(self, department):
+        return department in self.names
+
+    def payload(self, department):
+        """Finds the course data shown on the page of a department
+        @params
+            'department': Department abbreviation (i.e EE)
+        Returns
+            Dictionary of courses to their Course Catalog entries. Empty if the department
+            has no courses.
+        """
+        return self.payloads.get(department, {})
@@ -7,8 +7,12 @@ Creates Department course graphs showing connections between all courses in that
 
 
 import os
-import re
-from graphviz import Digraph
+from collections import deque
+from metrics import CACHE_REQUESTS, timed
+from prereq_graph import REQUISITE_TYPES
+from render_queue import RenderQueue
+from svg_tree import Tree
+from tree_cache import TreeCache
 
 
 # Change PATH setup for Graphviz folder here:
@@ -16,95 +20,142 @@ from graphviz import Digraph
 os.environ['PATH'] += os.pathsep + 'C:\\Graphviz\\bin'
 # ---------------------------------------------------------------------- #
 
-total = set()
-REQUISITE_TYPES = ['Prerequisites', 'Co-Requisites']
 PATH = os.path.join(os.getcwd(), 'static', 'Prerequisite_Trees')
-SPLIT_COURSE = re.compile(r'/|,|&&')
+CACHE = TreeCache(PATH, os.path.join('..', 'static', 'Prerequisite_Trees'))
+QUEUE = RenderQueue()
+# Returned instead of a path if a tree is still being rendered and the caller does not wait
+PENDING = 'PENDING'
+# Returned instead of a path if the tree could not be rendered
+FAILED = 'FAILED'
 ARROWHEADS = [
     'box', 'dot', 'normal', 'diamond', 'inv', 'tee', 'crow',
     'icurve', 'curve', 'vee', 'none'
 ]
 
 
-def create_tree(course_df, course, url):
+def render_cached(kind, name, graph, url, build, wait=True):
+    """Renders a tree unless it is already cached
+    @params
+        'kind': Kind of tree, part of the cache key
+        'name': The course or department in question
+        'graph': The Prerequisite Graph of all courses
+        'url': URL of current webpage
+        'build': Function building the tree from 'graph', 'name' and 'url'
+        'wait': Wait for the tree to be rendered. If False, PENDING is returned
+                while the tree is being rendered.
+    Returns
+        Path of the SVG, PENDING, FAILED if rendering the tree failed recently or None if
+        there is nothing to draw
+    """
+    key = CACHE.key(kind, name, graph.version, url=url)
+    cached = CACHE.get(key)
+    if cached:
+        CACHE_REQUESTS.inc(cache='tree', result='hit')
+        return cached
+    if QUEUE.failure(key) is not None:
+        return FAILED
+    job = QUEUE.get(key)
+    if job is None:
+        CACHE_REQUESTS.inc(cache='tree', result='miss')
+        with timed(f'{kind}_build'):
+            tree = build(graph, name, url)
+        if tree is None:
+            return None
+        job = QUEUE.submit(key, tree, CACHE.file_path(key))
+    else:
+        CACHE_REQUESTS.inc(cache='tree', result='coalesced')
+    if not wait and not job.done():
+        return PENDING
+    with timed('tree_render_wait'):
+        if job.exception() is not None:
+            return FAILED
+    return CACHE.add(key)
+
+
+def create_tree(graph, course, url, wait=True):
+    """Creates the prerequisite tree of a course
+    @params
+        'graph': The Prerequisite Graph of all courses
+        'course': The course in question
+        'url': URL of current webpage
+        'wait': Wait for the tree to be rendered (see 'render_cached')
+    """
+    return render_cached('tree', course, graph, url, build_tree, wait)
+
+
+def build_tree(graph, course, url):
     """Starts the tree by adding the selected course as the top element
     @params
-        'course_df': The DataFrame of courses
+        'graph': The Prerequisite Graph of all courses
         'course': The course in question
         'url': URL of current webpage
     """
-    file_path = os.path.join('..', 'static', 'Prerequisite_Trees', f'{course}.svg')
-    if f'{course}.svg' in os.listdir(PATH):
-        return file_path
+    if course not in graph or not graph.requisites(course, graph.campus(course)):
+        return None
     # Tree used to draw the course prerequisite tree
-    tree = Digraph(
+    tree = Tree(
         comment=f'{course} Prerequisites',
         graph_attr={'rankdir': 'TB', 'splines': 'ortho', 'overlap': 'scale'},
         edge_attr={'arrowhead': 'dot', 'arrowsize': '0.8'},
     )
-    course_df = course_df[course_df['Campus'] == course_df.loc[course, 'Campus']]
-    prereqs = set(course_df.loc[course, REQUISITE_TYPES])
-    splitted = list(filter(
-        lambda x: x in course_df.index and x != 'POI',
-        re.compile(r'/|,|&&|;').split(','.join(prereqs))
-    ))
-    if any(prereqs) and splitted and course in course_df.index:
-        del splitted
-        global total
-        total.clear()
-        tree.node(course, course, fontname='helvetica')
-        tree.attr('node', shape='rectangle', style='filled', color='gray30', fontname='helvetica')
-        # Recursively build up tree
-        create_tree_helper(course_df, course, 0, tree, url)
-        path = os.path.join(PATH, course)
-        tree.render(path, view=False, format='svg')
-        os.remove(path)
-        return file_path
-    return None
-
-
-def create_tree_helper(course_df, course, level, tree, url):
+    tree.node(course.replace('&', '&amp;'), course.replace('&', '&amp;'), fontname='helvetica')
+    tree.attr('node', shape='rectangle', style='filled', color='gray30', fontname='helvetica')
+    # Recursively build up tree
+    create_tree_helper(graph, course, graph.campus(course), 0, tree, url, set())
+    return tree
+
+
+def create_tree_helper(graph, course, campus, level, tree, url, total):
     """Builds up the prerequisite tree
     @params
-        'course_df': The DataFrame of courses
+        'graph': The Prerequisite Graph of all courses
         'course': The course in question
+        'campus': Campus of the course at the top of the tree
         'level': The current level of the tree
         'tree': The tree being built
         'url': URL of the current webpage
+        'total': Set of courses already in the tree
     """
     if course not in total:
         total.add(course)
-        for i, requisite_type in enumerate(REQUISITE_TYPES):
-            for index, crs in enumerate(course_df.loc[course.replace('&amp;', '&'), requisite_type].split(';')):
-                for option in SPLIT_COURSE.split(crs):
-                    if option and option != 'POI' and option in course_df.index:
-                        option = option.replace('&', '&amp;')
-                        tree.attr(
-                            'edge',
-                            arrowhead=ARROWHEADS[index] if not i else f'o{ARROWHEADS[index]}',
-                        )
-                        tree.attr(
-                            'node',
-                            fillcolor=f'grey{99 - (level * 3)}' if not i else 'cyan',
-                            URL=f'{url}{option}',
-                            target="_blank"
-                        )
-                        tree.edge(course, option)
-                        create_tree_helper(course_df, option, level + 1, tree, url)
-
-
-def post_requisites(course_df, course, url):
+        for option, i, index in graph.requisites(course, campus):
+            name = option.replace('&', '&amp;')
+            arrowhead = ARROWHEADS[min(index, len(ARROWHEADS) - 1)]
+            tree.attr('edge', arrowhead=arrowhead if not i else f'o{arrowhead}')
+            tree.attr(
+                'node',
+                fillcolor=f'grey{99 - (level * 3)}' if not i else 'cyan',
+                URL=f'{url}{name}',
+                target="_blank"
+            )
+            tree.edge(course.replace('&', '&amp;'), name)
+            create_tree_helper(graph, option, campus, level + 1, tree, url, total)
+
+
+def post_requisites(graph, course, url, wait=True):
+    """Creates the tree of all courses requiring a course
+    @params
+        'graph': The Prerequisite Graph of all courses
+        'course': The course in question
+        'url': URL of current webpage
+        'wait': Wait for the tree to be rendered (see 'render_cached')
+    """
+    return render_cached('post', course, graph, url, build_post_requisites, wait)
+
+
+def build_post_requisites(graph, course, url):
     """Starts the tree by adding the selected course as the top element
     @params
-        'course_df': The DataFrame of courses
+        'graph': The Prerequisite Graph of all courses
         'course': The course in question
         'url': URL of current webpage
     """
-    postreqs = {}
-    post_requisites_helper(course_df, course, postreqs)
+    postreqs = post_requisites_helper(graph, course)
+    if not postreqs:
+        return None
 
     # Tree used to draw the postrequisite tree
-    tree = Digraph(
+    tree = Tree(
         comment=f'{course} Course Post Requisites',
         graph_attr={'rankdir': 'BT', 'splines': 'ortho', 'overlap': 'false'},
         edge_attr={'arrowhead': 'normal', 'arrowsize': '0.8'},
@@ -119,59 +170,67 @@ def post_requisites(course_df, course, url):
             post = post.replace('&', '&amp;')
             tree.attr('node', URL=f'{url}{post}', target="_blank")
             tree.edge(crs, post)
+    return tree
 
-    path = os.path.join(PATH, f'{course}_POST')
-    tree.render(path, view=False, format='svg')
-    os.remove(path)
-    return None
-
-    
-def post_requisites_helper(course_df, course, postreqs):
-    # Get post-requisites
-    mask = (course_df['Prerequisites'] != '') & (course_df['Prerequisites'] != 'POI')
-    campus_mask = course_df['Campus'] == course_df.loc[course, 'Campus']
-    postreqs_df = course_df[mask & campus_mask]['Prerequisites'].str.split(r'/|,|&&|;')
-    postreqs_df = postreqs_df.apply(lambda x: set(filter(lambda y: y != 'POI', x)))
-    post_requisites = postreqs_df[postreqs_df.apply(lambda x: course in x)].index
-
-    if post_requisites.empty:
-        return
-    if course not in postreqs:
-        postreqs[course] = set()
-    postreqs[course].update(post_requisites)
-    for postreq in post_requisites:
-        post_requisites_helper(course_df, postreq, postreqs)
-
-
-def graph_department(department_df, department, url):
-    """Builds up the department prerequisite tree
+
+def post_requisites_helper(graph, course):
+    """Finds all courses that directly or indirectly require 'course' as a prerequisite
+    @params
+        'graph': The Prerequisite Graph of all courses
+        'course': The course in question
+    Returns
+        Dictionary mapping every course in the closure to the courses that directly
+        require it. Courses nobody requires are left out.
+    """
+    postreqs = {}
+    visited = {course}
+    queue = deque([course])
+    prerequisites = REQUISITE_TYPES.index('Prerequisites')
+    while queue:
+        crs = queue.popleft()
+        post_requisites = graph.dependents(crs, graph.campus(crs), prerequisites)
+        if post_requisites:
+            postreqs[crs] = post_requisites
+        for postreq in post_requisites:
+            # Requisites can be cyclic, so every course is only visited once
+            if postreq not in visited:
+                visited.add(postreq)
+                queue.append(postreq)
+    return postreqs
+
+
+def graph_department(graph, department, url, wait=True):
+    """Creates the department prerequisite tree
     @params
-        'department_df': The DataFrame of courses in the department
+        'graph': The Prerequisite Graph of all courses
         'department': The department in question
         'url': URL of the current webpage
+        'wait': Wait for the tree to be rendered (see 'render_cached')
     """
-    file_path = os.path.join('..', 'static', 'Prerequisite_Trees', f'{department}.svg')
-    if f'{department}.svg' in os.listdir(PATH):
-        return file_path
+    return render_cached('department', department, graph, url, build_department, wait)
+
 
+def build_department(graph, department, url):
+    """Builds up the department prerequisite tree
+    @params
+        'graph': The Prerequisite Graph of all courses
+        'department': The department in question
+        'url': URL of the current webpage
+    """
     course_prereqs = {}
-    split_prereqs = re.compile(r'/|,|&&|;')
-    for course in department_df.index:
-        if course not in course_prereqs:
-            course_prereqs[course] = set()
-        for requisite_type in REQUISITE_TYPES:
-            for prereq in split_prereqs.split(department_df.loc[course, requisite_type]):
-                if prereq and ''.join(filter(lambda x: not x.isdigit() or x == '&', prereq)) == department and \
-                    prereq in department_df.index:
-                    course_prereqs[course].add(prereq)
-        if not course_prereqs[course]:
-            del course_prereqs[course]
+    for course in graph.department_courses(department):
+        prereqs = {}
+        for prereq, _, _ in graph.requisites(course):
+            if graph.department(prereq) == department:
+                prereqs[prereq] = None
+        if prereqs:
+            course_prereqs[course] = list(prereqs)
 
     if not course_prereqs:
         return None
 
     # Tree used to draw the department tree
-    tree = Digraph(
+    tree = Tree(
         comment=f'{department} Course Connections by Pre/Co-Requisites',
         graph_attr={'layout': 'dot', 'rankdir': 'LR', 'splines': 'true', 'overlap': 'false'},
         edge_attr={'arrowhead': 'normal', 'arrowsize': '0.6'},
@@ -187,8 +246,4 @@ def graph_department(department_df, department, url):
             tree.attr('node', URL=f'{url}{prereq}', target='_blank')
             tree.node(prereq)
             tree.edge(course, prereq)
-
-    path = os.path.join(PATH, department)
-    tree.render(path, view=False, format='svg')
-    os.remove(path)
-    return file_path
\ No newline at end of file
+    return tree
\ No newline at end of file
@@ -0,0 +1,128 @@
+"""
+Alex Eidt
+
+Keeps track of the schedules every MyMap user is paging through.
+
+The position of a user in the schedule search is small enough to be stored in their
+session, so any worker can resume the search. Workers keep the live search for recently
+used cursors in memory to avoid restarting it on every request.
+"""
+
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from schedule import search_combinations
+
+
+class ScheduleCursor:
+    def __init__(self, courses, time_schedule, quarter=(None, None), position=None, done=False, constraints=None):
+        self.courses = courses
+        self.time_schedule = time_schedule
+        self.quarter = list(quarter)
+        self.position = position
+        self.done = done
+        self.constraints = constraints or {}
+        self.schedules = None
+        if not done:
+            self.schedules = search_combinations(courses, position, time_schedule, self.constraints)
+
+    @classmethod
+    def from_state(cls, state, time_schedule):
+        return cls(
+            state['courses'], time_schedule, state['quarter'], state['position'], state['done'], state['constraints']
+        )
+
+    @property
+    def state(self):
+        # Serializable search state stored in the session of the user
+        return {
+            'courses': self.courses,
+            'quarter': self.quarter,
+            'version': self.time_schedule.version,
+            'position': self.position,
+            'done': self.done,
+            'constraints': self.constraints,
+        }
+
+    def take(self, count):
+        """Finds the next schedules of the cursor
+        @params
+            'count': Maximum number of schedules to find
+        Returns
+            List with up to 'count' combinations of courses. Empty if there are no
+            more combinations.
+        """
+        options = []
+        while not self.done and len(options) < count:
+            try:
+                position, option = next(self.schedules)
+            except StopIteration:
+                self.done = True
+                self.schedules = None
+                break
+            self.position = list(position)
+            options.append(option)
+        return options
+
+
+class CursorStore:
+    def __init__(self, schedules, max_cursors=256, ttl=30 * 60):
+        """Stores live schedule cursors by token
+        @params
+            'schedules': ScheduleStore with the Time Schedules to search
+            'max_cursors': Maximum number of cursors kept in memory
+            'ttl': Number of seconds an unused cursor is kept in memory
+        """
+        self.schedules = schedules
+        self.max_cursors = max_cursors
+        self.ttl = ttl
+        self.cursors = OrderedDict()
+        self.lock = threading.Lock()
+
+    def create(self, courses, year=None, quarter=None, constraints=None):
+        """Starts a new schedule search
+        @params
+            'courses': List of courses to find combinations from
+            'year': Year of the quarter to search, None for the current quarter
+            'quarter': Quarter to search (i.e AUT)
+            'constraints': Dictionary of hard constraints (see 'blocked_mask' in schedule.py)
+        Returns
+            Tuple with the token and the search state of the new cursor
+        """
+        cursor = ScheduleCursor(courses, self.schedules.get(year, quarter), (year, quarter), constraints=constraints)
+        return uuid.uuid4().hex, cursor.state
+
+    def next(self, token, state, count=1):
+        """Finds the next schedules for the cursor with the given 'token'. If this worker does
+        not have the cursor in memory, the search is resumed from 'state'.
+        @params
+            'token': Token of the cursor
+            'state': Search state of the cursor as returned by 'create' or 'next'
+            'count': Maximum number of schedules to find
+        Returns
+            Tuple with a list of the next combinations of courses and the new search state
+        """
+        time_schedule = self.schedules.get(*state['quarter'])
+        with self.lock:
+            # The cursor is removed while in use so concurrent requests never share a generator
+            cursor, _ = self.cursors.pop(token, (None, None))
+        if state['version'] != time_schedule.version:
+            # The Time Schedule was updated, so the position no longer points to the same sections
+            state = {**state, 'position': None, 'done': False}
+        if cursor is None or cursor.time_schedule is not time_schedule or cursor.position != state['position']:
+            cursor = ScheduleCursor.from_state(state, time_schedule)
+        options = cursor.take(count)
+        with self.lock:
+            self.cursors[token] = (cursor, time.monotonic())
+            self.evict()
+        return options, cursor.state
+
+    def evict(self):
+        # Removes expired cursors and the least recently used cursors over the limit
+        now = time.monotonic()
+        while self.cursors:
+            token, (_, last_used) = next(iter(self.cursors.items()))
+            if len(self.cursors) <= self.max_cursors and now - last_used <= self.ttl:
+                break
+            del self.cursors[token]
@@ -0,0 +1,109 @@
+"""
+Alex Eidt
+
+Caches the serialized and gzipped bodies of responses that only change with the data.
+
+Every payload gets a strong ETag from its content, so clients revalidating with
+'If-None-Match' get a '304 Not Modified' instead of the whole body again.
+"""
+
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+from flask import Response, request
+from metrics import CACHE_REQUESTS
+
+
+# Bodies smaller than this many bytes are not worth compressing
+MIN_GZIP_BYTES = 1024
+# Cache-Control of payloads whose URL changes whenever their content changes
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+class Payload:
+    def __init__(self, body, mimetype):
+        """Serializes and compresses a response body once
+        @params
+            'body': String or bytes of the body
+            'mimetype': Mimetype of the body (i.e application/json)
+        """
+        self.body = body.encode('utf-8') if isinstance(body, str) else body
+        self.mimetype = mimetype
+        self.etag = hashlib.sha1(self.body).hexdigest()
+        self.gzipped = None
+        if len(self.body) >= MIN_GZIP_BYTES:
+            gzipped = gzip.compress(self.body, compresslevel=9, mtime=0)
+            if len(gzipped) < len(self.body):
+                self.gzipped = gzipped
+
+    @property
+    def size(self):
+        return len(self.body) + len(self.gzipped or b'')
+
+
+class PayloadCache:
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        """Keeps payloads in least recently used order
+        @params
+            'max_bytes': Maximum total size of the cached payloads
+        """
+        self.max_bytes = max_bytes
+        self.payloads = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, build):
+        """Finds the payload of 'key', building it if it is not cached
+        @params
+            'key': Key of the payload. Must include the version of the data it is built from.
+            'build': Function returning the Payload of 'key'
+        Returns
+            Payload of 'key'
+        """
+        with self.lock:
+            payload = self.payloads.get(key)
+            if payload is not None:
+                self.payloads.move_to_end(key)
+        if payload is not None:
+            CACHE_REQUESTS.inc(cache='http', result='hit')
+            return payload
+        CACHE_REQUESTS.inc(cache='http', result='miss')
+        payload = build()
+        with self.lock:
+            if key not in self.payloads:
+                self.payloads[key] = payload
+                self.size += payload.size
+            self.evict()
+        return payload
+
+    def evict(self):
+        # Removes the least recently used payloads over the size limit
+        while self.size > self.max_bytes and self.payloads:
+            _, payload = self.payloads.popitem(last=False)
+            self.size -= payload.size
+
+
+def respond(payload, cache_control='no-cache'):
+    """Creates the response of a payload for the current request
+    @params
+        'payload': Payload to send
+        'cache_control': Cache-Control header of the response. 'no-cache' lets clients keep
+                         the payload but revalidate it on every use.
+    Returns
+        Response with the gzipped body if the client accepts it, or '304 Not Modified' if the
+        client already has the payload
+    """
+    use_gzip = payload.gzipped is not None and 'gzip' in request.accept_encodings
+    # Every encoding of the payload has its own strong ETag
+    etag = f'{payload.etag}-gzip' if use_gzip else payload.etag
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(payload.gzipped if use_gzip else payload.body, mimetype=payload.mimetype)
+        if use_gzip:
+            response.headers['Content-Encoding'] = 'gzip'
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    response.vary.add('Accept-Encoding')
+    return response
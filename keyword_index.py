@@ -0,0 +1,202 @@
+"""
+Alex Eidt
+
+Inverted n-gram index used for the keyword search over the Course Catalogs.
+
+Unigrams and bigrams are indexed as well, so the one and two letter words sent while
+typing are looked up in the index instead of scanning every course. These match most of
+the catalog, so their ranked results are cached as well.
+
+The postings are stored in three numpy arrays (see 'build_postings') instead of a set of
+Python integers per n-gram. They are built into the snapshot by 'python snapshot.py build'
+and memory mapped from there, so workers share them instead of each building their own.
+"""
+
+import threading
+from collections import OrderedDict
+from heapq import nsmallest
+import numpy as np
+
+
+SEARCH_COLUMNS = ['Course Name', 'Description']
+# Longest n-grams in the index. Words up to this length are matched by the index alone.
+MAX_GRAM = 3
+# Bits of every character of an n-gram key. Unicode code points need 21 bits.
+CHAR_BITS = 21
+# Number of courses whose n-grams are sorted at once while building the postings
+BUILD_CHUNK = 500
+# Results of keywords with up to this many letters are cached, at most MAX_CACHED of them
+CACHED_LETTERS = 2
+MAX_CACHED = 4096
+
+
+def get_texts(course_df):
+    # Lowercase text searched for every course, its title first
+    return [' '.join(row).lower() for row in course_df[SEARCH_COLUMNS].itertuples(index=False)]
+
+
+def get_ngrams(text, n):
+    """Finds the keys of all n-grams of 'text'
+    @params
+        'text': String to find n-grams of
+        'n': Length of the n-grams
+        Example: 'data', 3 -> keys of {'dat', 'ata'}
+    Returns
+        Set of integer keys with the code point plus one of every character of an n-gram
+        in CHAR_BITS bits each, shorter n-grams padded with zeros
+    """
+    keys = set()
+    for i in range(len(text) - n + 1):
+        key = 0
+        for j in range(MAX_GRAM):
+            key = (key << CHAR_BITS) | (ord(text[i + j]) + 1 if j < n else 0)
+        keys.add(key)
+    return keys
+
+
+def build_postings(texts):
+    """Finds the courses containing every unigram, bigram and trigram of the texts
+    @params
+        'texts': Lowercase text of every course (see 'get_texts')
+    Returns
+        Tuple with the sorted n-gram keys (see 'get_ngrams'), the offsets of the courses of
+        every key and the positions of the courses containing every key, sorted per key
+    """
+    chunks = []
+    for start in range(0, len(texts), BUILD_CHUNK):
+        chunk = texts[start:start + BUILD_CHUNK]
+        # Code points plus one of all texts, separated by zeros n-grams never span
+        codes = np.frombuffer('\x00'.join(chunk).encode('utf-32-le'), dtype=np.uint32).astype(np.int64)
+        codes = np.where(codes == 0, 0, codes + 1)
+        courses = np.repeat(
+            np.arange(start, start + len(chunk), dtype=np.int32), [len(text) + 1 for text in chunk]
+        )[:len(codes)]
+        for n in range(1, MAX_GRAM + 1):
+            size = len(codes) - n + 1
+            if size <= 0:
+                continue
+            keys = np.zeros(size, dtype=np.int64)
+            valid = np.ones(size, dtype=bool)
+            for j in range(MAX_GRAM):
+                keys <<= CHAR_BITS
+                if j < n:
+                    keys |= codes[j:j + size]
+                    valid &= codes[j:j + size] != 0
+            keys, grams_courses = keys[valid], courses[:size][valid]
+            order = np.lexsort((grams_courses, keys))
+            keys, grams_courses = keys[order], grams_courses[order]
+            # Every n-gram is listed once per course
+            first = np.ones(len(keys), dtype=bool)
+            first[1:] = (keys[1:] != keys[:-1]) | (grams_courses[1:] != grams_courses[:-1])
+            chunks.append((keys[first], grams_courses[first]))
+    if not chunks:
+        return np.zeros(0, dtype=np.int64), np.zeros(1, dtype=np.int32), np.zeros(0, dtype=np.int32)
+    keys = np.concatenate([keys for keys, _ in chunks])
+    courses = np.concatenate([courses for _, courses in chunks])
+    del chunks
+    # Chunks are in course order, so a stable sort keeps the courses of every key sorted
+    order = np.argsort(keys, kind='stable')
+    courses = courses[order]
+    keys = keys[order]
+    del order
+    starts = np.flatnonzero(np.append(True, keys[1:] != keys[:-1]))
+    offsets = np.append(starts, len(keys)).astype(np.int32)
+    return keys[starts], offsets, courses
+
+
+class KeywordIndex:
+    def __init__(self, course_df, records=None, postings=None):
+        """Builds the index from the Course Catalogs
+        @params
+            'course_df': The DataFrame of courses
+            'records': Dictionary of courses to their Course Catalog entries, i.e. the records of
+                       the CatalogIndex. Built from 'course_df' if not given.
+            'postings': Postings of 'course_df' built by 'build_postings', i.e. from the snapshot.
+                        Built from 'course_df' if not given.
+        """
+        self.courses = list(course_df.index)
+        self.records = records if records is not None else course_df.to_dict(orient='index')
+        self.texts = get_texts(course_df)
+        # The title of every course is the start of its text
+        self.title_ends = [len(title.lower()) for title in course_df['Course Name']]
+        self.keys, self.offsets, self.postings = postings if postings is not None else build_postings(self.texts)
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    def courses_with(self, key):
+        # Sorted positions of the courses containing the n-gram of 'key'
+        i = np.searchsorted(self.keys, key)
+        if i == len(self.keys) or self.keys[i] != key:
+            return self.postings[:0]
+        return self.postings[self.offsets[i]:self.offsets[i + 1]]
+
+    def candidates(self, word):
+        """Finds the courses that contain every trigram of 'word', or 'word' itself if it
+        is shorter than a trigram
+        @params
+            'word': Lowercase word to search for
+        Returns
+            Sorted array of course positions that may contain 'word'. Courses of words up to
+            MAX_GRAM letters all contain 'word'.
+        """
+        postings = sorted(map(self.courses_with, get_ngrams(word, min(len(word), MAX_GRAM))), key=len)
+        result = postings[0]
+        for courses in postings[1:]:
+            if not len(result):
+                break
+            result = np.intersect1d(result, courses, assume_unique=True)
+        return result
+
+    def search(self, keyword, limit=200):
+        """Finds all courses with a title or description containing every word of 'keyword'
+        @params
+            'keyword': Case-insensitive words to search for
+            'limit': Maximum number of courses to return
+        Returns
+            Tuple with a list of (course, course data) tuples ranked by relevance and
+            the total number of matching courses
+        """
+        keyword = ' '.join(keyword.lower().split())
+        if len(keyword) > CACHED_LETTERS:
+            return self.find(keyword, limit)
+        key = (keyword, limit)
+        with self.lock:
+            result = self.cache.get(key)
+            if result is not None:
+                self.cache.move_to_end(key)
+                return result
+        result = self.find(keyword, limit)
+        with self.lock:
+            self.cache[key] = result
+            if len(self.cache) > MAX_CACHED:
+                self.cache.popitem(last=False)
+        return result
+
+    def find(self, keyword, limit):
+        # Searches the index for a normalized keyword, see 'search'
+        words = keyword.split()
+        if not words:
+            return [], 0
+        matches = None
+        for word in sorted(words, key=len, reverse=True):
+            found = self.candidates(word)
+            if matches is not None:
+                found = np.intersect1d(found, matches, assume_unique=True)
+            # Trigrams only narrow down longer words, the actual text still has to be checked
+            if len(word) > MAX_GRAM:
+                found = [i for i in found.tolist() if word in self.texts[i]]
+            matches = np.asarray(found, dtype=np.int32)
+            if not len(matches):
+                return [], 0
+        ranked = nsmallest(limit, matches.tolist(), key=lambda i: (-self.score(i, keyword, words), self.courses[i]))
+        return [(self.courses[i], self.records[self.courses[i]]) for i in ranked], len(matches)
+
+    def score(self, i, keyword, words):
+        """Ranks a matching course. Matches of the whole keyword count more than matches of
+        single words and matches in the title count more than matches in the description.
+        """
+        text, title_end = self.texts[i], self.title_ends[i]
+        score = 10 * text.count(keyword, 0, title_end) + 3 * text.count(keyword)
+        for word in words:
+            score += 2 * text.count(word, 0, title_end) + text.count(word)
+        return score
@@ -0,0 +1,193 @@
+"""
+Alex Eidt
+
+Latency histograms, counters and request profiling for the Flask Application.
+
+Metrics are kept per process and served in the Prometheus text format by '/metrics'.
+Set the environment variable PROFILE_SLOW_REQUESTS to a number of seconds to profile every
+request and keep a cProfile dump (in 'profiles') of the requests slower than that.
+"""
+
+import cProfile
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+# Upper bounds of the latency histogram buckets in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def escape(value):
+    # Escapes a label value of the Prometheus text format
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    labels = ','.join(f'{name}="{escape(value)}"' for name, value in zip(names, values))
+    return f'{{{labels}}}'
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(label, '') for label in self.labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} counter']
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f'{self.name}{format_labels(self.labels, key)} {value}')
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # Label values -> [count per bucket (last one is +Inf), sum]
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(label, '') for label in self.labels)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * (len(self.buckets) + 1), 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+            self.values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        # Observes how long the body of the 'with' statement takes
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            for key, (counts, total) in sorted(self.values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + ('+Inf',), counts):
+                    cumulative += count
+                    labels = format_labels(self.labels + ('le',), key + (bound,))
+                    lines.append(f'{self.name}_bucket{labels} {cumulative}')
+                labels = format_labels(self.labels, key)
+                lines.append(f'{self.name}_sum{labels} {total}')
+                lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        # Functions returning (name, help, value) gauges when the metrics are served
+        self.collectors = []
+        self.lock = threading.Lock()
+
+    def counter(self, name, help, labels=()):
+        with self.lock:
+            return self.metrics.setdefault(name, Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=BUCKETS):
+        with self.lock:
+            return self.metrics.setdefault(name, Histogram(name, help, labels, buckets))
+
+    def collector(self, function):
+        self.collectors.append(function)
+        return function
+
+    def render(self):
+        """Formats all metrics in the Prometheus text format
+        Returns
+            String with all metrics
+        """
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.extend(metric.render())
+        for collector in self.collectors:
+            for name, help, value in collector():
+                lines.extend([f'# HELP {name} {help}', f'# TYPE {name} gauge', f'{name} {value}'])
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+REQUEST_LATENCY = REGISTRY.histogram(
+    'uwcp_request_seconds', 'Latency of the requests by route', ('route', 'method', 'status')
+)
+PHASE_LATENCY = REGISTRY.histogram(
+    'uwcp_phase_seconds', 'Latency of the phases of requests (tree render, catalog lookup, schedule search)', ('phase',)
+)
+CACHE_REQUESTS = REGISTRY.counter('uwcp_cache_requests_total', 'Cache lookups by cache and result', ('cache', 'result'))
+
+
+def timed(phase):
+    """Times a phase of a request
+    @params
+        'phase': Name of the phase (i.e 'tree_render')
+    Returns
+        Context manager observing the time spent in its body
+    """
+    return PHASE_LATENCY.time(phase=phase)
+
+
+def init_app(app, profile_seconds=None, profile_path=None):
+    """Records the latency of every request of a Flask Application and adds the '/metrics' route
+    @params
+        'app': The Flask Application
+        'profile_seconds': Requests slower than this many seconds are profiled, defaults to
+                           PROFILE_SLOW_REQUESTS. None turns profiling off.
+        'profile_path': Directory of the profiles, defaults to 'profiles'
+    """
+    from flask import Response, g, request
+
+    if profile_seconds is None and os.environ.get('PROFILE_SLOW_REQUESTS'):
+        profile_seconds = float(os.environ['PROFILE_SLOW_REQUESTS'])
+    profile_path = profile_path or os.path.join(os.getcwd(), 'profiles')
+
+    @app.before_request
+    def start_timer():
+        g.metrics_start = time.perf_counter()
+        if profile_seconds is not None:
+            g.profile = cProfile.Profile()
+            g.profile.enable()
+
+    @app.after_request
+    def record_latency(response):
+        if 'metrics_start' not in g:
+            return response
+        elapsed = time.perf_counter() - g.metrics_start
+        route = request.url_rule.rule if request.url_rule is not None else 'not_found'
+        REQUEST_LATENCY.observe(elapsed, route=route, method=request.method, status=response.status_code)
+        profile = g.pop('profile', None)
+        if profile is not None:
+            profile.disable()
+            if elapsed >= profile_seconds:
+                os.makedirs(profile_path, exist_ok=True)
+                name = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{route.strip('/').replace('/', '_') or 'index'}"
+                profile.dump_stats(os.path.join(profile_path, f'{name}-{elapsed * 1000:.0f}ms.prof'))
+        return response
+
+    @app.route('/metrics')
+    def metrics():
+        return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,385 @@
+"""
+Alex Eidt
+
+Plans the quarters to take a set of courses in using the Prerequisite Graph.
+
+Requisites in the same OR-group are interchangeable, every group of a course must be
+satisfied. Prerequisites must be taken in an earlier quarter, co-requisites in the same or
+an earlier quarter. For every unsatisfied group the option that can be finished the earliest
+is taken. Courses are then placed quarter by quarter, longest chain of courses depending on
+them first, until the credit limit of the quarter is reached.
+"""
+
+import json
+import math
+import os
+import re
+import threading
+import time
+from collections import deque
+
+
+# Quarters in calendar order
+QUARTERS = ['WIN', 'SPR', 'SUM', 'AUT']
+# Credits of courses without a number of credits in the Course Catalogs
+DEFAULT_CREDITS = 5
+# Plans never span more quarters than this
+MAX_QUARTERS = 24
+
+
+def get_credits(credits):
+    """Finds the number of credits of a course
+    @params
+        'credits': Credits in the Course Catalogs (i.e '5' or '1-5, max. 15')
+    Returns
+        Smallest number of credits of the course
+    """
+    match = re.search(r'\d+(\.\d+)?', credits or '')
+    return float(match.group()) if match else DEFAULT_CREDITS
+
+
+def next_quarter():
+    # First quarter after the current one, i.e ('AUT', 2026) in July 2026
+    now = time.localtime()
+    i = (now.tm_mon - 1) // 3 + 1
+    return (QUARTERS[i], now.tm_year) if i < len(QUARTERS) else (QUARTERS[0], now.tm_year + 1)
+
+
+def get_terms(start, count, summer=False):
+    """Lists the quarters of a plan
+    @params
+        'start': Tuple with the first quarter (i.e AUT) and its year
+        'count': Number of quarters to list
+        'summer': Include summer quarters
+    Returns
+        List of (quarter, year) tuples
+    """
+    quarter, year = start
+    i = QUARTERS.index(quarter)
+    terms = []
+    while len(terms) < count:
+        if QUARTERS[i] != 'SUM' or summer:
+            terms.append((QUARTERS[i], year))
+        i += 1
+        if i == len(QUARTERS):
+            i, year = 0, year + 1
+    return terms
+
+
+class Offerings:
+    def __init__(self, path):
+        """Courses offered in every quarter, read from the Time Schedules in 'path'/Time_Schedules
+        @params
+            'path': The 'static' directory
+        """
+        self.path = os.path.join(path, 'Time_Schedules')
+        self.signature = None
+        self.offerings = {}
+        self.lock = threading.Lock()
+
+    def get(self):
+        """Finds the courses offered in every quarter, reading the Time Schedules again if they changed
+        Returns
+            Dictionary of quarters (i.e AUT) to the set of courses offered in that quarter of any
+            year with a Time Schedule. Quarters without a Time Schedule are missing.
+        """
+        if not os.path.isdir(self.path):
+            return {}
+        files = sorted(
+            (entry.name, entry.stat().st_mtime_ns, entry.stat().st_size) for entry in os.scandir(self.path)
+            if re.fullmatch(r'\d{4}(WIN|SPR|SUM|AUT)\.json', entry.name)
+        )
+        with self.lock:
+            if files != self.signature:
+                offerings = {}
+                for name, _, _ in files:
+                    with open(os.path.join(self.path, name), mode='r') as f:
+                        offerings.setdefault(name[4:7], set()).update(json.loads(f.read()))
+                self.signature, self.offerings = files, offerings
+            return self.offerings
+
+
+class Planner:
+    def __init__(self, graph, completed=()):
+        """Finds which courses to take for a set of courses
+        @params
+            'graph': The Prerequisite Graph of all courses
+            'completed': Courses already taken
+        """
+        self.graph = graph
+        self.completed = set(completed)
+        # Requisite groups of every course looked at
+        self.groups = {}
+        # Earliest quarter every course can be taken in, ignoring credits and offerings
+        self.earliest = {}
+        # Requisite chosen for every unsatisfied group of a course by its type and group
+        self.picks = {}
+
+    def requisite_groups(self, course):
+        # Lists of interchangeable prerequisites and co-requisites of a course
+        if course not in self.groups:
+            groups = ({}, {})
+            for requisite, requisite_type, group in self.graph.requisites(course):
+                groups[requisite_type].setdefault(group, []).append(requisite)
+            self.groups[course] = tuple(list(by_group.values()) for by_group in groups)
+        return self.groups[course]
+
+    def solve(self, targets, max_quarters=MAX_QUARTERS):
+        """Finds the earliest quarter every course needed for 'targets' can be taken in, ignoring
+        credits and offerings. Every course starts in the first quarter and is moved later until
+        all its requisite groups are satisfied. Courses that can only be taken after themselves
+        keep moving past the number of courses or 'max_quarters', which no plan reaches, and
+        are impossible.
+        @params
+            'targets': Courses to take
+            'max_quarters': Maximum number of quarters of the plan
+        """
+        # Courses reachable through any requisite and the courses requiring each of them
+        dependents = {}
+        stack = [course for course in targets if course not in self.completed]
+        while stack:
+            course = stack.pop()
+            if course in dependents:
+                continue
+            dependents[course] = []
+            for groups in self.requisite_groups(course):
+                for group in groups:
+                    stack.extend(option for option in group if option not in self.completed)
+        for course in dependents:
+            for groups in self.requisite_groups(course):
+                for option in {option for group in groups for option in group}:
+                    if option in dependents:
+                        dependents[option].append(course)
+
+        # Every round of a cycle moves its courses one quarter later, so the limit bounds the rounds
+        limit = min(len(dependents), max_quarters) + 1
+        self.earliest = dict.fromkeys(dependents, 1)
+        queue = deque(dependents)
+        queued = set(dependents)
+        while queue:
+            course = queue.popleft()
+            queued.discard(course)
+            prerequisites, corequisites = self.requisite_groups(course)
+            quarter = max(
+                [1] + [min(map(self.earliest_quarter, group)) + 1 for group in prerequisites] +
+                [min(map(self.earliest_quarter, group)) for group in corequisites]
+            )
+            if quarter > limit:
+                quarter = math.inf
+            if quarter != self.earliest[course]:
+                self.earliest[course] = quarter
+                for dependent in dependents[course]:
+                    if dependent not in queued:
+                        queue.append(dependent)
+                        queued.add(dependent)
+
+    def earliest_quarter(self, course):
+        """Finds the earliest quarter a course can be taken in, ignoring credits and offerings
+        @params
+            'course': A course needed for the targets passed to 'solve'
+        Returns
+            Number of the quarter (1 for the first quarter of the plan), 0 if the course was
+            already taken or infinity if its prerequisites can never be satisfied
+        """
+        if course in self.completed:
+            return 0
+        return self.earliest[course]
+
+    def choose(self, targets):
+        """Chooses the requisites to take for every unsatisfied OR-group
+        @params
+            'targets': Courses to take
+        Returns
+            List of all courses to take, including the targets
+        """
+        required = {}
+        stack = list(reversed(targets))
+        while stack:
+            course = stack.pop()
+            if course in required or course in self.completed:
+                continue
+            required[course] = None
+            self.picks[course] = {}
+            for requisite_type, groups in enumerate(self.requisite_groups(course)):
+                for i, group in enumerate(groups):
+                    if any(option in self.completed for option in group):
+                        continue
+                    # Earliest option first, then options that are taken anyway
+                    pick = min(group, key=lambda option: (
+                        self.earliest_quarter(option), option not in required, self.graph.index[option]
+                    ))
+                    self.picks[course][(requisite_type, i)] = pick
+                    stack.append(pick)
+        return list(required)
+
+    def heights(self, courses):
+        """Finds the length of the longest chain of courses depending on every course
+        @params
+            'courses': Courses to take as returned by 'choose'
+        Returns
+            Dictionary of courses to the number of quarters from their quarter to the end of the plan
+        """
+        dependents = {course: [] for course in courses}
+        for course in courses:
+            for (requisite_type, _), pick in self.picks[course].items():
+                dependents[pick].append((course, 1 - requisite_type))
+        heights = {}
+
+        def height(course):
+            if course not in heights:
+                heights[course] = 1
+                heights[course] = max(
+                    [1] + [height(dependent) + offset for dependent, offset in dependents[course]]
+                )
+            return heights[course]
+
+        for course in courses:
+            height(course)
+        return heights
+
+
+def make_plan(graph, targets, completed=(), records=None, max_credits=15, start=None,
+              offerings=None, summer=False, max_quarters=MAX_QUARTERS):
+    """Plans the quarters to take a set of courses in
+    @params
+        'graph': The Prerequisite Graph of all courses
+        'targets': Courses to take (i.e ['EE235', 'EE233'])
+        'completed': Courses already taken
+        'records': Dictionary of courses to their Course Catalog entries, used for the credits
+        'max_credits': Maximum number of credits per quarter. Raises ValueError if it is not a
+                       positive number.
+        'start': Tuple with the first quarter of the plan (i.e AUT) and its year, defaults to
+                 the quarter after the current one
+        'offerings': Dictionary of quarters to the courses offered in them (see 'Offerings').
+                     Courses can be taken in any quarter without a Time Schedule.
+        'summer': Plan summer quarters
+        'max_quarters': Maximum number of quarters of the plan
+    Returns
+        Dictionary with the number of 'quarters' of the plan, a 'lower_bound' on the number of
+        quarters needed, the courses of every quarter in 'plan', the courses that are 'unknown'
+        or 'unschedulable' and the courses left 'unplanned' after 'max_quarters' quarters
+    """
+    if not 0 < max_credits < math.inf:
+        raise ValueError(f'max_credits must be positive, not {max_credits}')
+    records = records or {}
+    offerings = offerings or {}
+    planner = Planner(graph, completed)
+    unknown = [course for course in targets if course not in graph]
+    targets = [course for course in targets if course in graph]
+    planner.solve(targets, max_quarters)
+    unschedulable = [course for course in targets if planner.earliest_quarter(course) == math.inf]
+    courses = planner.choose([course for course in targets if course not in unschedulable])
+    heights = planner.heights(courses)
+    credits = {course: get_credits(records.get(course, {}).get('Credits')) for course in courses}
+    terms = get_terms(start or next_quarter(), max_quarters, summer)
+
+    placed = dict.fromkeys(planner.completed, 0)
+    remaining = set(courses)
+
+    def bundle(course, quarter, offered):
+        # Course and the co-requisites it has to be taken with, None if it can not be taken yet
+        members = []
+
+        def add(member):
+            # Adds a course and its co-requisites to 'members', False if one can not be taken
+            if member in members:
+                return True
+            if offered is not None and member not in offered:
+                return False
+            prerequisites, corequisites = planner.requisite_groups(member)
+            if any(all(placed.get(option, math.inf) >= quarter for option in group) for group in prerequisites):
+                return False
+            members.append(member)
+            for i, group in enumerate(corequisites):
+                if any(placed.get(option, math.inf) <= quarter for option in group):
+                    continue
+                # The chosen option first, then the other options of the group
+                pick = planner.picks.get(member, {}).get((1, i))
+                options = [pick] if pick is not None else []
+                options += [
+                    option for option in group
+                    if option != pick and planner.earliest_quarter(option) < math.inf
+                ]
+                size = len(members)
+                for option in options:
+                    if add(option):
+                        break
+                    del members[size:]
+                else:
+                    return False
+            return True
+
+        return members if add(course) else None
+
+    # Requisite groups every course was chosen for
+    wanted = set(targets)
+    chosen_for = {}
+    for course, picks in planner.picks.items():
+        for (requisite_type, i), pick in picks.items():
+            chosen_for.setdefault(pick, []).append(planner.requisite_groups(course)[requisite_type][i])
+
+    def needed(course):
+        # Targets and courses chosen for a group none of whose other options were taken
+        return course in wanted or any(
+            all(option == course or option not in placed for option in group) for group in chosen_for.get(course, [])
+        )
+
+    order = sorted(courses, key=lambda course: (-heights[course], graph.index[course]))
+    plan = []
+    idle = 0
+    exhausted = True
+    for quarter, (term, year) in enumerate(terms, 1):
+        if not remaining:
+            break
+        offered = offerings.get(term)
+        taken, total = [], 0
+        changed = True
+        while changed:
+            changed = False
+            for course in order:
+                if course not in remaining:
+                    continue
+                if not needed(course):
+                    remaining.discard(course)
+                    continue
+                members = bundle(course, quarter, offered)
+                if members is None:
+                    continue
+                # Other options of a co-requisite group are not in 'credits' yet
+                for member in members:
+                    if member not in credits:
+                        credits[member] = get_credits(records.get(member, {}).get('Credits'))
+                bundle_credits = sum(credits[member] for member in members)
+                # Courses with more credits than the limit are taken alone
+                if taken and total + bundle_credits > max_credits:
+                    continue
+                for member in members:
+                    placed[member] = quarter
+                    remaining.discard(member)
+                    taken.append(member)
+                total += bundle_credits
+                changed = True
+        plan.append({'quarter': f'{term} {year}', 'courses': taken, 'credits': total})
+        idle = 0 if taken else idle + 1
+        # Nothing was taken for a whole year, so the remaining courses are never offered
+        if idle >= (4 if summer else 3):
+            exhausted = False
+            break
+    while plan and not plan[-1]['courses']:
+        plan.pop()
+
+    # Courses never offered and chosen requisites no longer needed are left out of the lower bound
+    remaining = sorted(remaining, key=graph.index.get)
+    schedulable = [course for term in plan for course in term['courses']] + (remaining if exhausted else [])
+    lower_bound = max(
+        [0] + [planner.earliest_quarter(course) for course in schedulable] +
+        [math.ceil(sum(credits[course] for course in schedulable) / max_credits)]
+    )
+    return {
+        'quarters': len(plan),
+        'lower_bound': lower_bound,
+        'plan': plan,
+        'unknown': unknown,
+        'unschedulable': unschedulable + ([] if exhausted else remaining),
+        'unplanned': remaining if exhausted else [],
+    }
@@ -0,0 +1,126 @@
+"""
+Alex Eidt
+
+Renders the Prerequisite Trees of every course and department ahead of time, so the first
+visitors after a Course Catalog update do not have to wait for them.
+
+Trees are rendered in parallel on all CPUs. A manifest of what every tree looked like is
+kept next to the trees. On later runs, trees that did not change since the last Course
+Catalog version are copied from the previous version instead of being rendered again.
+
+Usage:
+    python prerender.py [--workers N] [--force]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+from multiprocessing import Pool
+from time import perf_counter
+import pandas as pd
+from create_tree import CACHE, PATH, build_department, build_tree
+from prereq_graph import PrereqGraph
+from svg_tree import render
+
+
+# Trees link to courses relative to the root of the site, like the trees rendered by app.py
+URL = '/'
+MANIFEST_PATH = os.path.join(PATH, 'manifest.json')
+BUILDERS = {'tree': build_tree, 'department': build_department}
+
+# Set in every worker by 'init'
+GRAPH = None
+MANIFEST = {}
+
+
+def init(graph, manifest):
+    global GRAPH, MANIFEST
+    GRAPH = graph
+    MANIFEST = manifest
+
+
+def fingerprint(tree):
+    # Hash of everything that ends up in the SVG of the tree
+    data = json.dumps([tree.comment, tree.graph_attr, tree.statements], sort_keys=True)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+def prerender(job):
+    """Renders one tree unless it is cached or unchanged since the last run
+    @params
+        'job': Tuple with the kind of tree ('tree' or 'department') and the course or department
+    Returns
+        Tuple with the job, its manifest entry (or None) and what was done
+    """
+    kind, name = job
+    tree = BUILDERS[kind](GRAPH, name, URL)
+    if tree is None:
+        return job, None, 'skipped'
+    entry = {'fingerprint': fingerprint(tree), 'key': CACHE.key(kind, name, GRAPH.version, url=URL)}
+    path = CACHE.file_path(entry['key'])
+    if os.path.isfile(f'{path}.svg'):
+        return job, entry, 'cached'
+    previous = MANIFEST.get(f'{kind} {name}')
+    if previous and previous['fingerprint'] == entry['fingerprint']:
+        previous_path = f"{CACHE.file_path(previous['key'])}.svg"
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        try:
+            os.link(previous_path, temp_path)
+            os.replace(temp_path, f'{path}.svg')
+            return job, entry, 'reused'
+        except OSError:
+            pass
+    render(tree, path)
+    return job, entry, 'rendered'
+
+
+def main(workers=None, force=False):
+    start = perf_counter()
+    static = os.path.join(os.getcwd(), 'static')
+    csv_path = os.path.join(static, 'Course_Catalogs.csv')
+    catalogs = pd.read_csv(csv_path, dtype=str, index_col=0).fillna('')
+    graph = PrereqGraph.load(catalogs, csv_path)
+    with open(os.path.join(static, 'departments.json'), mode='r') as f:
+        departments = sorted({d for campus in json.loads(f.read()).values() for d in campus})
+
+    manifest = {}
+    if force:
+        CACHE.clear()
+    elif os.path.isfile(MANIFEST_PATH):
+        with open(MANIFEST_PATH, mode='r') as f:
+            manifest = json.loads(f.read())
+
+    jobs = [('tree', course) for course in graph.courses if graph.requisites(course, graph.campus(course))]
+    jobs += [('department', department) for department in departments]
+    print(f'Loaded {len(graph.courses)} courses in {perf_counter() - start:.2f} s, {len(jobs)} trees to check')
+
+    start = perf_counter()
+    counts = {'rendered': 0, 'reused': 0, 'cached': 0, 'skipped': 0}
+    new_manifest = {}
+    with Pool(workers, initializer=init, initargs=(graph, manifest)) as pool:
+        for i, (job, entry, status) in enumerate(pool.imap_unordered(prerender, jobs, chunksize=8), 1):
+            counts[status] += 1
+            if entry is not None:
+                new_manifest[' '.join(job)] = entry
+            if i % 100 == 0 or i == len(jobs):
+                elapsed = perf_counter() - start
+                stats = ', '.join(f'{status} {count}' for status, count in counts.items())
+                print(f'\r[{i}/{len(jobs)}] {i / elapsed:.1f} trees/s, {stats}', end='', flush=True)
+    print()
+
+    # Write the manifest atomically so an interrupted run keeps the previous one
+    temp_path = f'{MANIFEST_PATH}.{os.getpid()}.tmp'
+    with open(temp_path, mode='w') as f:
+        f.write(json.dumps(new_manifest))
+    os.replace(temp_path, MANIFEST_PATH)
+    print(f'Done in {perf_counter() - start:.2f} s')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Pre-render all Prerequisite Trees')
+    parser.add_argument('--workers', type=int, default=None, help='Number of processes, defaults to all CPUs')
+    parser.add_argument('--force', action='store_true', help='Remove all cached trees and render every tree')
+    args = parser.parse_args()
+    sys.exit(main(args.workers, args.force))
@@ -0,0 +1,206 @@
+"""
+Alex Eidt
+
+Compiled Prerequisite Graph of all courses in the UW Course Catalogs.
+
+Requisite strings are parsed once into integer indexed edge arrays. Every course has its
+forward edges (requisites of the course) and reverse edges (courses requiring the course)
+stored in compressed rows, so the tree builders never have to touch the DataFrame.
+"""
+
+import os
+import pickle
+import re
+from array import array
+import numpy as np
+import pandas as pd
+
+
+REQUISITE_TYPES = ['Prerequisites', 'Co-Requisites']
+# Courses separated by these are options of the same OR-group
+SPLIT_COURSE = re.compile(r'/|,|&&')
+# Version of the compiled format. Persisted graphs with another version are rebuilt.
+VERSION = 2
+
+
+def to_array(values):
+    # Compact integer array that does not depend on numpy to be read
+    return array('i', np.asarray(values, dtype=np.int32).tobytes())
+
+
+def to_rows(rows, size, *columns):
+    """Stores edges in compressed rows
+    @params
+        'rows': Row of every edge
+        'size': Number of rows
+        'columns': Values of every edge, one array per value
+    Returns
+        Tuple with the row offsets and the values of every edge sorted by row. Edges in
+        the same row keep their relative order.
+    """
+    order = np.argsort(rows, kind='stable')
+    offsets = np.zeros(size + 1, dtype=np.int32)
+    np.cumsum(np.bincount(rows, minlength=size), out=offsets[1:])
+    return (to_array(offsets), *(to_array(column[order]) for column in columns))
+
+
+def parse_requisites(course_df):
+    """Parses the requisites of every course in one vectorized pass
+    @params
+        'course_df': The DataFrame of courses
+    Returns
+        DataFrame with one row per edge and the columns 'course' and 'target' (positions of the
+        course and its requisite in 'course_df'), 'type' (index into REQUISITE_TYPES) and
+        'group' (OR-group of the requisite). Edges of a course keep their catalog order.
+    """
+    positions = pd.Series(np.arange(len(course_df)), index=course_df.index)
+    frames = []
+    for requisite_type, column in enumerate(REQUISITE_TYPES):
+        groups = pd.Series(course_df[column].to_numpy(dtype=object), name='option')
+        groups = groups.str.split(';').explode()
+        edges = groups.to_frame()
+        edges['course'] = groups.index.to_numpy()
+        edges['group'] = groups.groupby(level=0).cumcount().to_numpy()
+        edges['type'] = requisite_type
+        frames.append(edges.reset_index(drop=True))
+    edges = pd.concat(frames, ignore_index=True)
+    edges['option'] = edges['option'].str.split(SPLIT_COURSE.pattern)
+    edges = edges.explode('option')
+    edges = edges[(edges['option'] != 'POI') & edges['option'].isin(positions.index)]
+    edges['target'] = positions.reindex(edges['option']).to_numpy()
+    return edges[['course', 'target', 'type', 'group']].astype(np.int32)
+
+
+class PrereqGraph:
+    def __init__(self, course_df, version=None):
+        """Parses the requisites of every course in the Course Catalogs
+        @params
+            'course_df': The DataFrame of courses
+            'version': Version of the Course Catalogs, used to invalidate cached trees
+        """
+        self.version = version
+        self.courses = list(course_df.index)
+        self.index = {course: i for i, course in enumerate(self.courses)}
+        self.campuses = sorted(set(course_df['Campus']))
+        self.departments = sorted(set(course_df['Department Name']))
+        self.campus_codes = to_array(
+            pd.Categorical(course_df['Campus'], categories=self.campuses).codes
+        )
+        department_codes = pd.Categorical(course_df['Department Name'], categories=self.departments).codes
+        self.department_codes = to_array(department_codes)
+        # Courses of every department in compressed rows, so departments are looked up directly
+        self.department_index = {department: i for i, department in enumerate(self.departments)}
+        self.department_offsets, self.department_members = to_rows(
+            department_codes, len(self.departments), np.arange(len(self.courses))
+        )
+
+        edges = parse_requisites(course_df)
+        course, target = edges['course'].to_numpy(), edges['target'].to_numpy()
+        requisite_type, group = edges['type'].to_numpy(), edges['group'].to_numpy()
+        self.offsets, self.targets, self.types, self.groups = to_rows(
+            course, len(self.courses), target, requisite_type, group
+        )
+        self.reverse_offsets, self.sources, self.reverse_types = to_rows(
+            target, len(self.courses), course, requisite_type
+        )
+
+    @classmethod
+    def load(cls, course_df, csv_path):
+        """Loads the graph persisted in the 'data' directory next to the directory of the
+        Course Catalogs, rebuilding it if the Course Catalogs changed since it was persisted.
+        The graph is unpickled, so it is never stored in the publicly served 'static' directory.
+        @params
+            'course_df': The DataFrame of courses
+            'csv_path': Path of the Course Catalogs the DataFrame was read from
+        """
+        stat = os.stat(csv_path)
+        signature = (VERSION, stat.st_mtime_ns, stat.st_size)
+        csv_path = os.path.abspath(csv_path)
+        name = os.path.splitext(os.path.basename(csv_path))[0]
+        data_path = os.path.join(os.path.dirname(os.path.dirname(csv_path)), 'data')
+        graph_path = os.path.join(data_path, f'{name}.graph')
+        # Graphs persisted next to the Course Catalogs by older versions could be downloaded
+        if os.path.isfile(f'{os.path.splitext(csv_path)[0]}.graph'):
+            os.remove(f'{os.path.splitext(csv_path)[0]}.graph')
+        if os.path.isfile(graph_path):
+            with open(graph_path, mode='rb') as f:
+                persisted_signature, graph = pickle.load(f)
+            if persisted_signature == signature:
+                return graph
+        graph = cls(course_df, f'{stat.st_mtime_ns:x}-{stat.st_size:x}')
+        # Write to a temporary file first so other workers never read a partial graph
+        os.makedirs(data_path, exist_ok=True)
+        temp_path = f'{graph_path}.{os.getpid()}.tmp'
+        with open(temp_path, mode='wb') as f:
+            pickle.dump((signature, graph), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, graph_path)
+        return graph
+
+    def __contains__(self, course):
+        return course in self.index
+
+    def campus(self, course):
+        return self.campuses[self.campus_codes[self.index[course]]]
+
+    def department(self, course):
+        return self.departments[self.department_codes[self.index[course]]]
+
+    def department_courses(self, department):
+        """Finds all courses in a department
+        @params
+            'department': The department in question
+        Returns
+            List of courses in catalog order
+        """
+        code = self.department_index.get(department)
+        if code is None:
+            return []
+        start, end = self.department_offsets[code], self.department_offsets[code + 1]
+        return [self.courses[i] for i in self.department_members[start:end]]
+
+    def requisites(self, course, campus=None, requisite_type=None):
+        """Finds the requisites of a course in the order they appear in the Course Catalogs
+        @params
+            'course': The course in question
+            'campus': Only include requisites offered at this campus
+            'requisite_type': Only include requisites of this type (index into REQUISITE_TYPES)
+        Returns
+            List of (requisite, requisite type, OR-group) tuples. Requisites in the same
+            OR-group are interchangeable.
+        """
+        if course not in self.index:
+            return []
+        i = self.index[course]
+        campus_code = self.campuses.index(campus) if campus in self.campuses else None
+        requisites = []
+        for edge in range(self.offsets[i], self.offsets[i + 1]):
+            target = self.targets[edge]
+            if campus is not None and self.campus_codes[target] != campus_code:
+                continue
+            if requisite_type is not None and self.types[edge] != requisite_type:
+                continue
+            requisites.append((self.courses[target], self.types[edge], self.groups[edge]))
+        return requisites
+
+    def dependents(self, course, campus=None, requisite_type=None):
+        """Finds the courses that have 'course' as a requisite
+        @params
+            'course': The course in question
+            'campus': Only include courses offered at this campus
+            'requisite_type': Only include courses requiring 'course' as this type
+        Returns
+            List of courses without duplicates in catalog order
+        """
+        if course not in self.index:
+            return []
+        i = self.index[course]
+        campus_code = self.campuses.index(campus) if campus in self.campuses else None
+        dependents = {}
+        for edge in range(self.reverse_offsets[i], self.reverse_offsets[i + 1]):
+            source = self.sources[edge]
+            if campus is not None and self.campus_codes[source] != campus_code:
+                continue
+            if requisite_type is not None and self.reverse_types[edge] != requisite_type:
+                continue
+            dependents[source] = None
+        return [self.courses[source] for source in sorted(dependents)]
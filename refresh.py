@@ -0,0 +1,143 @@
+"""
+Alex Eidt
+
+Refreshes the Course Catalogs and Time Schedules in the background.
+
+Scraping UW takes minutes, so jobs run in a background thread instead of the request that
+started them. New data files are written to their own directory in 'static/versions' and
+then swapped in with a single rename, so workers never read a partially written file.
+Workers watch the data files and load new versions in the background as well.
+"""
+
+import os
+import shutil
+import threading
+import time
+import traceback
+
+
+def signature(file_path):
+    try:
+        stat = os.stat(file_path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+class Refresher:
+    def __init__(self, path, max_versions=3):
+        """Creates the refresher
+        @params
+            'path': The 'static' directory with the data files
+            'max_versions': Number of versions of every data file kept in 'path'/versions
+        """
+        self.path = path
+        self.max_versions = max_versions
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def start(self, name, function, *args):
+        """Runs a job in a background thread unless a job with the same name is running
+        @params
+            'name': Name of the job (i.e catalogs)
+            'function': Function run by the job
+            'args': Arguments of 'function'
+        Returns
+            True if the job was started, False if it is already running
+        """
+        with self.lock:
+            if self.jobs.get(name, {}).get('state') == 'running':
+                return False
+            self.jobs[name] = {'state': 'running', 'started': time.time(), 'finished': None, 'error': None}
+        threading.Thread(target=self.run, args=(name, function, args), daemon=True).start()
+        return True
+
+    def run(self, name, function, args):
+        try:
+            function(*args)
+            state, error = 'done', None
+        except Exception:
+            state, error = 'failed', traceback.format_exc()
+        with self.lock:
+            self.jobs[name] = {**self.jobs[name], 'state': state, 'finished': time.time(), 'error': error}
+
+    def status(self):
+        with self.lock:
+            return {name: dict(job) for name, job in self.jobs.items()}
+
+    def publish(self, name, write):
+        """Writes a new version of a data file and swaps it in atomically
+        @params
+            'name': Path of the data file relative to 'path' (i.e Course_Catalogs.csv or
+                    Time_Schedules/2026AUT.json)
+            'write': Function writing the new data file to the path it is given
+        Returns
+            Directory of the new version
+        """
+        versions = os.path.join(self.path, 'versions')
+        # Versions are named by the time they were written so sorting them sorts them by age
+        now = time.time_ns()
+        version = os.path.join(
+            versions, f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(now // 10 ** 9))}-{now % 10 ** 9:09d}-{os.getpid()}"
+        )
+        os.makedirs(os.path.dirname(os.path.join(version, name)))
+        write(os.path.join(version, name))
+        # The new version is linked next to the data file and renamed over it. Readers that
+        # already opened the data file keep reading the previous version.
+        os.makedirs(os.path.dirname(os.path.join(self.path, name)), exist_ok=True)
+        temp_path = os.path.join(self.path, f'{name}.{os.getpid()}.tmp')
+        try:
+            os.link(os.path.join(version, name), temp_path)
+        except OSError:
+            shutil.copyfile(os.path.join(version, name), temp_path)
+        os.replace(temp_path, os.path.join(self.path, name))
+
+        # Remove the oldest versions of this data file
+        old = sorted(
+            entry.path for entry in os.scandir(versions)
+            if entry.is_dir() and os.path.isfile(os.path.join(entry.path, name))
+        )
+        for directory in old[:-self.max_versions]:
+            shutil.rmtree(directory, ignore_errors=True)
+        return version
+
+
+class Watcher:
+    def __init__(self, file_path, load, interval=1.0):
+        """Watches a data file loaded in memory
+        @params
+            'file_path': Path of the data file
+            'load': Function loading the data file and swapping it in
+            'interval': Minimum number of seconds between checks of the data file
+        """
+        self.file_path = file_path
+        self.load = load
+        self.interval = interval
+        self.signature = signature(file_path)
+        self.checked = time.monotonic()
+        self.loading = False
+        self.lock = threading.Lock()
+
+    def check(self):
+        # Starts loading the data file in the background if it changed since it was last loaded
+        now = time.monotonic()
+        with self.lock:
+            if self.loading or now - self.checked < self.interval:
+                return
+            self.checked = now
+            current = signature(self.file_path)
+            if current is None or current == self.signature:
+                return
+            self.loading = True
+        threading.Thread(target=self.reload, args=(current,), daemon=True).start()
+
+    def reload(self, current):
+        try:
+            self.load()
+        except Exception:
+            # The data in memory is kept until the data file changes again
+            traceback.print_exc()
+        finally:
+            with self.lock:
+                self.signature = current
+                self.loading = False
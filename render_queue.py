@@ -0,0 +1,96 @@
+"""
+Alex Eidt
+
+Renders Prerequisite Trees in a pool of background processes.
+
+Requests for a tree that is already being rendered share the same job, so every tree is
+only rendered once no matter how many users request it at the same time. Failed renders are
+remembered for a while, so clients polling for the tree get the error instead of a new job.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from metrics import PHASE_LATENCY
+from svg_tree import render
+
+
+# Seconds a failed render is remembered before the tree is rendered again
+FAILURE_SECONDS = 300
+# Maximum number of failed renders remembered
+MAX_FAILURES = 1000
+
+
+class RenderQueue:
+    def __init__(self, max_workers=None):
+        """Creates the queue. The process pool is only started when the first tree is rendered,
+        so web servers forking workers after import each get their own pool.
+        @params
+            'max_workers': Number of render processes, defaults to the number of CPUs
+        """
+        self.max_workers = max_workers or os.cpu_count()
+        self.executor = None
+        self.jobs = {}
+        # Error message and time of the failed renders by cache key
+        self.failures = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Finds the job rendering a tree
+        @params
+            'key': Cache key of the tree
+        Returns
+            Future of the job or None if the tree is not being rendered
+        """
+        with self.lock:
+            return self.jobs.get(key)
+
+    def failure(self, key):
+        """Finds why a tree could not be rendered
+        @params
+            'key': Cache key of the tree
+        Returns
+            Error message of the last render of the tree if it failed in the last
+            FAILURE_SECONDS seconds, otherwise None
+        """
+        with self.lock:
+            error, failed = self.failures.get(key, (None, 0))
+            if error is not None and time.monotonic() - failed > FAILURE_SECONDS:
+                del self.failures[key]
+                return None
+            return error
+
+    def submit(self, key, tree, path):
+        """Renders 'tree' to 'path' + '.svg' unless the tree is already being rendered
+        @params
+            'key': Cache key of the tree
+            'tree': The tree to render
+            'path': Path of the SVG without the '.svg' extension
+        Returns
+            Future of the job rendering the tree
+        """
+        with self.lock:
+            if key in self.jobs:
+                return self.jobs[key]
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            job = self.executor.submit(render, tree, path)
+            self.jobs[key] = job
+        start = time.perf_counter()
+        job.add_done_callback(lambda _: self.finish(key, job, start))
+        return job
+
+    def finish(self, key, job, start):
+        # Time from queueing the tree until its SVG is written
+        PHASE_LATENCY.observe(time.perf_counter() - start, phase='tree_render')
+        error = None if job.cancelled() or job.exception() is None else job.exception()
+        with self.lock:
+            if self.jobs.get(key) is job:
+                del self.jobs[key]
+            if error is not None:
+                self.failures[key] = (f'{type(error).__name__}: {error}', time.monotonic())
+                self.failures.move_to_end(key)
+                if len(self.failures) > MAX_FAILURES:
+                    self.failures.popitem(last=False)
@@ -4,11 +4,24 @@ Alex Eidt
 Finds all combinations of classes given a list of courses to search.
 """
 
-from json import dump, loads
+from json import JSONDecoder, dump, dumps, loads
+from re import compile as re_compile
 from re import search as re_search
-from os import path, getcwd
-from itertools import chain, combinations, product, filterfalse
-from time import strftime, strptime
+from hashlib import sha1
+from os import path, cpu_count, getcwd, getpid, makedirs, remove, replace
+from array import array
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FuturesTimeout
+from heapq import heappush, heapreplace
+from itertools import chain, combinations, islice, product, takewhile
+from itertools import count as count_up
+from math import asin, cos, radians, sin, sqrt
+from time import perf_counter, strftime, strptime, time
+from filecmp import cmp
+from shutil import copyfile
+import threading
+import tracemalloc
 import uwtools
 
 # --------------------------Time Methods--------------------------#       
@@ -20,6 +33,23 @@ convert_pm = lambda t, pm: f'{pm[0]} {switch_pm(pm[-1])}' if check_convert_pm(t)
 switch_pm = lambda t: 'AM' if t.strip() == 'PM' else 'PM'
 # --------------------------Time Methods--------------------------#    
 
+# Sections are compiled into a bitmask covering the week in 5 minute slots.
+# Two sections overlap if the bitwise AND of their masks is non-zero.
+DAYS = ['M', 'T', 'W', 'Th', 'F', 'S']
+SLOT_MINUTES = 5
+DAY_SLOTS = 24 * 60 // SLOT_MINUTES
+DAY_MASK = (1 << DAY_SLOTS) - 1
+# ConflictMatrix searched by a worker process of 'parallel_combinations' and the maximum
+# number of schedules a process sends back at once
+MATRIX = None
+PARALLEL_CHUNK = 20000
+# Process pool of the last parallel search with its number of processes, ConflictMatrix and
+# number of searches using it. Later searches of the same matrix reuse it.
+POOL = {'pool': None, 'workers': None, 'matrix': None, 'searches': 0}
+POOL_LOCK = threading.Lock()
+# Times without a 'P' before this hour are in the afternoon. UW classes start at 7:00 AM.
+EARLIEST_HOUR = 7
+
 
 def has_overlap(time1, time2):
     """Checks if the two times overlap
@@ -64,6 +94,99 @@ def get_days(offered):
     return result
 
 
+def get_minutes(time):
+    """Converts a time range of the Time Schedule into minutes since midnight. Times followed
+    by 'P' are in the evening. Otherwise, hours before 'EARLIEST_HOUR' are in the afternoon
+    and 12 is noon.
+    @params
+        'time': Time range of a section
+        Example: '1030-1120', '130-220' or '630-920P'
+    Returns
+        Tuple with the start and end of the time range in minutes. None if 'time' is not a
+        time range (i.e 'to be arranged').
+    """
+    match = re_search(r'^(\d{1,2})(\d\d)-(\d{1,2})(\d\d)(P?)$', time)
+    if not match:
+        return None
+    start_hour, start_minute, end_hour, end_minute, pm = match.groups()
+    start, end = [
+        (hour + (12 if hour < 12 and (pm or hour < EARLIEST_HOUR) else 0)) * 60 + int(minute)
+        for hour, minute in [(int(start_hour), start_minute), (int(end_hour), end_minute)]
+    ]
+    # Ranges crossing noon have only one side in the afternoon (i.e '1030-630' or '1130-120P')
+    if start > end:
+        if end < 12 * 60:
+            end += 12 * 60
+        else:
+            start -= 12 * 60
+    return start, end
+
+
+def get_section_meetings(section):
+    """Finds the meetings of a section on every day. The meetings are stored in the Organized
+    Time Schedule by 'main', so the time strings are only parsed for older Time Schedules.
+    @params
+        'section': Dictionary representing a LECT/QZ/LB/ST section
+    Returns
+        List of [day, start, end, building] lists with start and end in minutes since midnight
+    """
+    if 'Meetings' in section:
+        return section['Meetings']
+    meetings = []
+    for days, time, building in zip(section['Days'], section['Time'], section['Building']):
+        minutes = get_minutes(time)
+        if minutes is None:
+            continue
+        for day in sorted(get_days(days), key=DAYS.index):
+            meetings.append([day, minutes[0], minutes[1], building])
+    return meetings
+
+
+def time_mask(day, start, end):
+    """Creates the bitmask for a single meeting of a section
+    @params
+        'day': Abbreviated day of the meeting (see 'DAYS')
+        'start': Start of the meeting in minutes since midnight
+        'end': End of the meeting in minutes since midnight
+    Returns
+        Integer with the bits of every 5 minute slot touched by the meeting set
+    """
+    first, last = start // SLOT_MINUTES, max(start, end) // SLOT_MINUTES
+    return ((1 << (last - first + 1)) - 1) << (DAYS.index(day) * DAY_SLOTS + first)
+
+
+def section_mask(section):
+    """Creates the bitmask for all meetings of a section
+    @params
+        'section': Dictionary representing a LECT/QZ/LB/ST section
+    Returns
+        Integer with the bits of every 5 minute slot the section meets in set
+    """
+    mask = 0
+    for day, start, end, _ in get_section_meetings(section):
+        mask |= time_mask(day, start, end)
+    return mask
+
+
+def compile_option(option, masks):
+    """Creates the bitmask for one Lecture/Quiz/Lab/Studio combination of a course
+    @params
+        'option': Tuple of section dictionaries
+        'masks': Dictionary mapping section ids to bitmasks, used to compile
+                 every section only once
+    Returns
+        Bitmask of the combination or None if the sections overlap each other
+    """
+    mask = 0
+    for section in option:
+        if id(section) not in masks:
+            masks[id(section)] = section_mask(section)
+        if mask & masks[id(section)]:
+            return None
+        mask |= masks[id(section)]
+    return mask
+
+
 def check_overlap(schedule):
     """Checks if the courses in the 'schedule' overlap
     @params
@@ -92,16 +215,14 @@ def check_overlap(schedule):
     return False
 
 
-def get_combinations(planned_courses):
-    """Finds all possible combinations of the courses in 'planned_courses'
-    such that no sections of any course overlap
+def get_options(courses_offered, planned_courses):
+    """Finds all Lecture/Quiz/Lab/Studio combinations of every course in 'planned_courses'
     @params
+        'courses_offered': Organized Time Schedule (see 'main')
         'planned_courses': List of courses to find combinations from
     Returns
-        Generator object with all valid combinations of courses
+        List with a list of section combinations for every course
     """
-    with open(path.join(getcwd(), 'static', 'Time_Schedules.json'), mode='r') as f:
-        courses_offered = loads(f.read())
     total = []
     for course in planned_courses:
         course_sections = []
@@ -119,103 +240,847 @@ def get_combinations(planned_courses):
             products.append([section['LECT']])
             course_sections.append(list(product(*products)))
         total.append([y for x in course_sections for y in x])
-    # Find all course combinations where there are no course overlaps
-    for combo in filterfalse(lambda x: check_overlap(x), product(*total)):
+    return total
+
+
+def backtrack(masks, start=None):
+    """Depth first search over the section combinations of every course. A partial schedule
+    is rejected as soon as two of its sections overlap, so the remaining courses are never
+    searched for it.
+    @params
+        'masks': List with a list of combination bitmasks for every course
+        'start': Indices of a previously found schedule to resume the search after
+    Returns
+        Generator object with the indices of the chosen combination of every course
+    """
+    if not masks or not all(masks):
+        return
+    indices = [-1] * len(masks)
+    # 'used[depth]' is the bitmask of all sections chosen for the courses before 'depth'
+    used = [0] * len(masks)
+    depth = 0
+    if start is not None:
+        indices = list(start)
+        for depth in range(len(masks) - 1):
+            used[depth + 1] = used[depth] | masks[depth][indices[depth]]
+        depth = len(masks) - 1
+    while depth >= 0:
+        indices[depth] += 1
+        if indices[depth] == len(masks[depth]):
+            indices[depth] = -1
+            depth -= 1
+            continue
+        mask = masks[depth][indices[depth]]
+        if used[depth] & mask:
+            continue
+        if depth == len(masks) - 1:
+            yield tuple(indices)
+        else:
+            used[depth + 1] = used[depth] | mask
+            depth += 1
+
+
+class ConflictMatrix:
+    def __init__(self, masks):
+        """Precomputes which combinations of every pair of courses overlap
+        @params
+            'masks': List with a list of combination bitmasks for every course, in search order
+        """
+        self.sizes = [len(course) for course in masks]
+        # 'compatible[i][a][k]' is a bitset of the combinations of course i + k + 1 that do not
+        # overlap combination a of course i
+        self.compatible = []
+        for i, course in enumerate(masks):
+            rows = []
+            for mask in course:
+                row = []
+                for other in masks[i + 1:]:
+                    bits = 0
+                    for b, other_mask in enumerate(other):
+                        if not mask & other_mask:
+                            bits |= 1 << b
+                    row.append(bits)
+                rows.append(row)
+            self.compatible.append(rows)
+
+    def search(self, start=None, prefix=()):
+        """Depth first search over the combinations of every course. After every choice, the
+        combinations left for the remaining courses are narrowed with the matrix, and a choice
+        leaving any course without combinations is rejected right away. Schedules are found in
+        the same order as 'backtrack'.
+        @params
+            'start': Indices of a previously found schedule to resume the search after
+            'prefix': Indices of the combinations of the first courses to search schedules with.
+                      Searches with consecutive prefixes find the schedules of a full search
+                      in the same order.
+        Returns
+            Generator object with the indices of the chosen combination of every course
+        """
+        count = len(self.sizes)
+        if not count or not all(self.sizes):
+            return
+        indices = [-1] * count
+        # 'allowed[depth]' has a bitset of the combinations still possible for every course
+        # from 'depth' on, given the choices before 'depth'
+        allowed = [None] * count
+        allowed[0] = [(1 << size) - 1 for size in self.sizes]
+        for i, index in enumerate(prefix):
+            allowed[0][i] &= 1 << index
+        depth = 0
+        if start is not None:
+            indices = list(start)
+            for depth in range(count - 1):
+                row = self.compatible[depth][indices[depth]]
+                allowed[depth + 1] = [bits & row[k] for k, bits in enumerate(allowed[depth][1:])]
+            depth = count - 1
+        last = count - 1
+        while depth >= 0:
+            if depth == last:
+                # Every combination left for the last course completes a schedule
+                bits = allowed[last][0] >> (indices[last] + 1) << (indices[last] + 1)
+                while bits:
+                    lowest = bits & -bits
+                    indices[last] = lowest.bit_length() - 1
+                    yield tuple(indices)
+                    bits ^= lowest
+                indices[last] = -1
+                depth -= 1
+                continue
+            # Next possible combination of the course after the current one
+            remaining = allowed[depth][0] >> (indices[depth] + 1)
+            if not remaining:
+                indices[depth] = -1
+                depth -= 1
+                continue
+            indices[depth] += (remaining & -remaining).bit_length()
+            row = self.compatible[depth][indices[depth]]
+            narrowed = [bits & row[k] for k, bits in enumerate(allowed[depth][1:])]
+            if all(narrowed):
+                allowed[depth + 1] = narrowed
+                depth += 1
+
+
+def search_prefix(prefix, start=None, count=None, deadline=None):
+    """Finds the schedules of one part of a search in a worker process
+    @params
+        'prefix': Indices of the combinations of the first courses (see 'ConflictMatrix.search')
+        'start': Indices of a previously found schedule of the part to resume after
+        'count': Maximum number of schedules to find
+        'deadline': Time (see 'time.time') to stop searching at
+    Returns
+        Tuple with an array of the indices of all schedules found one after the other (sent to
+        the parent process much faster than tuples) and True if the part has more schedules
+    """
+    found = array('i')
+    for i, indices in enumerate(MATRIX.search(start, prefix)):
+        if i == count or (deadline is not None and i % 64 == 0 and time() > deadline):
+            return found, True
+        found.extend(indices)
+    return found, False
+
+
+def set_matrix(matrix):
+    # Stores the ConflictMatrix of the search in a worker process when it starts
+    global MATRIX
+    MATRIX = matrix
+
+
+def get_pool(workers, matrix):
+    """Finds the process pool of a parallel search. Every worker process receives the
+    ConflictMatrix once when it starts, so jobs only send the part to search. The pool of the
+    last search is reused if it searched the same matrix (i.e. the same courses, see
+    'ConflictCache'), so paging through a search does not start new processes.
+    @params
+        'workers': Number of processes
+        'matrix': ConflictMatrix of the search
+    Returns
+        ProcessPoolExecutor, given back with 'release_pool' when the search is done
+    """
+    with POOL_LOCK:
+        if POOL['pool'] is not None and POOL['workers'] == workers and POOL['matrix'] is matrix:
+            POOL['searches'] += 1
+            return POOL['pool']
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=set_matrix, initargs=(matrix,))
+        # A pool still searched by another request is left to it
+        if POOL['searches'] == 0:
+            if POOL['pool'] is not None:
+                POOL['pool'].shutdown(wait=False)
+            POOL.update(pool=pool, workers=workers, matrix=matrix, searches=1)
+        return pool
+
+
+def release_pool(pool, jobs):
+    """Gives back the process pool of a finished search
+    @params
+        'pool': ProcessPoolExecutor from 'get_pool'
+        'jobs': Futures of the search. Jobs that have not started are cancelled.
+    """
+    for job in jobs:
+        job.cancel()
+    with POOL_LOCK:
+        if pool is POOL['pool']:
+            POOL['searches'] -= 1
+            return
+    pool.shutdown(wait=False)
+
+
+class ConflictCache:
+    def __init__(self, max_entries=128):
+        """Least recently used cache of conflict matrices
+        @params
+            'max_entries': Maximum number of matrices kept in memory
+        """
+        self.max_entries = max_entries
+        self.matrices = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.build_time = 0
+
+    def get(self, key, masks):
+        """Finds the conflict matrix of a query, building it if it is not cached
+        @params
+            'key': Key of the query (see 'search_combinations')
+            'masks': Function returning the masks to build the matrix from (see 'ConflictMatrix')
+        Returns
+            ConflictMatrix of the query
+        """
+        with self.lock:
+            matrix = self.matrices.get(key)
+            if matrix is not None:
+                self.hits += 1
+                self.matrices.move_to_end(key)
+                return matrix
+            self.misses += 1
+        start = perf_counter()
+        matrix = ConflictMatrix(masks())
+        with self.lock:
+            self.build_time += perf_counter() - start
+            self.matrices[key] = matrix
+            while len(self.matrices) > self.max_entries:
+                self.matrices.popitem(last=False)
+        return matrix
+
+    def stats(self):
+        # Statistics for tuning the size of the cache
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.matrices),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0,
+                'build_time': self.build_time,
+                'average_build_time': self.build_time / self.misses if self.misses else 0,
+            }
+
+
+def load_time_schedule():
+    """Loads the Organized Time Schedule created by 'main'"""
+    with open(path.join(getcwd(), 'static', 'Time_Schedules.json'), mode='r') as f:
+        return loads(f.read())
+
+
+def is_full(section):
+    """Checks if a section has no open seats
+    @params
+        'section': Dictionary representing a LECT/QZ/LB/ST section
+    Returns
+        True if any of the 'Seats' of the section (i.e '40/40') are all taken.
+        Sections with unknown seats are not full.
+    """
+    for seats in section['Seats']:
+        match = re_search(r'(\d+)\s*/\s*(\d+)', seats)
+        if match and int(match.group(1)) >= int(match.group(2)):
+            return True
+    return False
+
+
+def blocked_mask(constraints):
+    """Creates the bitmask of the times no section may meet in
+    @params
+        'constraints': Dictionary with the hard constraints of a schedule search:
+            'blocked': List of [days, start, end] windows with the days as a string (i.e 'MWF')
+                       and start and end in minutes since midnight
+            'free_days': Days without any classes as a string (i.e 'F')
+            'open_seats': True to exclude full sections (see 'TimeSchedule.compile')
+    Returns
+        Integer with the bits of every blocked 5 minute slot set
+    """
+    mask = 0
+    for days, start, end in constraints.get('blocked', []):
+        for day in get_days(days):
+            # A class may start right when the window ends
+            mask |= time_mask(day, start, max(start, end - 1))
+    for day in get_days(constraints.get('free_days', '')):
+        mask |= DAY_MASK << (DAYS.index(day) * DAY_SLOTS)
+    return mask
+
+
+class TimeSchedule:
+    def __init__(self, courses_offered, version=None):
+        """Compiles every section of an Organized Time Schedule into a bitmask
+        @params
+            'courses_offered': Organized Time Schedule (see 'main')
+            'version': Version of the Time Schedule file the schedule was loaded from
+        """
+        self.courses = courses_offered
+        self.version = version
+        # Bitmasks of every section by id and the ids of full sections. The sections live as
+        # long as 'courses'.
+        self.masks = {}
+        self.full = set()
+        for lectures in courses_offered.values():
+            for sections in lectures.values():
+                for section in chain([sections['LECT']], sections['QZ'], sections['LB'], sections['ST']):
+                    self.masks[id(section)] = section_mask(section)
+                    if is_full(section):
+                        self.full.add(id(section))
+        # Compiled Lecture/Quiz/Lab/Studio combinations of the courses searched so far
+        self.options = {}
+        # Conflict matrices of recent searches
+        self.conflicts = ConflictCache()
+
+    def __contains__(self, course):
+        return course in self.courses
+
+    def __getitem__(self, course):
+        return self.courses[course]
+
+    def course_options(self, course):
+        """Finds the Lecture/Quiz/Lab/Studio combinations of a course that do not overlap themselves
+        @params
+            'course': Course (i.e EE235) or course with a lecture (i.e EE235 A)
+        Returns
+            List of (combination, bitmask) tuples. Empty if the course is not offered.
+        """
+        if course not in self.options:
+            try:
+                options = get_options(self.courses, [course])[0]
+            except KeyError:
+                # Course or lecture not offered this quarter
+                options = []
+            compiled = [(option, compile_option(option, self.masks)) for option in options]
+            self.options[course] = [(option, mask) for option, mask in compiled if mask is not None]
+        return self.options[course]
+
+    def compile(self, planned_courses, constraints=None):
+        """Finds the compiled combinations of every course in 'planned_courses'. Combinations
+        violating the 'constraints' are removed before any search sees them.
+        @params
+            'planned_courses': List of courses to find combinations from
+            'constraints': Dictionary of hard constraints (see 'blocked_mask')
+        Returns
+            List with a list of (combination, bitmask) tuples for every course
+        """
+        if not constraints:
+            return [self.course_options(course) for course in planned_courses]
+        blocked = blocked_mask(constraints)
+        open_seats = constraints.get('open_seats', False)
+        return [
+            [
+                (option, mask) for option, mask in self.course_options(course)
+                if not mask & blocked and not (open_seats and any(id(section) in self.full for section in option))
+            ]
+            for course in planned_courses
+        ]
+
+
+def count_combinations(planned_courses, time_schedule=None, constraints=None):
+    """Counts the combinations of the courses in 'planned_courses' without enumerating them.
+    Combinations with overlapping sections of different courses are included in the count.
+    @params
+        'planned_courses': List of courses to count combinations from
+        'time_schedule': TimeSchedule to search, defaults to the one in 'static'
+        'constraints': Dictionary of hard constraints (see 'blocked_mask')
+    Returns
+        Number of combinations
+    """
+    if time_schedule is None:
+        time_schedule = TimeSchedule(load_time_schedule())
+    count = 1
+    for options in time_schedule.compile(planned_courses, constraints):
+        count *= len(options)
+    return count
+
+
+def search_combinations(planned_courses, start=None, time_schedule=None, constraints=None):
+    """Finds all possible combinations of the courses in 'planned_courses'
+    such that no sections of any course overlap
+    @params
+        'planned_courses': List of courses to find combinations from
+        'start': Search position of a previously found combination to resume after
+        'time_schedule': TimeSchedule to search, defaults to the one in 'static'
+        'constraints': Dictionary of hard constraints (see 'blocked_mask')
+    Returns
+        Generator object with the search position and the combination of courses
+        for every valid combination
+    """
+    total, order, matrix = prepare_search(planned_courses, time_schedule, constraints)
+    for indices in matrix.search(start):
+        yield indices, get_combo(total, order, indices)
+
+
+def prepare_search(planned_courses, time_schedule=None, constraints=None):
+    """Compiles the courses of a search and finds its conflict matrix
+    @params
+        'planned_courses': List of courses to find combinations from
+        'time_schedule': TimeSchedule to search, defaults to the one in 'static'
+        'constraints': Dictionary of hard constraints (see 'blocked_mask')
+    Returns
+        Tuple with the compiled combinations of every course (see 'TimeSchedule.compile'),
+        the search order of the courses and the ConflictMatrix
+    """
+    if time_schedule is None:
+        time_schedule = TimeSchedule(load_time_schedule())
+    total = time_schedule.compile(planned_courses, constraints)
+    # Search the most constrained courses (fewest combinations) first. Ties are broken by name
+    # so the same courses entered in any order share a conflict matrix.
+    order = sorted(range(len(total)), key=lambda i: (len(total[i]), planned_courses[i]))
+    key = (tuple(sorted(planned_courses)), dumps(constraints or {}, sort_keys=True))
+    matrix = time_schedule.conflicts.get(key, lambda: [[mask for _, mask in total[i]] for i in order])
+    return total, order, matrix
+
+
+def get_combo(total, order, indices):
+    # Combination of courses in the order they were planned from the indices of a search
+    combo = [None] * len(total)
+    for i, index in zip(order, indices):
+        combo[i] = total[i][index][0]
+    return tuple(combo)
+
+
+def parallel_combinations(planned_courses, count=None, time_budget=None, workers=None, time_schedule=None, constraints=None):
+    """Finds the combinations of the courses in 'planned_courses' such that no sections of any
+    course overlap, using a pool of processes. The search is split by the combinations of the
+    first courses and the parts are searched in parallel. Schedules are found in the same
+    order as 'search_combinations'.
+    @params
+        'planned_courses': List of courses to find combinations from
+        'count': Number of combinations to stop after
+        'time_budget': Number of seconds to stop searching after
+        'workers': Number of processes, defaults to the number of CPUs
+        'time_schedule': TimeSchedule to search, defaults to the one in 'static'
+        'constraints': Dictionary of hard constraints (see 'blocked_mask')
+    Returns
+        Generator object with the search position and the combination of courses
+        for every valid combination
+    """
+    total, order, matrix = prepare_search(planned_courses, time_schedule, constraints)
+    if not matrix.sizes or not all(matrix.sizes):
+        return
+    workers = workers or cpu_count()
+    deadline = time() + time_budget if time_budget is not None else None
+    # Split on as many courses as needed for every process to get several parts
+    depth, parts = 0, 1
+    while depth < len(matrix.sizes) - 1 and parts < 4 * workers:
+        parts *= matrix.sizes[depth]
+        depth += 1
+    prefixes = product(*[range(size) for size in matrix.sizes[:depth]])
+    pool = get_pool(workers, matrix)
+    size = len(matrix.sizes)
+    # Parts in search order with the job searching them
+    jobs = deque()
+    found = 0
+
+    def submit(prefix, start=None):
+        limit = PARALLEL_CHUNK if count is None else min(PARALLEL_CHUNK, count - found)
+        return prefix, pool.submit(search_prefix, prefix, start, limit, deadline)
+
+    try:
+        while True:
+            # Keep a few parts ahead of the one being read, so stopping early wastes little work
+            while len(jobs) < 2 * workers:
+                prefix = next(prefixes, None)
+                if prefix is None:
+                    break
+                jobs.append(submit(prefix))
+            if not jobs:
+                return
+            timeout = max(deadline - time(), 0) if deadline is not None else None
+            prefix, job = jobs.popleft()
+            schedules, more = job.result(timeout=timeout)
+            out_of_time = more and deadline is not None and time() >= deadline
+            if more and not out_of_time:
+                # Continue the part from its last schedule while this chunk is handed out
+                jobs.appendleft(submit(prefix, tuple(schedules[-size:])))
+            for start in range(0, len(schedules), size):
+                indices = tuple(schedules[start:start + size])
+                yield indices, get_combo(total, order, indices)
+                found += 1
+                if found == count:
+                    return
+            if out_of_time:
+                return
+    except FuturesTimeout:
+        return
+    finally:
+        release_pool(pool, [job for _, job in jobs])
+
+
+def get_combinations(planned_courses, time_schedule=None, constraints=None, workers=None, count=None, time_budget=None):
+    """Finds all possible combinations of the courses in 'planned_courses'
+    such that no sections of any course overlap
+    @params
+        'planned_courses': List of courses to find combinations from
+        'time_schedule': TimeSchedule to search, defaults to the one in 'static'
+        'constraints': Dictionary of hard constraints (see 'blocked_mask')
+        'workers': Number of processes to search with (see 'parallel_combinations').
+                   None searches in this process.
+        'count': Number of combinations to stop after
+        'time_budget': Number of seconds to stop searching after
+    Returns
+        Generator object with all valid combinations of courses
+    """
+    if workers:
+        schedules = parallel_combinations(planned_courses, count, time_budget, workers, time_schedule, constraints)
+    else:
+        schedules = islice(search_combinations(planned_courses, time_schedule=time_schedule, constraints=constraints), count)
+        if time_budget is not None:
+            deadline = time() + time_budget
+            schedules = takewhile(lambda _: time() <= deadline, schedules)
+    for _, combo in schedules:
         yield combo
 
 
+# Ranking criteria of 'rank_combinations' and their weights. Scores are in minutes, so every
+# campus day counts as an hour and every class before 'EARLY_MINUTES' as half an hour.
+RANK_WEIGHTS = {'days': 60, 'mornings': 30, 'walking': 1, 'gaps': 0.5}
+EARLY_MINUTES = 9 * 60
+# Walking speed in meters per minute
+WALKING_SPEED = 80
+EARLY_MASK = sum(
+    ((1 << (EARLY_MINUTES // SLOT_MINUTES)) - 1) << (day * DAY_SLOTS) for day in range(len(DAYS))
+)
+
+
+def get_distance(start, end):
+    """Finds the distance between two points on Earth
+    @params
+        'start': Tuple with the latitude and longitude of the first point in radians
+        'end': Tuple with the latitude and longitude of the second point in radians
+    Returns
+        Distance in meters
+    """
+    a = sin((end[0] - start[0]) / 2) ** 2 + cos(start[0]) * cos(end[0]) * sin((end[1] - start[1]) / 2) ** 2
+    return 2 * 6371000 * asin(sqrt(a))
+
+
+def get_meetings(option, locations):
+    """Finds the meetings of a Lecture/Quiz/Lab/Studio combination
+    @params
+        'option': Tuple of section dictionaries
+        'locations': Dictionary mapping buildings to (latitude, longitude) in radians
+    Returns
+        List of (day, start, location) tuples. The location is None for unknown buildings.
+    """
+    return [
+        (DAYS.index(day), start, locations.get(building))
+        for section in option for day, start, _, building in get_section_meetings(section)
+    ]
+
+
+def get_walking(meetings):
+    # Minutes walked between consecutive classes on the same day. Adding a class never
+    # shortens the walk (triangle inequality), so this is a valid lower bound for a partial schedule.
+    # Classes in unknown buildings are skipped so they do not break this property
+    meters = 0
+    meetings = sorted((meeting for meeting in meetings if meeting[2] is not None), key=lambda meeting: meeting[:2])
+    for (day, _, start), (next_day, _, end) in zip(meetings, meetings[1:]):
+        if day == next_day:
+            meters += get_distance(start, end)
+    return meters / WALKING_SPEED
+
+
+def get_gaps(mask):
+    # Minutes between the first and last class of every day not spent in class
+    gaps = 0
+    for day in range(len(DAYS)):
+        slots = (mask >> (day * DAY_SLOTS)) & DAY_MASK
+        if slots:
+            span = slots.bit_length() - (slots & -slots).bit_length() + 1
+            gaps += (span - bin(slots).count('1')) * SLOT_MINUTES
+    return gaps
+
+
+def get_bound(mask, meetings, weights):
+    """Scores the criteria of a partial schedule that can only get worse as courses are added
+    @params
+        'mask': Bitmask of the sections in the schedule
+        'meetings': Meetings of the sections in the schedule (see 'get_meetings')
+        'weights': Dictionary mapping the criteria to rank by to their weight
+    Returns
+        Lower bound of the score of every schedule containing the partial schedule
+    """
+    score = 0
+    if 'days' in weights:
+        score += weights['days'] * sum(bool((mask >> (day * DAY_SLOTS)) & DAY_MASK) for day in range(len(DAYS)))
+    if 'mornings' in weights:
+        early = mask & EARLY_MASK
+        score += weights['mornings'] * sum(bool((early >> (day * DAY_SLOTS)) & DAY_MASK) for day in range(len(DAYS)))
+    if 'walking' in weights:
+        score += weights['walking'] * get_walking(meetings)
+    return score
+
+
+def rank_combinations(planned_courses, count=10, criteria=None, coords=None, time_schedule=None, constraints=None):
+    """Finds the best combinations of the courses in 'planned_courses' such that no sections
+    of any course overlap. Partial schedules are abandoned as soon as they can no longer beat
+    the 'count' best schedules found so far (branch and bound).
+    @params
+        'planned_courses': List of courses to find combinations from
+        'count': Number of combinations to find
+        'criteria': List of criteria in 'RANK_WEIGHTS' to rank by, defaults to all
+        'coords': Dictionary mapping buildings to their coordinates (see 'geocode.json')
+        'time_schedule': TimeSchedule to search, defaults to the one in 'static'
+        'constraints': Dictionary of hard constraints (see 'blocked_mask')
+    Returns
+        List of (score, combination) tuples, best (lowest score) first
+    """
+    if time_schedule is None:
+        time_schedule = TimeSchedule(load_time_schedule())
+    weights = {criterion: RANK_WEIGHTS[criterion] for criterion in criteria or RANK_WEIGHTS}
+    locations = {
+        building: (radians(float(c['Latitude'])), radians(float(c['Longitude'])))
+        for building, c in (coords or {}).items() if c['Latitude'] and c['Longitude']
+    }
+    total = time_schedule.compile(planned_courses, constraints)
+    if count < 1 or not total or not all(total):
+        return []
+    # Search the most constrained courses (fewest combinations) first
+    order = sorted(range(len(total)), key=lambda i: len(total[i]))
+    courses = [[(mask, get_meetings(option, locations)) for option, mask in total[i]] for i in order]
+    # Heap of the best schedules with the worst at the top. Among equal scores, schedules
+    # found later are dropped first.
+    best = []
+    found = count_up()
+    indices = [0] * len(courses)
+
+    def search(depth, used, meetings):
+        children = []
+        for index, (mask, course_meetings) in enumerate(courses[depth]):
+            if used & mask:
+                continue
+            child_meetings = meetings + course_meetings
+            children.append((get_bound(used | mask, child_meetings, weights), index, used | mask, child_meetings))
+        # Visit the most promising options first so good schedules raise the bar early
+        children.sort(key=lambda child: child[:2])
+        for bound, index, mask, child_meetings in children:
+            if len(best) == count and bound >= -best[0][0]:
+                break
+            indices[depth] = index
+            if depth < len(courses) - 1:
+                search(depth + 1, mask, child_meetings)
+                continue
+            score = bound + weights.get('gaps', 0) * get_gaps(mask)
+            entry = (-score, -next(found), tuple(indices))
+            if len(best) < count:
+                heappush(best, entry)
+            elif entry > best[0]:
+                heapreplace(best, entry)
+
+    search(0, 0, [])
+    ranked = []
+    for score, _, found_indices in sorted(best, reverse=True):
+        combo = [None] * len(total)
+        for i, index in zip(order, found_indices):
+            combo[i] = total[i][index][0]
+        ranked.append((-score, tuple(combo)))
+    return ranked
+
+
+# Per-meeting data of a section. Sections meeting at several times have one entry per meeting.
+SECTION_TIMES = ['Building', 'Days', 'Room Number', 'Seats', 'Time']
+
+
 # Sections class used for the organized Time Schedule
 class Sections:
-    def __init__(self):
-        self.LECT = ''
+    def __init__(self, lecture):
+        for section_data in SECTION_TIMES:
+            lecture[section_data] = [lecture[section_data]]
+        self.LECT = lecture
         self.QZ = []
         self.LB = []
         self.ST = []
-    
+        # Sections by type and section name (i.e AA)
+        self.index = {}
+
     def add_section(self, section_type, data):
-        if section_type == 'QZ':
-            s_type = self.QZ
-        elif section_type == 'LB':
-            s_type = self.LB
-        elif section_type == 'ST':
-            s_type = self.ST
-        else:
+        if section_type not in ['QZ', 'LB', 'ST']:
             return
 
-        # Check if Section is already in the list for that section type.
         # For some courses, such as CHEM142 on the Seattle Campus, the Quiz and Lab Section
-        # are grouped in the same section. This is why the 'Building', 'Days', 'Room Number', 
+        # are grouped in the same section. This is why the 'Building', 'Days', 'Room Number',
         # 'Seats', and 'Time' sections are represented as lists.
-        for section in s_type[::-1]:
-            if section['Section'] == data['Section']:
-                break
-        else:
-            for section_data in ['Building', 'Days', 'Room Number', 'Seats', 'Time']:
+        section = self.index.get((section_type, data['Section']))
+        if section is None:
+            for section_data in SECTION_TIMES:
                 data[section_data] = [data[section_data]]
-            s_type.append(data)
-            return
+            getattr(self, section_type).append(data)
+            self.index[(section_type, data['Section'])] = data
+        else:
+            for section_data in SECTION_TIMES:
+                section[section_data].append(data[section_data])
 
-        for section in s_type:
-            if section['Section'] == data['Section']:
-                for section_data in ['Building', 'Days', 'Room Number', 'Seats', 'Time']:
-                    section[section_data].append(data[section_data])
+    def to_dict(self):
+        return {'LECT': self.LECT, 'QZ': self.QZ, 'LB': self.LB, 'ST': self.ST}
 
 
-def main(year, quarter):
+def organize(sections):
+    """Organizes the sections of the Time Schedule by course and lecture
+    @params
+        'sections': Iterable of section dictionaries as returned by 'uwtools.time_schedules'
+    Returns
+        Dictionary with Course Names (i.e EE235) as keys. The value for every key is another
+        dictionary with Lectures as keys (i.e Lecture A). These lecture keys have another
+        dictionary with section types as keys (LECT, QZ, LB, ST). The LECT key has the
+        information for the lecture, every other key has a list as a value with dictionaries
+        representing every QZ/LB/ST section for that lecture. Every section has its
+        'Meetings' (see 'get_section_meetings').
+    """
+    lectures = {}
+    # Last lecture of every course. Quiz/Lab/Studio sections belong to the lecture before them.
+    current = {}
+    for section in sections:
+        # Check if a building exists for the section
+        if not section['Building'] or not section['Room Number']:
+            continue
+        course = section['Course Name']
+        if section['Type'] == 'LECT':
+            current[course] = Sections(section)
+            lectures.setdefault(course, {})[f"Lecture {section['Section']}"] = current[course]
+        elif course in current:
+            current[course].add_section(section['Type'], section)
+    course_map = {}
+    for course, course_lectures in lectures.items():
+        course_map[course] = {}
+        for lecture, sections in course_lectures.items():
+            course_map[course][lecture] = sections.to_dict()
+            # Parse the times of every section once, so searches never parse time strings
+            for section in chain([sections.LECT], sections.QZ, sections.LB, sections.ST):
+                section['Meetings'] = get_section_meetings(section)
+    return course_map
+
+
+def hash_course(sections):
+    # Hash of the lectures of a course that only changes if the lectures change
+    return sha1(dumps(sections, separators=(',', ':'), sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def course_hashes(file_path):
+    """Hashes every course of an Organized Time Schedule file. Courses are decoded one at a
+    time, so only the text of the file and a single course are in memory at once.
+    @params
+        'file_path': Path of the Organized Time Schedule file
+    Returns
+        Dictionary of courses to the hashes of their lectures, empty if there is no file
+    """
+    if not path.isfile(file_path):
+        return {}
+    with open(file_path, mode='r') as f:
+        text = f.read()
+    decoder = JSONDecoder()
+    skip = re_compile(r'[\s,:]*').match
+    hashes = {}
+    position = skip(text, text.index('{') + 1).end()
+    while text[position] != '}':
+        course, position = decoder.raw_decode(text, position)
+        sections, position = decoder.raw_decode(text, skip(text, position).end())
+        hashes[course] = hash_course(sections)
+        position = skip(text, position).end()
+    return hashes
+
+
+def diff(previous, course_map):
+    """Compares two Organized Time Schedules
+    @params
+        'previous': Hashes of the courses of the previous Organized Time Schedule (see 'course_hashes')
+        'course_map': New Organized Time Schedule
+    Returns
+        Dictionary with the number of added, removed and changed courses
+    """
+    return {
+        'added': sum(course not in previous for course in course_map),
+        'removed': sum(course not in course_map for course in previous),
+        'changed': sum(
+            course in previous and previous[course] != hash_course(sections)
+            for course, sections in course_map.items()
+        ),
+    }
+
+
+def write_if_changed(temp_path, file_path):
+    # Replaces 'file_path' atomically with a copy of 'temp_path' unless they are the same
+    if path.isfile(file_path) and cmp(temp_path, file_path, shallow=False):
+        return False
+    copy_path = f'{file_path}.{getpid()}.tmp'
+    copyfile(temp_path, copy_path)
+    replace(copy_path, file_path)
+    return True
+
+
+def main(year, quarter, report=False, publish=None):
     """Creates an Organized Time Schedule as a json file with all courses from
     all UW Campuses included for the current UW Quarter. 
     Organized Time Schedules include the Course as the Key. The associated value to 
     this key are all the lectures for this course with quiz, lab and studio sections
     included as a list.
 
+    The Time Schedule is stored for the current quarter and as a copy for the given quarter.
+    Files that did not change are not rewritten, so the app does not reload them.
+
     @params
         'year': Year of Quarter to get time schedules from.
         'quarter': Quarter to get time schedules from.
+        'report': Print the changes since the last run, wall time and peak memory.
+        'publish': Function writing a new version of a file instead (see 'Refresher.publish'
+                   in refresh.py), called with the path of the file relative to 'static' and
+                   a function writing the file.
+    Returns
+        Dictionary with the number of added, removed and changed courses
     """
-    section_times = ['Building', 'Days', 'Room Number', 'Seats', 'Time']
-    
+    start = perf_counter()
+    if report:
+        tracemalloc.start()
+
     # Replace 'year' and 'quarter' with the values for the quarter you'd like to parse.
     # Make sure that quarter's time schedules are available.
-    df = uwtools.time_schedules(year, quarter, json_ready=True, struct='dict')        
+    course_map = organize(uwtools.time_schedules(year, quarter, json_ready=True, struct='dict'))
 
-    # Create a dictionary with Course Names (i.e EE235) as keys and a list of course sections
-    # (as dictionaries) as values. 
-    total = {}
-    for dict_ in df:
-        # Check if a building exists for the section
-        if dict_['Building'] and dict_['Room Number']:
-            course_name = dict_['Course Name']
-            if course_name not in total:
-                total[course_name] = []
-            total[course_name].append(dict_)
-
-    # Create a dictionary with course names (i.e EE235) as keys.
-    # The value for every key is another dictionary with Lectures as keys (i.e Lecture A).
-    # These lecture keys have another dictionary with section types as keys (LECT, QZ, LB, ST).
-    # The LECT key has the information for the lecture, every other key has a list as a value with
-    # dictionaries representing every QZ/LB/ST section for that lecture.
-    course_map = {}
-    for course, course_list in total.items():
-        section_map = {}
-        for section in course_list:
-            section_type = section['Type']
-            if section_type == 'LECT':
-                course_sections = Sections()
-                for section_data in section_times:
-                    section[section_data] = [section[section_data]]
-                course_sections.LECT = section
-                section_map[f"Lecture {section['Section']}"] = course_sections.__dict__
-            else:
-                course_sections.add_section(section_type, section)
-        if section_map:
-            course_map[course] = section_map
-
-    # Store these Organized Time Schedules as a .json file
-    with open(path.join(getcwd(), 'static', 'Time_Schedules.json'), mode='w') as f:
-        dump(course_map, f, indent=4, sort_keys=True)
+    quarter_path = path.join(getcwd(), 'static', 'Time_Schedules')
+    makedirs(quarter_path, exist_ok=True)
+    quarter_file = path.join(quarter_path, f'{year}{quarter}.json')
+    # Courses of the previous version are compared by hash, so it is never loaded whole
+    changes = diff(course_hashes(quarter_file), course_map)
+
+    # Store these Organized Time Schedules as compact .json files. Files are replaced
+    # atomically since the app reads them while running.
+    temp_path = f'{quarter_file}.{getpid()}.new'
+    with open(temp_path, mode='w') as f:
+        dump(course_map, f, separators=(',', ':'), sort_keys=True)
+    written = []
+    for name in [path.join('Time_Schedules', f'{year}{quarter}.json'), 'Time_Schedules.json']:
+        file_path = path.join(getcwd(), 'static', name)
+        if publish is None:
+            if write_if_changed(temp_path, file_path):
+                written.append(file_path)
+        elif not (path.isfile(file_path) and cmp(temp_path, file_path, shallow=False)):
+            publish(name, lambda version_path: copyfile(temp_path, version_path))
+            written.append(file_path)
+    remove(temp_path)
+
+    if report:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(
+            f"{len(course_map)} courses: {changes['added']} added, {changes['removed']} removed, "
+            f"{changes['changed']} changed, {len(written)} files written"
+        )
+        print(f'Done in {perf_counter() - start:.2f} s, peak memory {peak / 2 ** 20:.1f} MiB')
+    return changes
 
 
 if __name__ == '__main__':
     year = input('Year: ')
     quarter = input('Quarter: ')
-    main(int(year), quarter.upper())
\ No newline at end of file
+    main(int(year), quarter.upper(), report=True)
\ No newline at end of file
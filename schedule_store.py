@@ -0,0 +1,153 @@
+"""
+Alex Eidt
+
+Keeps the compiled Time Schedules of one or more quarters in memory.
+
+Time Schedules are loaded once and compiled into bitmasks (see 'TimeSchedule' in schedule.py).
+Whenever a Time Schedule file changes, it is loaded again in the background and swapped in as
+a whole, so requests keep using the previous version and never see a partially loaded quarter.
+"""
+
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from planner import QUARTERS
+from refresh import Watcher
+from schedule import TimeSchedule
+from schedule import main as check_schedules
+
+# Raised by 'get' if there is no Time Schedule for a quarter, the quarter is not valid or its
+# Time Schedule file could not be parsed
+LOAD_ERRORS = (FileNotFoundError, ValueError)
+
+
+def is_quarter(year, quarter):
+    # Checks a year and quarter sent by a user before they become part of a path
+    return bool(re.fullmatch(r'[0-9]{4}', str(year))) and str(quarter).upper() in QUARTERS
+
+
+class ScheduleStore:
+    def __init__(self, path, max_quarters=4):
+        """Creates the store
+        @params
+            'path': The 'static' directory with the Time Schedule files
+            'max_quarters': Maximum number of quarters kept in memory
+        """
+        self.path = path
+        self.max_quarters = max_quarters
+        self.schedules = OrderedDict()
+        # Watchers of the Time Schedule files of the loaded quarters
+        self.watchers = {}
+        self.lock = threading.Lock()
+        self.loading = threading.Lock()
+
+    def file_path(self, year=None, quarter=None):
+        """Finds the Time Schedule file of a quarter
+        @params
+            'year': Year of the quarter, None for the current quarter
+            'quarter': Quarter (i.e AUT)
+        Returns
+            Path of the Time Schedule file. Raises ValueError if 'year' and 'quarter' are not a quarter.
+        """
+        if year is None:
+            return os.path.join(self.path, 'Time_Schedules.json')
+        if not is_quarter(year, quarter):
+            raise ValueError(f'{year}{quarter} is not a quarter')
+        return os.path.join(self.path, 'Time_Schedules', f'{year}{quarter.upper()}.json')
+
+    def version(self, year=None, quarter=None):
+        stat = os.stat(self.file_path(year, quarter))
+        return f'{stat.st_mtime_ns:x}-{stat.st_size:x}'
+
+    def add(self, courses_offered, year=None, quarter=None):
+        """Adds an already parsed Time Schedule of a quarter, i.e. from the snapshot
+        @params
+            'courses_offered': Organized Time Schedule (see 'main' in schedule.py)
+            'year': Year of the quarter, None for the current quarter
+            'quarter': Quarter (i.e AUT)
+        Returns
+            TimeSchedule of the quarter
+        """
+        schedule = TimeSchedule(courses_offered, self.version(year, quarter))
+        self.swap((year, quarter and quarter.upper()), schedule)
+        return schedule
+
+    def get(self, year=None, quarter=None):
+        """Finds the Time Schedule of a quarter, loading it if it is not loaded. If its file
+        changed, it is loaded again in the background and the loaded version is returned until then.
+        @params
+            'year': Year of the quarter, None for the current quarter
+            'quarter': Quarter (i.e AUT)
+        Returns
+            TimeSchedule of the quarter. Raises one of LOAD_ERRORS if there is no Time Schedule
+            for the quarter, the quarter is not valid or its Time Schedule could not be parsed.
+        """
+        key = (year, quarter and quarter.upper())
+        with self.lock:
+            schedule = self.schedules.get(key)
+            if schedule is not None:
+                self.schedules.move_to_end(key)
+                watcher = self.watchers[key]
+        if schedule is None:
+            return self.reload(year, quarter)
+        watcher.check()
+        return schedule
+
+    def reload(self, year=None, quarter=None):
+        """Loads the Time Schedule file of a quarter again if it changed
+        @params
+            'year': Year of the quarter, None for the current quarter
+            'quarter': Quarter (i.e AUT)
+        Returns
+            TimeSchedule of the quarter
+        """
+        key = (year, quarter and quarter.upper())
+        # Loading is serialized so concurrent requests do not all parse the same file. Requests
+        # for quarters already loaded are not blocked by it.
+        with self.loading:
+            version = self.version(year, quarter)
+            schedule = self.schedules.get(key)
+            if schedule is not None and schedule.version == version:
+                return schedule
+            file_path = self.file_path(year, quarter)
+            with open(file_path, mode='r') as f:
+                try:
+                    schedule = TimeSchedule(json.loads(f.read()), version)
+                except (ValueError, KeyError, TypeError, AttributeError) as e:
+                    raise ValueError(f'{file_path} is not a Time Schedule') from e
+            self.swap(key, schedule)
+        return schedule
+
+    def refresh(self, year, quarter, publish=None):
+        """Scrapes the Time Schedule of a quarter with 'main' in schedule.py and loads the
+        new Time Schedule files, sparing the next MyMap request from compiling them
+        @params
+            'year': Year of the quarter
+            'quarter': Quarter (i.e AUT)
+            'publish': Function writing new versions of the Time Schedule files (see
+                       'Refresher.publish' in refresh.py)
+        """
+        check_schedules(year, quarter, publish=publish)
+        self.reload()
+        self.reload(year, quarter)
+
+    def swap(self, key, schedule):
+        year, quarter = key
+        with self.lock:
+            self.schedules[key] = schedule
+            if key not in self.watchers:
+                self.watchers[key] = Watcher(
+                    self.file_path(year, quarter), lambda: self.reload(year, quarter)
+                )
+            self.evict()
+
+    def evict(self):
+        # Removes the least recently used quarters over the limit. The current quarter is kept.
+        for key in list(self.schedules):
+            if len(self.schedules) <= self.max_quarters:
+                break
+            if key != (None, None):
+                del self.schedules[key]
+                del self.watchers[key]
@@ -0,0 +1,195 @@
+"""
+Alex Eidt
+
+Compiled snapshot of the data loaded by app.py at startup.
+
+The Course Catalogs are stored column by column as integer codes into a table of unique
+strings, which is read faster than the CSV is parsed. Every worker still decodes its own
+copy of the strings. The JSON files are stored pickled, which loads about twice as fast as
+parsing the JSON. The postings of the keyword index (see keyword_index.py) are built once
+and memory mapped, so workers share them through the page cache.
+
+The snapshot is stored in 'data/snapshot', outside of the 'static' directory served by the
+Flask Application, since it is unpickled when loaded.
+
+Usage:
+    python snapshot.py build
+    python snapshot.py measure
+"""
+
+import json
+import os
+import pickle
+import shutil
+import subprocess
+import sys
+import numpy as np
+import pandas as pd
+from keyword_index import build_postings, get_texts
+
+
+VERSION = 2
+# Arrays of the keyword index postings (see 'build_postings' in keyword_index.py)
+POSTINGS = ['keys', 'offsets', 'postings']
+# Separates the strings of a string table
+SEPARATOR = '\x00'
+SOURCES = {
+    'catalogs': 'Course_Catalogs.csv',
+    'departments': 'departments.json',
+    'geocode': 'geocode.json',
+    'time_schedules': 'Time_Schedules.json',
+}
+
+
+def snapshot_path(path):
+    # Directory of the snapshot of the data files in 'path', next to the 'static' directory
+    return os.path.join(os.path.dirname(os.path.abspath(path)), 'data', 'snapshot')
+
+
+def signature(path):
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def read_sources(path):
+    """Parses the data files used by app.py
+    @params
+        'path': The 'static' directory
+    Returns
+        Tuple with the Course Catalogs DataFrame and the departments, geocode and
+        Time Schedule dictionaries
+    """
+    catalogs = pd.read_csv(os.path.join(path, SOURCES['catalogs']), dtype=str, index_col=0).fillna('')
+    data = [catalogs]
+    for name in ['departments', 'geocode', 'time_schedules']:
+        with open(os.path.join(path, SOURCES[name]), mode='r') as f:
+            data.append(json.loads(f.read()))
+    return tuple(data)
+
+
+def save_strings(directory, name, values):
+    """Stores strings as codes into a table of unique strings
+    @params
+        'directory': Directory of the snapshot
+        'name': Name of the column
+        'values': Strings to store
+    """
+    codes, uniques = pd.factorize(pd.Series(values, dtype=object))
+    table = SEPARATOR.join(str(value) for value in uniques)
+    if table.count(SEPARATOR) != len(uniques) - 1:
+        raise ValueError(f'Column {name!r} contains the string table separator')
+    np.save(os.path.join(directory, f'{name}.codes.npy'), codes.astype(np.int32))
+    np.save(os.path.join(directory, f'{name}.strings.npy'), np.frombuffer(table.encode('utf-8'), dtype=np.uint8))
+
+
+def load_strings(directory, name):
+    """Loads strings stored by 'save_strings'
+    @params
+        'directory': Directory of the snapshot
+        'name': Name of the column
+    Returns
+        Numpy object array of the strings
+    """
+    codes = np.load(os.path.join(directory, f'{name}.codes.npy'))
+    strings = np.load(os.path.join(directory, f'{name}.strings.npy'))
+    table = np.array(strings.tobytes().decode('utf-8').split(SEPARATOR), dtype=object)
+    return table.take(codes)
+
+
+def build(path):
+    """Compiles the data files in 'path' into the snapshot (see 'snapshot_path')
+    @params
+        'path': The 'static' directory
+    """
+    catalogs, departments, geocode, time_schedules = read_sources(path)
+    snapshot = snapshot_path(path)
+    directory = f'{snapshot}.{os.getpid()}.tmp'
+    os.makedirs(directory)
+    save_strings(directory, 'index', catalogs.index)
+    for i, column in enumerate(catalogs.columns):
+        save_strings(directory, f'column{i}', catalogs[column])
+    for name, array in zip(POSTINGS, build_postings(get_texts(catalogs))):
+        np.save(os.path.join(directory, f'keyword.{name}.npy'), array)
+    for name, data in [('departments', departments), ('geocode', geocode), ('time_schedules', time_schedules)]:
+        with open(os.path.join(directory, f'{name}.pickle'), mode='wb') as f:
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+    manifest = {
+        'version': VERSION,
+        'index': catalogs.index.name,
+        'columns': list(catalogs.columns),
+        'sources': {name: signature(os.path.join(path, file)) for name, file in SOURCES.items()},
+    }
+    with open(os.path.join(directory, 'manifest.json'), mode='w') as f:
+        f.write(json.dumps(manifest))
+
+    # Swap the new snapshot in. Workers starting in between fall back to the data files.
+    if os.path.isdir(snapshot):
+        old = f'{snapshot}.{os.getpid()}.old'
+        os.replace(snapshot, old)
+        os.replace(directory, snapshot)
+        shutil.rmtree(old)
+    else:
+        os.replace(directory, snapshot)
+
+
+def load(path):
+    """Loads the data used by app.py from the snapshot if it is up to date, otherwise from
+    the data files
+    @params
+        'path': The 'static' directory
+    Returns
+        Tuple with the Course Catalogs DataFrame, the departments, geocode and Time Schedule
+        dictionaries and the postings of the keyword index. The postings are None if the data
+        is not loaded from the snapshot.
+    """
+    directory = snapshot_path(path)
+    try:
+        with open(os.path.join(directory, 'manifest.json'), mode='r') as f:
+            manifest = json.loads(f.read())
+        current = {name: signature(os.path.join(path, file)) for name, file in SOURCES.items()}
+        if manifest['version'] != VERSION or manifest['sources'] != current:
+            return (*read_sources(path), None)
+        catalogs = pd.DataFrame(
+            {column: load_strings(directory, f'column{i}') for i, column in enumerate(manifest['columns'])},
+            index=pd.Index(load_strings(directory, 'index'), name=manifest['index'])
+        )
+        data = [catalogs]
+        for name in ['departments', 'geocode', 'time_schedules']:
+            with open(os.path.join(directory, f'{name}.pickle'), mode='rb') as f:
+                data.append(pickle.load(f))
+        # Replacing the snapshot does not change the files already mapped
+        data.append(tuple(
+            np.load(os.path.join(directory, f'keyword.{name}.npy'), mmap_mode='r') for name in POSTINGS
+        ))
+        return tuple(data)
+    except (OSError, ValueError, KeyError, pickle.UnpicklingError):
+        return (*read_sources(path), None)
+
+
+def measure(path):
+    # Measures the startup time and peak memory of loading the data in a fresh process each
+    script = (
+        'import resource, sys, time\n'
+        'start = time.perf_counter()\n'
+        'import snapshot\n'
+        f'snapshot.{{}}({path!r})\n'
+        'elapsed = time.perf_counter() - start\n'
+        'print(elapsed, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)\n'
+    )
+    for name, function in [('data files', 'read_sources'), ('snapshot', 'load')]:
+        output = subprocess.run(
+            [sys.executable, '-c', script.format(function)],
+            capture_output=True, text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.split()
+        elapsed, rss = float(output[0]), int(output[1])
+        print(f'{name:>10}: {elapsed * 1000:.0f} ms, peak RSS {rss / 1024:.1f} MiB')
+
+
+if __name__ == '__main__':
+    path = os.path.join(os.getcwd(), 'static')
+    if sys.argv[1:] == ['build']:
+        build(path)
+    elif sys.argv[1:] == ['measure']:
+        measure(path)
+    else:
+        print(__doc__)
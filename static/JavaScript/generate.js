@@ -7,21 +7,27 @@ $(document).ready(function() {
         }
     });
     $('img#tree').hide();
-    $('button#btn').on('click', function() {
-        var course = $('#courseInput').val();
+    // Time in milliseconds to wait before asking for a tree that is still being rendered
+    var POLL_INTERVAL = 500;
+    // Number of times to ask for a tree before giving up, about two minutes
+    var MAX_POLLS = 240;
+    function requestTree(course, polls) {
+        polls = polls || 0;
         $.ajax({
             data: {
                 name: course,
             },
             url: "/_get_tree/",
             type: "POST",
-            beforeSend: function() {
-                $('#btn').attr('disabled', true);
-                $('span').addClass('spinner-border spinner-border-sm');
-            },
         }).done(function(resp) {
-            $('#btn').attr('disabled', false);
             var image = String(resp.data);
+            if (image.startsWith('PENDING') && polls < MAX_POLLS) {
+                setTimeout(function() {
+                    requestTree(course, polls + 1);
+                }, POLL_INTERVAL);
+                return;
+            }
+            $('#btn').attr('disabled', false);
             if (image.endsWith('.svg')) {
                 $('img#tree').attr('src', image);
                 $('img#tree').show();
@@ -33,11 +39,20 @@ $(document).ready(function() {
                     alert(`${text} has no Prerequisites`);
                 } else if (image.startsWith('ND')) {
                     alert(`${text} is not a Department`);
+                } else if (image.startsWith('FAILED')) {
+                    alert(`The tree of ${text} could not be drawn`);
+                } else if (image.startsWith('PENDING')) {
+                    alert(`The tree of ${text} is taking too long to draw, please try again later`);
                 } else {
                     alert(`${text} not found`)
                 }
             }
             $('span').removeClass('spinner-border spinner-border-sm');
         });
+    }
+    $('button#btn').on('click', function() {
+        $('#btn').attr('disabled', true);
+        $('span').addClass('spinner-border spinner-border-sm');
+        requestTree($('#courseInput').val());
     }); 
 });
\ No newline at end of file
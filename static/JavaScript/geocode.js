@@ -10,7 +10,18 @@ $('#mapped').hide()
 var index = 0;
 var campus = new Array();
 var layers = new Array();
+// Schedules fetched from the server that have not been shown yet
+var pending = new Array();
+var coords = {};
+// Number of schedules requested from the server at once
+var PAGE_SIZE = 10;
 $(document).ready(function() {
+    $.ajax({
+        url: '/get_geocode/',
+        type: 'GET'
+    }).done(function(resp) {
+        coords = resp.coords;
+    });
     var table = document.getElementById('chosen');
     $('a#campus').on('click', function() {
         campus = [];
@@ -78,7 +89,9 @@ $(document).ready(function() {
                 url: '/create_schedule/',
                 type: 'POST',
                 data: {
-                    course: courses
+                    course: courses,
+                    // Fewest campus days, no early mornings, least walking and fewest gaps
+                    rank: $('#best').is(':checked') ? 'days,mornings,walking,gaps' : ''
                 },
                 beforeSend: function() {
                     $('#schedule').attr('disabled', true);
@@ -92,7 +105,9 @@ $(document).ready(function() {
                     table.innerHTML = '';
 
                     $('#mapped').show();
-                    show_schedule(resp);
+                    // Ranked schedules arrive all at once
+                    pending = resp.options || [];
+                    show_schedule(resp.option);
                     
                 } else {
                     $('#schedule').attr('disabled', false);
@@ -120,9 +135,13 @@ $(document).ready(function() {
             layers[index][0].addTo(mymap);
             document.getElementById('sectionsTitle').innerHTML = layers[index][1];
             $('#prev').attr('disabled', false);
+        } else if (pending.length > 0) {
+            show_schedule(pending.shift());
+            mymap.removeLayer(layers[index - 1][0]);
+            $('#prev').attr('disabled', false);
         } else {
             $.ajax({
-                url: '/get_schedules/',
+                url: '/get_schedules/?n=' + PAGE_SIZE,
                 type: 'POST',
                 beforeSend: function() {
                         $('#next').attr('disabled', true);
@@ -131,11 +150,13 @@ $(document).ready(function() {
             }).done(function(resp) {
                 $('#next').attr('disabled', false);
                 $('span#nextSpan').removeClass('spinner-border spinner-border-sm');
-                if (resp.option == null) {
+                if (resp.options.length == 0) {
                     alert('No more combinations');
+                    index--;
                     $('#next').attr('disabled', true);
                 } else {
-                    show_schedule(resp);
+                    pending = resp.options;
+                    show_schedule(pending.shift());
                     mymap.removeLayer(layers[index - 1][0]);
                 }
                 $('#prev').attr('disabled', false);
@@ -143,15 +164,15 @@ $(document).ready(function() {
         }
     });
 });
-function show_schedule(resp) {
+function show_schedule(option) {
     var headerText = '';
 
     var building_map = {}
-    for (var i = 0; i < resp.option.length; i++) {
-        for (var j = 0; j < resp.option[i].length; j++) {
-            for (var k = 0; k < resp.option[i][j].Building.length; k++) {
-                var building = resp.option[i][j].Building[k];
-                var o = resp.option[i][j];
+    for (var i = 0; i < option.length; i++) {
+        for (var j = 0; j < option[i].length; j++) {
+            for (var k = 0; k < option[i][j].Building.length; k++) {
+                var building = option[i][j].Building[k];
+                var o = option[i][j];
                 if (building_map.hasOwnProperty(building)) {
                     building_map[building].push('<strong>' + o['Course Name'] + '</strong>' 
                                                 + ' ' + o.Type + ' ' + o.Section + 
@@ -173,8 +194,8 @@ function show_schedule(resp) {
     }
     var courseMarkers = new Array();
     Object.keys(building_map).forEach(function(building) {
-        var latitude = parseFloat(resp.coords[building]['Latitude']);
-        var longitude = parseFloat(resp.coords[building]['Longitude']);
+        var latitude = parseFloat(coords[building]['Latitude']);
+        var longitude = parseFloat(coords[building]['Longitude']);
         var text = '';
         for (var i = 0; i < building_map[building].length; i++) {
             //L.marker([latitude, longitude]).addTo(mymap);
@@ -26,8 +26,10 @@ $(document).ready(function() {
             header.insertCell().innerHTML = '<strong>Course</strong>';
             header.insertCell().innerHTML = '<strong>Course Name</strong>';
             header.insertCell().innerHTML = '<strong>Campus</strong>';
-            if (Object.keys(resp.matches).length > 0) {
-                jQuery.each(resp.matches, function(course, courseData) {
+            if (resp.matches.length > 0) {
+                resp.matches.forEach(function(match) {
+                    var course = match[0];
+                    var courseData = match[1];
                     var row = table.insertRow();
                     row.insertCell().innerHTML = '<a href="' + root + course + '" target="_blank"><strong>' + course + '</strong></a>';
                     row.insertCell().innerHTML = courseData['Course Name'];
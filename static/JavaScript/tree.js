@@ -0,0 +1,33 @@
+$(document).ready(function() {
+    // Time in milliseconds to wait before asking for a tree that is still being rendered
+    var POLL_INTERVAL = 500;
+    // Number of times to ask for a tree before giving up, about two minutes
+    var MAX_POLLS = 240;
+    var display = $('object#display');
+    // Pages only name the tree if it was still being rendered when the page was created
+    var name = display.attr('data-pending');
+    function requestTree(polls) {
+        $.ajax({
+            data: {
+                name: name,
+            },
+            url: "/_get_tree/",
+            type: "POST",
+        }).done(function(resp) {
+            var image = String(resp.data);
+            if (image.startsWith('PENDING') && polls < MAX_POLLS) {
+                setTimeout(function() {
+                    requestTree(polls + 1);
+                }, POLL_INTERVAL);
+            } else if (image.endsWith('.svg')) {
+                // Browsers do not reload an object if only its data changes
+                display.replaceWith(display.clone().attr('data', image));
+            } else {
+                display.closest('tr').remove();
+            }
+        });
+    }
+    if (name) {
+        requestTree(0);
+    }
+});
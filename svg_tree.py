@@ -0,0 +1,364 @@
+"""
+Alex Eidt
+
+Draws Prerequisite Trees without Graphviz.
+
+Trees are recorded with the same API as graphviz.Digraph. Small trees are laid out in layers
+and written as SVG in-process, large trees (i.e. department graphs) are rendered by Graphviz.
+"""
+
+import html
+import os
+import re
+from collections import OrderedDict
+
+
+# Trees with more nodes than this are rendered by Graphviz
+MAX_LAYOUT_NODES = 150
+FONT_SIZE = 14
+# Approximate width of a character in the Helvetica font at 'FONT_SIZE'
+CHAR_WIDTH = 8.4
+NODE_HEIGHT = 36
+NODE_SEPARATION = 18
+RANK_SEPARATION = 54
+MARGIN = 8
+# Shapes of the arrowheads, drawn pointing right with the tip at (10, 5)
+ARROWHEAD_SHAPES = {
+    'normal': '<polygon points="0,1 10,5 0,9"/>',
+    'inv': '<polygon points="0,5 10,1 10,9"/>',
+    'vee': '<polygon points="0,1 10,5 0,9 3,5"/>',
+    'crow': '<polygon points="10,1 0,5 10,9 7,5"/>',
+    'box': '<rect x="3" y="2" width="7" height="6"/>',
+    'dot': '<circle cx="6" cy="5" r="4"/>',
+    'diamond': '<polygon points="0,5 5,1 10,5 5,9"/>',
+    'tee': '<rect x="6" y="0" width="3" height="10"/>',
+    'curve': '<path d="M 10,5 L 6,5 M 6,0 A 5,5 0 0 0 6,10" fill="none"/>',
+    'icurve': '<path d="M 10,5 L 4,5 M 4,0 A 5,5 0 0 1 4,10" fill="none"/>',
+}
+
+
+class Tree:
+    def __init__(self, comment='', graph_attr=None, edge_attr=None, node_attr=None):
+        """Records a tree with the same API as graphviz.Digraph
+        @params
+            'comment': Comment of the tree
+            'graph_attr': Attributes of the tree
+            'edge_attr': Default attributes of the edges
+            'node_attr': Default attributes of the nodes
+        """
+        self.comment = comment
+        self.graph_attr = dict(graph_attr or {})
+        self.edge_defaults = dict(edge_attr or {})
+        self.node_defaults = dict(node_attr or {})
+        self.initial_edge_attr = dict(self.edge_defaults)
+        self.initial_node_attr = dict(self.node_defaults)
+        # Nodes get the default attributes at the time they are first mentioned, like in Graphviz
+        self.nodes = OrderedDict()
+        self.edges = []
+        self.statements = []
+
+    def attr(self, kind, **attrs):
+        if kind == 'node':
+            self.node_defaults.update(attrs)
+        elif kind == 'edge':
+            self.edge_defaults.update(attrs)
+        else:
+            self.graph_attr.update(attrs)
+        self.statements.append(('attr', kind, attrs))
+
+    def node(self, name, label=None, **attrs):
+        if name not in self.nodes:
+            self.nodes[name] = dict(self.node_defaults)
+        self.nodes[name].update(attrs)
+        if label is not None:
+            self.nodes[name]['label'] = label
+        self.statements.append(('node', name, label, attrs))
+
+    def edge(self, tail, head, **attrs):
+        for name in [tail, head]:
+            if name not in self.nodes:
+                self.nodes[name] = dict(self.node_defaults)
+        self.edges.append((tail, head, {**self.edge_defaults, **attrs}))
+        self.statements.append(('edge', tail, head, attrs))
+
+    def to_digraph(self):
+        # Replays the recorded statements on a Graphviz Digraph
+        from graphviz import Digraph
+
+        graph = Digraph(
+            comment=self.comment,
+            graph_attr=self.graph_attr,
+            edge_attr=self.initial_edge_attr,
+            node_attr=self.initial_node_attr
+        )
+        for statement, *args in self.statements:
+            if statement == 'attr':
+                graph.attr(args[0], **args[1])
+            elif statement == 'node':
+                graph.node(args[0], args[1], **args[2])
+            else:
+                graph.edge(args[0], args[1], **args[2])
+        return graph
+
+
+def render(tree, path):
+    """Renders 'tree' as an SVG to 'path' + '.svg'
+    @params
+        'tree': The tree to render
+        'path': Path of the SVG without the '.svg' extension
+    """
+    if len(tree.nodes) <= MAX_LAYOUT_NODES:
+        render_svg(tree, path)
+    else:
+        render_graphviz(tree, path)
+
+
+def render_svg(tree, path):
+    # Renders 'tree' in-process. The SVG is written to a temporary file first
+    # so a partially written SVG is never served.
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, mode='w', encoding='utf-8') as f:
+        f.write(to_svg(tree))
+    os.replace(temp_path, f'{path}.svg')
+
+
+def render_graphviz(tree, path):
+    # Graphviz writes its source file next to the SVG, so a temporary path is used
+    # to keep concurrent renders of the same tree from removing each other's files
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    tree.to_digraph().render(temp_path, view=False, format='svg')
+    os.remove(temp_path)
+    os.replace(f'{temp_path}.svg', f'{path}.svg')
+
+
+def rank_nodes(count, edges):
+    """Assigns every node to a layer such that every edge points to a later layer
+    @params
+        'count': Number of nodes
+        'edges': List of (tail, head) node indices
+    Returns
+        List with the layer of every node
+    """
+    adjacency = [[] for _ in range(count)]
+    for tail, head in edges:
+        adjacency[tail].append(head)
+    # Depth first search to find a topological order, ignoring edges that close a cycle
+    state = [0] * count
+    order = []
+    acyclic = [[] for _ in range(count)]
+    for root in range(count):
+        if state[root]:
+            continue
+        state[root] = 1
+        stack = [(root, iter(adjacency[root]))]
+        while stack:
+            node, children = stack[-1]
+            for child in children:
+                if state[child] == 0:
+                    acyclic[node].append(child)
+                    state[child] = 1
+                    stack.append((child, iter(adjacency[child])))
+                    break
+                if state[child] == 2:
+                    acyclic[node].append(child)
+            else:
+                state[node] = 2
+                order.append(node)
+                stack.pop()
+    ranks = [0] * count
+    for node in reversed(order):
+        for child in acyclic[node]:
+            ranks[child] = max(ranks[child], ranks[node] + 1)
+    return ranks
+
+
+def order_layers(layers, neighbors, sweeps=4):
+    """Orders the nodes in every layer to reduce edge crossings using the barycenter heuristic
+    @params
+        'layers': List with the nodes of every layer
+        'neighbors': Function returning the neighbors of a node in the layer above (up=True)
+                     or below (up=False)
+        'sweeps': Number of sweeps down and up the layers
+    """
+    position = {node: i for layer in layers for i, node in enumerate(layer)}
+    for sweep in range(sweeps * 2):
+        up = sweep % 2 == 0
+        indices = range(1, len(layers)) if up else range(len(layers) - 2, -1, -1)
+        for i in indices:
+            def barycenter(node):
+                adjacent = neighbors(node, up)
+                if not adjacent:
+                    return position[node]
+                return sum(position[n] for n in adjacent) / len(adjacent)
+            layers[i].sort(key=barycenter)
+            for j, node in enumerate(layers[i]):
+                position[node] = j
+
+
+def svg_color(color):
+    # Converts Graphviz grey levels to SVG colors
+    match = re.fullmatch(r'gr[ae]y(\d+)', color)
+    if match:
+        level = round(int(match.group(1)) * 2.55)
+        return f'rgb({level},{level},{level})'
+    return color
+
+
+def marker(arrowhead, size):
+    """Creates the SVG marker of an arrowhead
+    @params
+        'arrowhead': Graphviz arrowhead name. Names starting with 'o' are drawn open.
+        'size': Scale of the arrowhead
+    Returns
+        Tuple with the id and the definition of the marker or (None, None) for no arrowhead
+    """
+    shape, open_shape = arrowhead, False
+    if shape not in ARROWHEAD_SHAPES and shape.startswith('o'):
+        shape, open_shape = shape[1:], True
+    if shape not in ARROWHEAD_SHAPES:
+        return None, None
+    fill = 'white' if open_shape else 'black'
+    marker_id = f'{arrowhead}-{size}'.replace('.', '_')
+    length = 10 * float(size)
+    return marker_id, (
+        f'<marker id="{marker_id}" viewBox="0 0 10 10" refX="10" refY="5" '
+        f'markerWidth="{length:g}" markerHeight="{length:g}" markerUnits="userSpaceOnUse" '
+        f'orient="auto"><g fill="{fill}" stroke="black">{ARROWHEAD_SHAPES[shape]}</g></marker>'
+    )
+
+
+def to_svg(tree):
+    """Lays out 'tree' in layers and draws it
+    @params
+        'tree': The tree to draw
+    Returns
+        String with the SVG of the tree
+    """
+    names = list(tree.nodes)
+    index = {name: i for i, name in enumerate(names)}
+    edges = [(index[tail], index[head], attrs) for tail, head, attrs in tree.edges if tail != head]
+    ranks = rank_nodes(len(names), [(tail, head) for tail, head, _ in edges])
+
+    # Edges spanning several layers go through a dummy node in every layer in between
+    count = len(names)
+    chains = []
+    for tail, head, attrs in edges:
+        reverse = ranks[tail] > ranks[head]
+        start, end = (head, tail) if reverse else (tail, head)
+        chain = [start]
+        for rank in range(ranks[start] + 1, ranks[end]):
+            ranks.append(rank)
+            chain.append(count)
+            count += 1
+        chain.append(end)
+        chains.append((chain[::-1] if reverse else chain, attrs))
+
+    above, below = [[] for _ in range(count)], [[] for _ in range(count)]
+    for chain, _ in chains:
+        for a, b in zip(chain, chain[1:]):
+            a, b = (a, b) if ranks[a] < ranks[b] else (b, a)
+            below[a].append(b)
+            above[b].append(a)
+    layers = [[] for _ in range(max(ranks) + 1 if ranks else 0)]
+    for node in range(count):
+        layers[ranks[node]].append(node)
+    order_layers(layers, lambda node, up: above[node] if up else below[node])
+
+    # Size of every node along the layer ('extent') and across layers ('depth')
+    rankdir = tree.graph_attr.get('rankdir', 'TB')
+    horizontal = rankdir in ['LR', 'RL']
+    widths = [
+        max(54, len(html.unescape(str(tree.nodes[name].get('label', name)))) * CHAR_WIDTH + 16)
+        for name in names
+    ] + [0] * (count - len(names))
+    heights = [NODE_HEIGHT] * len(names) + [0] * (count - len(names))
+    extent, depth = (heights, widths) if horizontal else (widths, heights)
+
+    layer_depths = [max((depth[node] for node in layer), default=0) for layer in layers]
+    layer_sizes = [
+        sum(extent[node] for node in layer) + NODE_SEPARATION * (len(layer) - 1) for layer in layers
+    ]
+    total_extent = max(layer_sizes, default=0)
+    total_depth = sum(layer_depths) + RANK_SEPARATION * (len(layers) - 1)
+    across, along = [0] * count, [0] * count
+    offset = 0
+    for i, layer in enumerate(layers):
+        position = (total_extent - layer_sizes[i]) / 2
+        for node in layer:
+            along[node] = position + extent[node] / 2
+            position += extent[node] + NODE_SEPARATION
+            across[node] = offset + layer_depths[i] / 2
+        offset += layer_depths[i] + RANK_SEPARATION
+    if rankdir in ['BT', 'RL']:
+        across = [total_depth - a for a in across]
+    # Convert layer coordinates to x and y
+    xs, ys = (across, along) if horizontal else (along, across)
+    xs = [x + MARGIN for x in xs]
+    ys = [y + MARGIN for y in ys]
+    width, height = (total_depth, total_extent) if horizontal else (total_extent, total_depth)
+    width, height = width + 2 * MARGIN, height + 2 * MARGIN
+
+    markers = {}
+    paths = []
+    for chain, attrs in chains:
+        points = []
+        for a, b in zip(chain, chain[1:]):
+            sign = 1 if (across[b] > across[a]) else -1
+            start = across[a] + sign * depth[a] / 2
+            end = across[b] - sign * depth[b] / 2
+            middle = (start + end) / 2
+            if horizontal:
+                points += [(start, ys[a]), (middle, ys[a]), (middle, ys[b]), (end, ys[b])]
+            else:
+                points += [(xs[a], start), (xs[a], middle), (xs[b], middle), (xs[b], end)]
+        if horizontal:
+            points = [(x + MARGIN, y) for x, y in points]
+        else:
+            points = [(x, y + MARGIN) for x, y in points]
+        d = 'M ' + ' L '.join(f'{x:.1f},{y:.1f}' for x, y in points)
+        marker_id, definition = marker(attrs.get('arrowhead', 'normal'), attrs.get('arrowsize', '1'))
+        end = ''
+        if marker_id:
+            markers[marker_id] = definition
+            end = f' marker-end="url(#{marker_id})"'
+        paths.append(f'<path d="{d}" fill="none" stroke="black"{end}/>')
+
+    nodes = []
+    for i, name in enumerate(names):
+        attrs = tree.nodes[name]
+        label = html.escape(html.unescape(str(attrs.get('label', name))))
+        fill = svg_color(attrs.get('fillcolor', attrs.get('color', 'lightgrey'))) \
+            if 'filled' in attrs.get('style', '') else 'none'
+        stroke = svg_color(attrs.get('color', 'black'))
+        if attrs.get('shape', 'ellipse') in ['rectangle', 'rect', 'box']:
+            shape = (
+                f'<rect x="{xs[i] - widths[i] / 2:.1f}" y="{ys[i] - heights[i] / 2:.1f}" '
+                f'width="{widths[i]:.1f}" height="{heights[i]:.1f}" fill="{fill}" stroke="{stroke}"/>'
+            )
+        else:
+            shape = (
+                f'<ellipse cx="{xs[i]:.1f}" cy="{ys[i]:.1f}" rx="{widths[i] / 2:.1f}" '
+                f'ry="{heights[i] / 2:.1f}" fill="{fill}" stroke="{stroke}"/>'
+            )
+        text = (
+            f'<text x="{xs[i]:.1f}" y="{ys[i] + FONT_SIZE / 3:.1f}" text-anchor="middle" '
+            f'font-family="{attrs.get("fontname", "helvetica")},sans-serif" '
+            f'font-size="{FONT_SIZE}">{label}</text>'
+        )
+        node = f'<g class="node"><title>{label}</title>{shape}{text}</g>'
+        if 'URL' in attrs:
+            url = html.escape(html.unescape(attrs['URL']))
+            target = html.escape(attrs.get('target', '_self'))
+            node = f'<a href="{url}" xlink:href="{url}" target="{target}">{node}</a>'
+        nodes.append(node)
+
+    return '\n'.join([
+        '<?xml version="1.0" encoding="UTF-8" standalone="no"?>',
+        f'<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink" '
+        f'width="{width:.0f}pt" height="{height:.0f}pt" viewBox="0 0 {width:.1f} {height:.1f}">',
+        f'<title>{html.escape(tree.comment)}</title>',
+        f'<defs>{"".join(markers.values())}</defs>',
+        '<g class="edges">', *paths, '</g>',
+        '<g class="nodes">', *nodes, '</g>',
+        '</svg>',
+    ])
@@ -0,0 +1,18 @@
+"""
+Alex Eidt
+
+Shared setup of the tests. The modules are imported from the repository root and 'uwtools'
+is replaced by an empty module when it is not installed, so tests never scrape UW.
+Tests needing data from 'uwtools' set its functions with 'monkeypatch'.
+"""
+
+import os
+import sys
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import uwtools
+except ImportError:
+    sys.modules['uwtools'] = types.ModuleType('uwtools')
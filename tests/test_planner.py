@@ -0,0 +1,58 @@
+"""
+Alex Eidt
+
+Tests planning courses with cycles and interchangeable co-requisites in the Prerequisite Graph.
+"""
+
+import pandas as pd
+
+from planner import make_plan
+from prereq_graph import PrereqGraph
+
+
+def graph(requisites):
+    # Prerequisite Graph of courses given as {course: (prerequisites, co-requisites)}
+    rows = {
+        course: {
+            'Campus': 'Seattle', 'Department Name': course.rstrip('0123456789'),
+            'Prerequisites': prerequisites, 'Co-Requisites': corequisites, 'Credits': '5',
+        }
+        for course, (prerequisites, corequisites) in requisites.items()
+    }
+    return PrereqGraph(pd.DataFrame.from_dict(rows, orient='index'))
+
+
+def quarters(plan):
+    return {course: i for i, term in enumerate(plan['plan'], 1) for course in term['courses']}
+
+
+def test_cycle_does_not_depend_on_target_order():
+    g = graph({'X100': ('X101/X102', ''), 'X101': ('X100', ''), 'X102': ('', '')})
+    for targets in (['X100', 'X101'], ['X101', 'X100']):
+        plan = make_plan(g, targets, start=('AUT', 2026))
+        assert quarters(plan) == {'X102': 1, 'X100': 2, 'X101': 3}
+        assert plan['unschedulable'] == []
+
+
+def test_cycles_are_unschedulable():
+    g = graph({'Y100': ('Z100', ''), 'Z100': ('Y100', ''), 'A100': ('', 'B100'), 'B100': ('', 'A100')})
+    plan = make_plan(g, ['Y100', 'A100'], start=('AUT', 2026))
+    assert plan['unschedulable'] == ['Y100']
+    assert quarters(plan) == {'A100': 1, 'B100': 1}
+
+
+def test_cycle_limited_by_max_quarters():
+    # A long chain of courses on a cycle is given up after 'max_quarters' rounds
+    requisites = {f'C{100 + i}': (f'C{99 + i}', '') for i in range(1, 300)}
+    requisites['C100'] = ('C399', '')
+    plan = make_plan(graph(requisites), ['C399'], start=('AUT', 2026), max_quarters=4)
+    assert plan['unschedulable'] == ['C399']
+
+
+def test_corequisite_falls_back_to_offered_option():
+    g = graph({'A100': ('', 'B100/B101'), 'B100': ('', ''), 'B101': ('', '')})
+    offerings = {'AUT': {'A100', 'B101'}, 'WIN': {'A100', 'B100', 'B101'}}
+    plan = make_plan(g, ['A100'], start=('AUT', 2026), offerings=offerings)
+    # The option chosen first is not taken once another option satisfies the group
+    assert quarters(plan) == {'A100': 1, 'B101': 1}
+    assert plan['unplanned'] == [] and plan['unschedulable'] == []
@@ -0,0 +1,168 @@
+"""
+Alex Eidt
+
+Tests publishing new versions of the data files and loading them in the background, with
+the data of 'uwtools' replaced by small local data.
+"""
+
+import json
+import os
+import time
+
+import pandas as pd
+import pytest
+import uwtools
+
+from refresh import Refresher, Watcher
+from schedule_store import LOAD_ERRORS, ScheduleStore
+
+
+def section(course, section_type, section, days, time):
+    # Section as scraped by 'uwtools.time_schedules'
+    return {
+        'Course Name': course,
+        'Type': section_type,
+        'Section': section,
+        'Building': 'MGH',
+        'Days': days,
+        'Room Number': '101',
+        'Seats': '10/40',
+        'Time': time,
+    }
+
+
+def time_schedules(courses):
+    # Replacement of 'uwtools.time_schedules' returning one lecture with a quiz per course
+    def scrape(year, quarter, json_ready=True, struct='dict'):
+        return [
+            row for course, time in courses.items()
+            for row in [section(course, 'LECT', 'A', 'MWF', time), section(course, 'QZ', 'AA', 'Th', '830-920')]
+        ]
+    return scrape
+
+
+def wait(watcher):
+    # Waits for the background thread of a Watcher to finish loading
+    deadline = time.monotonic() + 10
+    while watcher.loading and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert not watcher.loading
+
+
+@pytest.fixture
+def static(tmp_path, monkeypatch):
+    # 'main' in schedule.py writes to the 'static' directory of the working directory
+    monkeypatch.chdir(tmp_path)
+    static = tmp_path / 'static'
+    static.mkdir()
+    return static
+
+
+def test_publish(static, monkeypatch):
+    monkeypatch.setattr(uwtools, 'course_catalogs', lambda: pd.DataFrame({'Course Name': ['EE235']}), raising=False)
+    refresher = Refresher(str(static), max_versions=2)
+    versions = [
+        refresher.publish('Course_Catalogs.csv', lambda file_path: uwtools.course_catalogs().to_csv(file_path))
+        for _ in range(3)
+    ]
+    assert list(pd.read_csv(static / 'Course_Catalogs.csv')['Course Name']) == ['EE235']
+    # Only the newest versions are kept and the data file is the newest version
+    assert sorted(os.listdir(static / 'versions')) == [os.path.basename(version) for version in versions[1:]]
+    assert os.path.samefile(static / 'Course_Catalogs.csv', os.path.join(versions[-1], 'Course_Catalogs.csv'))
+    assert [entry for entry in os.listdir(static) if entry.endswith('.tmp')] == []
+
+
+def test_publish_keeps_open_readers(static):
+    refresher = Refresher(str(static))
+    refresher.publish('data.txt', lambda file_path: open(file_path, mode='w').write('old'))
+    with open(static / 'data.txt', mode='r') as f:
+        refresher.publish('data.txt', lambda file_path: open(file_path, mode='w').write('new'))
+        assert f.read() == 'old'
+    assert (static / 'data.txt').read_text() == 'new'
+
+
+def test_watcher_hot_swap(static):
+    file_path = static / 'data.txt'
+    file_path.write_text('old')
+    loaded = [file_path.read_text()]
+    watcher = Watcher(str(file_path), lambda: loaded.append(file_path.read_text()), interval=0)
+
+    watcher.check()
+    wait(watcher)
+    assert loaded == ['old']
+
+    Refresher(str(static)).publish('data.txt', lambda version_path: open(version_path, mode='w').write('newer'))
+    watcher.check()
+    wait(watcher)
+    assert loaded == ['old', 'newer']
+    # Loaded versions are not loaded again
+    watcher.check()
+    wait(watcher)
+    assert loaded == ['old', 'newer']
+
+
+def test_watcher_keeps_data_on_failure(static, capsys):
+    file_path = static / 'data.txt'
+    file_path.write_text('old')
+    loaded = []
+
+    def load():
+        if file_path.read_text() == 'broken':
+            raise ValueError('broken data file')
+        loaded.append(file_path.read_text())
+
+    watcher = Watcher(str(file_path), load, interval=0)
+    file_path.write_text('broken')
+    watcher.check()
+    wait(watcher)
+    assert loaded == []
+    assert 'broken data file' in capsys.readouterr().err
+
+    file_path.write_text('fixed!')
+    watcher.check()
+    wait(watcher)
+    assert loaded == ['fixed!']
+
+
+def test_refresh_time_schedules(static, monkeypatch):
+    monkeypatch.setattr(uwtools, 'time_schedules', time_schedules({'EE235': '1030-1120'}), raising=False)
+    refresher = Refresher(str(static))
+    store = ScheduleStore(str(static))
+    store.refresh(2026, 'AUT', refresher.publish)
+
+    current = store.get()
+    assert set(current.courses) == {'EE235'}
+    assert store.get(2026, 'AUT').version == store.version(2026, 'AUT')
+    versions = os.listdir(static / 'versions')
+    assert sorted(
+        name for version in versions for name in os.listdir(static / 'versions' / version)
+    ) == ['Time_Schedules', 'Time_Schedules.json']
+    assert json.loads((static / 'Time_Schedules' / '2026AUT.json').read_text()) == current.courses
+
+    # A refresh without changes writes no new versions
+    store.refresh(2026, 'AUT', refresher.publish)
+    assert sorted(os.listdir(static / 'versions')) == sorted(versions)
+
+    # Another worker publishes a new Time Schedule. It is loaded in the background and the
+    # previous one is served until then.
+    monkeypatch.setattr(uwtools, 'time_schedules', time_schedules({'EE235': '1030-1120', 'EE233': '130-220'}))
+    ScheduleStore(str(static)).refresh(2026, 'AUT', refresher.publish)
+    store.watchers[(None, None)].interval = 0
+    assert store.get() is current
+    wait(store.watchers[(None, None)])
+    assert set(store.get().courses) == {'EE235', 'EE233'}
+    assert store.get().version == store.version()
+
+
+def test_schedule_store_rejects_bad_quarters(static):
+    store = ScheduleStore(str(static))
+    (static / 'Time_Schedules').mkdir()
+    (static / 'Time_Schedules' / '2026WIN.json').write_text('{"EE235": ')
+    (static / 'Time_Schedules' / '2026SPR.json').write_text('[]')
+    for year, quarter in [(2026, '/../../x'), ('../2026', 'AUT'), (26, 'AUT'), (2026, 'FALL')]:
+        with pytest.raises(ValueError):
+            store.file_path(year, quarter)
+    # Quarters without a Time Schedule or with one that cannot be parsed are all load errors
+    for quarter in ['AUT', 'WIN', 'SPR', '../x']:
+        with pytest.raises(LOAD_ERRORS):
+            store.get(2026, quarter)
@@ -0,0 +1,127 @@
+"""
+Alex Eidt
+
+Compares the section times of 'get_minutes' and 'get_section_meetings' with the times
+read by the previous 'has_overlap' on generated time ranges.
+"""
+
+import random
+from functools import lru_cache
+
+import pytest
+
+import schedule
+from schedule import DAYS, convert, convert_pm, check_pm, get_minutes, get_section_meetings, get_time
+
+# Every h:mm-h:mm range of the Time Schedule in 5 minute steps, with and without 'P'
+TIMES = [f'{hour}{minute:02}' for hour in range(1, 13) for minute in range(0, 60, 5)]
+RANGES = [f'{start}-{end}{pm}' for start in TIMES for end in TIMES for pm in ('', 'P')]
+
+
+@lru_cache(maxsize=None)
+def old_minutes(time):
+    # Start and end of a time range in minutes as read by 'has_overlap'
+    pm = 'P' in time
+    minutes = []
+    for t in time.replace('P', '', 1).split('-', 1):
+        hour, minute = get_time(t)
+        t = f'{hour}:{minute}{check_pm(pm)}'
+        hours, minutes_, _ = convert(convert_pm(t, t.rsplit(' ', 1))).split(':')
+        minutes.append(int(hours) * 60 + int(minutes_))
+    return tuple(minutes)
+
+
+def overlaps(first, second):
+    return first[0] <= second[1] and second[0] <= first[1]
+
+
+def test_ranges_are_ordered_and_inside_the_day():
+    for time in RANGES:
+        start, end = get_minutes(time)
+        assert 0 <= start <= end <= 24 * 60, time
+
+
+def changed(time, old):
+    # Ranges 'has_overlap' read differently. Noon starts were read as midnight, ranges could
+    # end before they start, 6:30 to 6:55 without 'P' was read as the morning although UW
+    # classes start at 7:00 AM and late evening times with 'P' were switched to the morning.
+    return (
+        time.startswith('12') or old[0] > old[1] or 6 * 60 + 30 <= old[0] < 7 * 60 or
+        (time.endswith('P') and old[0] < 12 * 60)
+    )
+
+
+def test_ranges_match_has_overlap():
+    differences = [time for time in RANGES if get_minutes(time) != old_minutes(time)]
+    for time in differences:
+        assert changed(time, old_minutes(time)), time
+    assert any(time.startswith('12') for time in differences)
+
+
+@pytest.mark.parametrize('time, minutes', [
+    ('1200-1250', (720, 770)),
+    ('1230-120', (750, 800)),
+    ('1130-1220', (690, 740)),
+    ('1130-120P', (690, 800)),
+    ('1030-630', (630, 1110)),
+    ('830-920', (510, 560)),
+    ('130-220', (810, 860)),
+    ('630-920P', (1110, 1280)),
+    ('645-735', (1125, 1175)),
+    ('1030-1120P', (1350, 1400)),
+])
+def test_noon_and_afternoon(time, minutes):
+    assert get_minutes(time) == minutes
+
+
+def test_noon_starts_differ_from_has_overlap():
+    # 'has_overlap' read '1200-1250' as starting at midnight, overlapping morning sections
+    assert schedule.has_overlap('1200-1250', '830-920')
+    assert not overlaps(get_minutes('1200-1250'), get_minutes('830-920'))
+    assert overlaps(get_minutes('1200-1250'), get_minutes('1230-120'))
+    # Late evening sections were switched to the morning
+    assert schedule.has_overlap('1100-1150P', '1100-1150')
+    assert not overlaps(get_minutes('1100-1150P'), get_minutes('1100-1150'))
+
+
+def test_overlap_matches_has_overlap():
+    generator = random.Random(17)
+    unchanged = [time for time in RANGES if get_minutes(time) == old_minutes(time)]
+    for _ in range(2000):
+        first, second = generator.sample(unchanged, 2)
+        old = schedule.has_overlap(first, second) or schedule.has_overlap(second, first)
+        assert overlaps(get_minutes(first), get_minutes(second)) == old, (first, second)
+
+
+@pytest.mark.parametrize('time', ['to be arranged', '*', '', '1030', '10:30-11:20', '12345-1300'])
+def test_not_a_range(time):
+    assert get_minutes(time) is None
+
+
+def test_section_meetings():
+    generator = random.Random(18)
+    unchanged = [time for time in RANGES if get_minutes(time) == old_minutes(time)]
+    for _ in range(500):
+        rows = generator.randint(1, 3)
+        days = [''.join(generator.sample(DAYS, generator.randint(1, 3))) for _ in range(rows)]
+        times = [generator.choice(unchanged + ['to be arranged']) for _ in range(rows)]
+        buildings = [f'B{i}' for i in range(rows)]
+        meetings = get_section_meetings({'Days': days, 'Time': times, 'Building': buildings})
+
+        expected = sorted(
+            (day, *old_minutes(time), building)
+            for offered, time, building in zip(days, times, buildings) if time != 'to be arranged'
+            for day in schedule.get_days(offered)
+        )
+        assert sorted(map(tuple, meetings)) == expected
+        for row in zip(days, times, buildings):
+            row_meetings = [m for m in meetings if m[3] == row[2]]
+            assert [m[0] for m in row_meetings] == sorted((m[0] for m in row_meetings), key=DAYS.index)
+        for _, start, end, _ in meetings:
+            assert 0 <= start <= end <= 24 * 60
+
+
+def test_section_meetings_stored():
+    meetings = [['M', 510, 560, 'MGH']]
+    section = {'Meetings': meetings, 'Days': ['TTh'], 'Time': ['1200-1250'], 'Building': ['EEB']}
+    assert get_section_meetings(section) is meetings
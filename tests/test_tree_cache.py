@@ -0,0 +1,22 @@
+"""
+Alex Eidt
+
+Tests the Prerequisite Tree cache shared by the workers.
+"""
+
+from tree_cache import TreeCache
+
+
+def test_evicted_by_another_worker(tmp_path):
+    cache, other = TreeCache(str(tmp_path), '/tree'), TreeCache(str(tmp_path), '/tree')
+    key = TreeCache.key('tree', 'CSE143', 'v1')
+    (tmp_path / f'{key}.svg').write_text('<svg/>')
+    assert cache.add(key) == other.get(key) == f'/tree/{key}.svg'
+
+    # The other worker evicts the SVG, so it is no longer served and is rendered again
+    other.clear()
+    assert cache.get(key) is None
+    assert key not in cache.index and cache.size == 0
+    (tmp_path / f'{key}.svg').write_text('<svg/>')
+    assert cache.get(key) == f'/tree/{key}.svg'
+    assert cache.size == len('<svg/>')
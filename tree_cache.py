@@ -0,0 +1,120 @@
+"""
+Alex Eidt
+
+Bounded cache for the rendered Prerequisite Tree SVGs.
+
+Every SVG is stored under a key derived from what was drawn, the version of the Course
+Catalogs and the render options, so trees from an older catalog are never served. An
+in-memory index keeps track of the cached files in least recently used order.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+
+class TreeCache:
+    def __init__(self, path, url_path, max_files=20000, max_bytes=1024 * 1024 * 1024):
+        """Indexes the SVGs already cached in 'path'
+        @params
+            'path': Directory the SVGs are stored in
+            'url_path': Path the SVGs are served from
+            'max_files': Maximum number of SVGs kept on disk
+            'max_bytes': Maximum total size of the SVGs kept on disk
+        """
+        self.path = path
+        self.url_path = url_path
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.index = OrderedDict()
+        self.size = 0
+        os.makedirs(path, exist_ok=True)
+        entries = sorted(
+            (entry for entry in os.scandir(path) if entry.name.endswith('.svg')),
+            key=lambda entry: entry.stat().st_mtime
+        )
+        for entry in entries:
+            self.index[entry.name[:-len('.svg')]] = entry.stat().st_size
+            self.size += entry.stat().st_size
+        with self.lock:
+            self.evict()
+
+    @staticmethod
+    def key(*parts, **options):
+        """Creates the cache key of a tree
+        @params
+            'parts': What the tree shows and the version of the Course Catalogs
+            'options': Render options of the tree
+        Returns
+            Hexadecimal key used as the file name of the SVG
+        """
+        data = json.dumps([parts, sorted(options.items())], default=str)
+        return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+    def file_path(self, key):
+        # Path of the SVG on disk without the '.svg' extension, as expected by Graphviz
+        return os.path.join(self.path, key)
+
+    def url(self, key):
+        return os.path.join(self.url_path, f'{key}.svg')
+
+    def get(self, key):
+        """Finds a cached SVG
+        @params
+            'key': Cache key of the tree
+        Returns
+            URL of the SVG or None if it is not cached
+        """
+        if not os.path.isfile(f'{self.file_path(key)}.svg'):
+            # The SVG may have been evicted by another worker, so it is rendered again
+            with self.lock:
+                self.size -= self.index.pop(key, 0)
+            return None
+        with self.lock:
+            if key in self.index:
+                self.index.move_to_end(key)
+                return self.url(key)
+        # The SVG may have been rendered by another worker
+        return self.add(key)
+
+    def add(self, key):
+        """Adds a rendered SVG to the cache, evicting the least recently used SVGs if
+        the cache is full
+        @params
+            'key': Cache key of the tree rendered to 'file_path(key)' + '.svg'
+        Returns
+            URL of the SVG
+        """
+        size = os.path.getsize(f'{self.file_path(key)}.svg')
+        with self.lock:
+            self.size += size - self.index.pop(key, 0)
+            self.index[key] = size
+            self.evict(keep=key)
+        return self.url(key)
+
+    def evict(self, keep=None):
+        # Removes the least recently used SVGs until the cache is within its limits
+        while len(self.index) > self.max_files or self.size > self.max_bytes:
+            key = next(iter(self.index))
+            if key == keep:
+                break
+            self.size -= self.index.pop(key)
+            try:
+                os.remove(f'{self.file_path(key)}.svg')
+            except FileNotFoundError:
+                pass
+
+    def clear(self):
+        # Removes every cached SVG, including those of other workers
+        with self.lock:
+            for entry in os.scandir(self.path):
+                if entry.name.endswith('.svg'):
+                    try:
+                        os.remove(entry.path)
+                    except FileNotFoundError:
+                        pass
+            self.index.clear()
+            self.size = 0